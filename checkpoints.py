@@ -0,0 +1,191 @@
+"""
+Checkpoints of the shapefiles of a preprocessing run so that a rerun (e.g., after a crash) skips the shapefiles
+that have already been imported. The FileSetupCheckpoints table keeps, next to the FileSetup record of the run,
+one record per shapefile in import order (drain points before road lines): its status, a hash of the
+shapefile content, a hash of how it is imported (field matches and drain type or road network) and the
+GRAIPDID/GRAIPRID range of its records. A rerun skips the shapefiles that were committed and have not changed
+and imports the changed shapefiles again incrementally (see ImportEngine.update_drain_points()); the records
+of the shapefiles that are no longer in the run are deleted.
+"""
+
+import hashlib
+import json
+import os
+
+import core
+import graip_db
+import import_engine
+
+CHECKPOINTS_TABLE_NAME = "FileSetupCheckpoints"
+
+STATUS_PENDING = 'Pending'
+STATUS_IMPORTING = 'Importing'
+STATUS_COMMITTED = 'Committed'
+# imported by a previous run but changed since (or its import did not finish)
+STATUS_CHANGED = 'Changed'
+
+# size of the blocks in which shapefiles are read for hashing
+HASH_BLOCK_SIZE = 1024 * 1024
+# shapefile parts hashed - the geometries and the attributes
+HASHED_FILE_EXTENSIONS = ('.shp', '.dbf')
+
+
+class Checkpoint(object):
+    def __init__(self, file_order, shp_type, shp_file, file_hash=None, mapping_hash=None, status=STATUS_PENDING,
+                 first_id=None, last_id=None):
+        self.file_order = file_order
+        self.shp_type = shp_type
+        self.shp_file = shp_file
+        self.file_hash = file_hash
+        self.mapping_hash = mapping_hash
+        self.status = status
+        self.first_id = first_id
+        self.last_id = last_id
+
+    @property
+    def is_committed(self):
+        return self.status == STATUS_COMMITTED
+
+    @property
+    def is_imported(self):
+        # the shapefile has records from a previous run
+        return self.first_id is not None
+
+
+def get_file_hash(shp_file):
+    """
+    Returns the hash of the content of a shapefile (the .shp and .dbf files)
+    """
+    file_hash = hashlib.sha1()
+    shp_file_wo_ext = os.path.splitext(shp_file)[0]
+    for file_ext in HASHED_FILE_EXTENSIONS:
+        with open(shp_file_wo_ext + file_ext, 'rb') as file_obj:
+            block = file_obj.read(HASH_BLOCK_SIZE)
+            while block:
+                file_hash.update(block)
+                block = file_obj.read(HASH_BLOCK_SIZE)
+    return file_hash.hexdigest()
+
+
+def get_mapping_hash(spec):
+    """
+    Returns the hash of how the shapefile of spec (import_engine.ShapefileImportSpec) is imported
+    """
+    mapping = [spec.shp_type, spec.field_matches, spec.drain_type_name, spec.road_network_name]
+    return hashlib.sha1(json.dumps(mapping)).hexdigest()
+
+
+def restore_checkpoints(db_session, shp_files):
+    """
+    Prepares the database for importing shp_files, the list of (shapefile type, shapefile) pairs of the run in
+    import order. The records of the shapefiles imported by the previous run are kept - the shapefiles are
+    marked committed if they have not changed since and changed otherwise; all other drain point and road line
+    records are deleted. If drain point shapefiles of the previous run are no longer in the run, the road line
+    shapefiles need to be linked to the drain points again and their mapping hash is cleared.
+    Returns a dict of (shapefile type, shapefile) -> Checkpoint for all shapefiles of the run.
+    """
+    cursor = db_session.cursor()
+    graip_db.create_missing_tables(cursor, (CHECKPOINTS_TABLE_NAME, import_engine.IMPORTED_FEATURES_TABLE_NAME))
+    rows = cursor.execute("SELECT * FROM {} ORDER BY FileOrder".format(CHECKPOINTS_TABLE_NAME)).fetchall()
+    previous_rows = dict(((row.ShpType, row.ShpFile), row) for row in rows)
+    sql_select = "SELECT ShpType, ShpFile, MIN(RecordID) AS FirstID, MAX(RecordID) AS LastID FROM {} " \
+                 "GROUP BY ShpType, ShpFile".format(import_engine.IMPORTED_FEATURES_TABLE_NAME)
+    imported_ranges = dict(((row.ShpType, row.ShpFile), (row.FirstID, row.LastID))
+                           for row in cursor.execute(sql_select).fetchall())
+    checkpoints = []
+    for shp_type, shp_file in shp_files:
+        checkpoint = Checkpoint(len(checkpoints), shp_type, shp_file)
+        row = previous_rows.get((shp_type, shp_file), None)
+        if row is not None and (shp_type, shp_file) in imported_ranges and os.path.isfile(shp_file):
+            checkpoint.file_hash = row.FileHash
+            checkpoint.mapping_hash = row.MappingHash
+            checkpoint.first_id, checkpoint.last_id = imported_ranges[(shp_type, shp_file)]
+            if row.Status == STATUS_COMMITTED and row.FileHash == get_file_hash(shp_file):
+                checkpoint.status = STATUS_COMMITTED
+            else:
+                checkpoint.status = STATUS_CHANGED
+        checkpoints.append(checkpoint)
+
+    # delete the records of the shapefiles that are not kept
+    kept_files = set((checkpoint.shp_type, checkpoint.shp_file) for checkpoint in checkpoints
+                     if checkpoint.is_imported)
+    if not kept_files:
+        core.clear_data_tables(db_session)
+        cursor.execute("DELETE FROM {}".format(import_engine.IMPORTED_FEATURES_TABLE_NAME))
+    else:
+        dropped_files = [imported_file for imported_file in imported_ranges if imported_file not in kept_files]
+        sql_delete = "DELETE FROM {} WHERE ShpType=? AND ShpFile=?".format(import_engine.IMPORTED_FEATURES_TABLE_NAME)
+        for shp_type, shp_file in dropped_files:
+            cursor.execute(sql_delete, shp_type, shp_file)
+        # this also deletes any records that were not imported with feature tracking
+        _delete_untracked_records(cursor, "DrainPoints", "GRAIPDID", 'DP')
+        for row in cursor.execute("SELECT TableName FROM DrainTypeDefinitions").fetchall():
+            _delete_untracked_records(cursor, row.TableName, "GRAIPDID", 'DP')
+        _delete_untracked_records(cursor, "RoadLines", "GRAIPRID", 'RD')
+        if any(shp_type == 'DP' for shp_type, _ in dropped_files):
+            for checkpoint in checkpoints:
+                if checkpoint.shp_type == 'RD':
+                    checkpoint.mapping_hash = None
+
+    cursor.execute("DELETE FROM {}".format(CHECKPOINTS_TABLE_NAME))
+    sql_insert = "INSERT INTO {} (FileOrder, ShpType, ShpFile, FileHash, MappingHash, Status, FirstID, LastID) " \
+                 "VALUES (?,?,?,?,?,?,?,?)".format(CHECKPOINTS_TABLE_NAME)
+    cursor.executemany(sql_insert, [(checkpoint.file_order, checkpoint.shp_type, checkpoint.shp_file,
+                                     checkpoint.file_hash, checkpoint.mapping_hash, checkpoint.status,
+                                     checkpoint.first_id, checkpoint.last_id) for checkpoint in checkpoints])
+    db_session.commit()
+    return dict(((checkpoint.shp_type, checkpoint.shp_file), checkpoint) for checkpoint in checkpoints)
+
+
+def start_import(db_session, checkpoint):
+    """
+    Records that the shapefile of checkpoint is being imported
+    """
+    checkpoint.status = STATUS_IMPORTING
+    db_session.cursor().execute("UPDATE {} SET Status=? WHERE FileOrder=?".format(CHECKPOINTS_TABLE_NAME),
+                                checkpoint.status, checkpoint.file_order)
+    db_session.commit()
+
+
+def commit_import(db_session, checkpoint, spec, first_id, last_id):
+    """
+    Records that the shapefile of checkpoint has been imported with spec (import_engine.ShapefileImportSpec) to
+    the records first_id to last_id
+    """
+    checkpoint.file_hash = get_file_hash(spec.shp_file)
+    checkpoint.mapping_hash = get_mapping_hash(spec)
+    checkpoint.status = STATUS_COMMITTED
+    checkpoint.first_id = first_id
+    checkpoint.last_id = last_id
+    db_session.cursor().execute("UPDATE {} SET FileHash=?, MappingHash=?, Status=?, FirstID=?, LastID=? "
+                                "WHERE FileOrder=?".format(CHECKPOINTS_TABLE_NAME), checkpoint.file_hash,
+                                checkpoint.mapping_hash, checkpoint.status, first_id, last_id, checkpoint.file_order)
+    db_session.commit()
+
+
+def get_import_call(engine, checkpoint, spec, is_dp_changed=False):
+    """
+    Returns the ImportEngine method and its arguments for importing the shapefile of checkpoint with spec
+    (import_engine.ShapefileImportSpec), or None if the shapefile was imported the same way before and has not
+    changed since. A shapefile imported before is imported again incrementally; all its features are written
+    again if its field matches changed or, for road lines, if drain point records have been written by the
+    run (is_dp_changed) so that the road lines are linked to the drain points again.
+    """
+    is_mapping_changed = checkpoint.mapping_hash != get_mapping_hash(spec)
+    is_relink_needed = spec.shp_type == 'RD' and is_dp_changed
+    if checkpoint.is_committed and not is_mapping_changed and not is_relink_needed:
+        return None
+
+    is_forced = is_mapping_changed or is_relink_needed
+    if spec.shp_type == 'DP':
+        if checkpoint.is_imported:
+            return engine.update_drain_points, (spec, is_forced)
+        return engine.import_drain_points, (spec,)
+    if checkpoint.is_imported:
+        return engine.update_road_lines, (spec, is_forced)
+    return engine.import_road_lines, (spec,)
+
+
+def _delete_untracked_records(cursor, table_name, id_field_name, shp_type):
+    cursor.execute("DELETE FROM {} WHERE {} NOT IN (SELECT RecordID FROM {} WHERE ShpType=?)".format(
+        table_name, id_field_name, import_engine.IMPORTED_FEATURES_TABLE_NAME), shp_type)
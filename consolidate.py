@@ -0,0 +1,235 @@
+"""
+Headless consolidation of the imported shapefiles: the drain point shapefiles are copied into one
+DrainPoints layer and the road line shapefiles into one RoadLines layer in the working directory, either as
+shapefiles (DrainPoints.shp, RoadLines.shp) or as GeoPackages (DrainPoints.gpkg, RoadLines.gpkg). Features
+get the GRAIPDID/GRAIPRID of their database record from the ImportedFeatures table and consolidation fails for a
+feature that is not in it. Without a database session or feature tracking, features are numbered in the order
+the shapefiles were imported, which is how the ids are assigned to the records of a database imported in one go.
+"""
+
+import os
+
+from osgeo import ogr, osr
+
+import core
+import graip_db
+import import_engine
+
+SHAPEFILE_FORMAT = 'shp'
+GEOPACKAGE_FORMAT = 'gpkg'
+OUTPUT_FORMATS = (SHAPEFILE_FORMAT, GEOPACKAGE_FORMAT)
+
+
+class ConsolidationEngine(object):
+    """
+    Writes the consolidated drain points and road lines layers. The layers get the spatial reference of the
+    first imported shapefile; features of shapefiles in another spatial reference are reprojected. Features
+    are written in OGR transactions of TRANSACTION_SIZE features and the layers are spatially indexed.
+    With include_attributes the fields of the DrainPoints/RoadLines table in the database (db_session) are
+    written to the layers as well, so that they can be used without joining back to the database (see
+    get_field_names() for the names of the fields in shapefiles).
+    progress_callback(layer_name, count_done, count_total) is called at most max_progress_rate times per
+    second and once more when a layer is complete.
+    """
+    # number of features written per OGR transaction
+    TRANSACTION_SIZE = 1000
+
+    def __init__(self, working_directory, progress_callback=None, max_progress_rate=10,
+                 output_format=SHAPEFILE_FORMAT, db_session=None, include_attributes=False):
+        if output_format not in OUTPUT_FORMATS:
+            raise Exception("{} is not a valid output format for consolidated files.".format(output_format))
+        if include_attributes and db_session is None:
+            raise Exception("Database session is required for writing database attributes to consolidated files.")
+
+        self.working_directory = working_directory
+        self.progress_callback = progress_callback
+        self.max_progress_rate = max_progress_rate
+        self.output_format = output_format
+        self.db_session = db_session
+        self.include_attributes = include_attributes
+        # layer name -> {column name: field name} of the fields of the consolidated layers written
+        self.field_names = {}
+
+    def run(self, dp_shp_files, rd_shp_files):
+        self.consolidate_drain_points(dp_shp_files)
+        self.consolidate_road_lines(rd_shp_files)
+
+    def consolidate_drain_points(self, dp_shp_files):
+        """
+        Returns the number of drain points written to the DrainPoints layer
+        """
+        return self._consolidate(dp_shp_files, "DrainPoints", "GRAIPDID", ogr.wkbPoint, 'DP')
+
+    def consolidate_road_lines(self, rd_shp_files):
+        """
+        Returns the number of road lines written to the RoadLines layer
+        """
+        return self._consolidate(rd_shp_files, "RoadLines", "GRAIPRID", ogr.wkbLineString, 'RD')
+
+    def get_consolidated_file(self, layer_name):
+        return os.path.join(self.working_directory, "{}.{}".format(layer_name, self.output_format))
+
+    def get_field_names(self, layer_name):
+        """
+        Returns the name of the field of the consolidated layer for each database column written to it. The
+        names differ from the column names in shapefiles, where field names have at most 10 characters.
+        """
+        return self.field_names[layer_name]
+
+    def _consolidate(self, shp_files, layer_name, id_field_name, geometry_type, shp_type):
+        shp_driver = ogr.GetDriverByName(core.GDALFileDriver.ShapeFile())
+        if self.output_format == GEOPACKAGE_FORMAT:
+            driver = ogr.GetDriverByName(core.GDALFileDriver.GeoPackage())
+            layer_options = ["SPATIAL_INDEX=YES"]
+        else:
+            driver = shp_driver
+            layer_options = []
+        consolidated_file = self.get_consolidated_file(layer_name)
+        if os.path.exists(consolidated_file):
+            driver.DeleteDataSource(consolidated_file)
+
+        data_sources = [shp_driver.Open(shp_file, 0) for shp_file in shp_files]
+        count_total = sum(data_source.GetLayer(0).GetFeatureCount() for data_source in data_sources)
+        progress = core.ProgressThrottle(self._get_layer_progress_callback(layer_name), count_total,
+                                         max_rate=self.max_progress_rate)
+
+        # the consolidated layer uses the spatial reference of the first shapefile that has one
+        srs = None
+        for data_source in data_sources:
+            srs = data_source.GetLayer(0).GetSpatialRef()
+            if srs is not None:
+                srs = srs.Clone()
+                break
+        if srs is None:
+            srs = osr.SpatialReference()
+
+        # create the data source and the layer
+        consolidated_data_source = driver.CreateDataSource(consolidated_file)
+        consolidated_layer = consolidated_data_source.CreateLayer(layer_name, srs, geometry_type,
+                                                                  options=layer_options)
+        # Add the id field (GRAIPDID or GRAIPRID)
+        consolidated_layer.CreateField(ogr.FieldDefn(id_field_name, ogr.OFTInteger))
+        attribute_fields, attribute_rows = self._create_attribute_fields(consolidated_layer, layer_name,
+                                                                         id_field_name)
+        layer_definition = consolidated_layer.GetLayerDefn()
+
+        # the features are numbered in order only if no shapefile was imported with feature tracking - otherwise
+        # the numbers could be ids of other records
+        is_tracked = self._is_tracked(shp_type)
+        feature_count = 0
+        consolidated_layer.StartTransaction()
+        for shp_file, data_source in zip(shp_files, data_sources):
+            layer = data_source.GetLayer(0)
+            coord_transform = self._get_coordinate_transformation(layer.GetSpatialRef(), srs)
+            record_ids = self._get_record_ids(shp_type, shp_file) if is_tracked else {}
+            for feature in layer:
+                if is_tracked:
+                    graipid = record_ids.get(feature.GetFID(), None)
+                    if graipid is None:
+                        raise Exception("Feature {} of shapefile {} is not in the GRAIP database. Import the "
+                                        "shapefile again before consolidating.".format(feature.GetFID(), shp_file))
+                else:
+                    graipid = feature_count
+                consolidated_feature = ogr.Feature(layer_definition)
+                geom = feature.GetGeometryRef()
+                if geom is not None and coord_transform is not None:
+                    geom = geom.Clone()
+                    geom.Transform(coord_transform)
+                consolidated_feature.SetGeometry(geom)
+                consolidated_feature.SetField(id_field_name, graipid)
+                attribute_row = attribute_rows.get(graipid, None)
+                if attribute_row is not None:
+                    for field_index, (col_name, to_field_value) in attribute_fields:
+                        value = getattr(attribute_row, col_name)
+                        if value is not None:
+                            consolidated_feature.SetField(field_index, to_field_value(value))
+                consolidated_layer.CreateFeature(consolidated_feature)
+                consolidated_feature.Destroy()
+                feature_count += 1
+                if feature_count % self.TRANSACTION_SIZE == 0:
+                    consolidated_layer.CommitTransaction()
+                    consolidated_layer.StartTransaction()
+                progress.update(feature_count)
+            data_source.Destroy()
+
+        consolidated_layer.CommitTransaction()
+        if self.output_format == SHAPEFILE_FORMAT:
+            # creates the .qix spatial index file
+            consolidated_data_source.ExecuteSQL("CREATE SPATIAL INDEX ON {}".format(layer_name))
+        consolidated_data_source.Destroy()
+        progress.update(feature_count, force=True)
+        return feature_count
+
+    def _is_tracked(self, shp_type):
+        # True if features of shp_type shapefiles are in the ImportedFeatures table
+        if self.db_session is None:
+            return False
+        with self.db_session.read_cursor() as cursor:
+            if not cursor.tables(table=import_engine.IMPORTED_FEATURES_TABLE_NAME).fetchall():
+                return False
+            sql_select = "SELECT COUNT(*) FROM {} WHERE ShpType=?".format(import_engine.IMPORTED_FEATURES_TABLE_NAME)
+            return cursor.execute(sql_select, shp_type).fetchone()[0] > 0
+
+    def _get_record_ids(self, shp_type, shp_file):
+        # feature ID -> GRAIPDID/GRAIPRID of the features imported from the shapefile
+        with self.db_session.read_cursor() as cursor:
+            sql_select = "SELECT FeatureID, RecordID FROM {} WHERE ShpType=? AND " \
+                         "ShpFile=?".format(import_engine.IMPORTED_FEATURES_TABLE_NAME)
+            return dict((row.FeatureID, row.RecordID) for row in
+                        cursor.execute(sql_select, shp_type, shp_file).fetchall())
+
+    def _create_attribute_fields(self, consolidated_layer, table_name, id_field_name):
+        """
+        Adds the fields of the database table (DrainPoints or RoadLines) to the consolidated layer if
+        attributes are included. Returns a list of (field index, (column name, value converter)) and the
+        table rows by id
+        """
+        self.field_names[table_name] = {id_field_name: id_field_name}
+        if not self.include_attributes:
+            return [], {}
+
+        schema = self.db_session.schema
+        attribute_fields = []
+        # created field name (lower case) -> column name, starting with the id field
+        created_field_names = {id_field_name.lower(): id_field_name}
+        for col_name in schema.get_column_names(table_name):
+            if col_name == id_field_name:
+                continue
+            data_type = schema.get_column_data_type(table_name, col_name)
+            if data_type in graip_db.INTEGER_DATA_TYPES:
+                field_type, to_field_value = ogr.OFTInteger, int
+            elif data_type in graip_db.FLOAT_DATA_TYPES:
+                field_type, to_field_value = ogr.OFTReal, float
+            else:
+                field_type, to_field_value = ogr.OFTString, str
+            field_count = consolidated_layer.GetLayerDefn().GetFieldCount()
+            if consolidated_layer.CreateField(ogr.FieldDefn(col_name, field_type)) != 0 or \
+                    consolidated_layer.GetLayerDefn().GetFieldCount() != field_count + 1:
+                raise Exception("Failed to add field {} to the consolidated {} layer.".format(col_name, table_name))
+            # the shapefile driver truncates field names to 10 characters (e.g., StreamConnect1ID and
+            # StreamConnect2ID) and renames a field whose truncated name is taken
+            field_name = consolidated_layer.GetLayerDefn().GetFieldDefn(field_count).GetName()
+            if field_name.lower() in created_field_names:
+                raise Exception("Fields {} and {} of the consolidated {} layer have the same name {}.".format(
+                    created_field_names[field_name.lower()], col_name, table_name, field_name))
+            created_field_names[field_name.lower()] = col_name
+            self.field_names[table_name][col_name] = field_name
+            attribute_fields.append((field_count, (col_name, to_field_value)))
+
+        with self.db_session.read_cursor() as cursor:
+            rows = cursor.execute("SELECT * FROM {}".format(table_name)).fetchall()
+        attribute_rows = dict((getattr(row, id_field_name), row) for row in rows)
+        return attribute_fields, attribute_rows
+
+    def _get_coordinate_transformation(self, layer_srs, srs):
+        if layer_srs is None or srs.ExportToWkt() == "" or layer_srs.IsSame(srs):
+            return None
+        return osr.CoordinateTransformation(layer_srs, srs)
+
+    def _get_layer_progress_callback(self, layer_name):
+        if self.progress_callback is None:
+            return None
+
+        def layer_progress_callback(count_done, count_total):
+            self.progress_callback(layer_name, count_done, count_total)
+        return layer_progress_callback
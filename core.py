@@ -0,0 +1,526 @@
+"""
+GUI-free constants and helper functions shared by the wizard (utils.py) and the
+headless import engine (import_engine.py). Nothing in this module may import PySide.
+"""
+
+import json
+import time
+from collections import Counter
+from datetime import datetime
+
+from osgeo import ogr
+
+try:
+    import numpy
+except ImportError:
+    # numpy is only needed for computing DrainIDs of whole columns at once (see compute_drain_ids)
+    numpy = None
+
+import matching
+
+DP_ERROR_LOG_TABLE_NAME = 'DPErrorLog'
+RD_ERROR_LOG_TABLE_NAME = 'RDErrorLog'
+NO_MATCH_USE_DEFAULT = '<No Match Use Default>'
+
+# fields of the DrainPoints table - any other mapped field goes to the drain type attribute table
+DP_TABLE_FIELD_NAMES = ['GRAIPDID', 'DrainTypeID', 'CDate', 'CTime', 'VehicleID', 'DrainID',
+                        'StreamConnectID', 'OrphanID', 'DischargeToID', 'Comments', 'FillErosion',
+                        'LinkCascadeID', 'In_Xing_FillID']
+
+# definition tables for these fields have an additional Multiplier column
+MULTIPLIER_FIELD_NAMES = ('FlowPathVeg1ID', 'FlowPathVeg2ID', 'SurfaceTypeID')
+
+# CTime value of a drain point or road end that has no collection time (and so no DrainID)
+NO_COLLECTION_TIME = 999
+
+# date formats of the CDate values in shapefiles (e.g., 01/12/2016 and 2016/12/01)
+DATE_FORMATS = ("%m/%d/%Y", "%Y/%m/%d", "%Y-%m-%d", "%Y-%m-%d %H:%M:%S")
+
+# number of features read from a shapefile at a time (see read_shapefile_batches)
+FEATURE_BATCH_SIZE = 1000
+# key of the feature IDs in the batches of read_shapefile_batches() - not a valid shapefile field name
+FEATURE_ID_KEY = ':FID'
+
+# actions for a value that is not in a definitions table (see DefineValueDialog)
+ACTION_USE_DEFAULT = 'use_default'
+ACTION_REASSIGN_VALUE = 'reassign_value'
+ACTION_ADD_NEW = 'add_new'
+
+
+class GDALFileDriver(object):
+    @classmethod
+    def ShapeFile(cls):
+        return "ESRI Shapefile"
+
+    @classmethod
+    def TifFile(cls):
+        return "GTiff"
+
+    @classmethod
+    def GeoPackage(cls):
+        return "GPKG"
+
+
+class ProgressThrottle(object):
+    """
+    Passes progress updates on to callback(count_done, count_total) at most max_rate times per second.
+    The update for the last count (and any forced update) is always passed on, unless it repeats the count
+    of the update passed on before.
+    """
+    def __init__(self, callback, count_total, max_rate=10):
+        self.callback = callback
+        self.count_total = count_total
+        self.min_interval = 1.0 / max_rate if max_rate > 0 else 0
+        self._last_update_time = None
+        self._last_count_done = None
+
+    def update(self, count_done, force=False):
+        if self.callback is None or count_done == self._last_count_done:
+            return
+        now = time.time()
+        if force or count_done >= self.count_total or self._last_update_time is None or \
+                now - self._last_update_time >= self.min_interval:
+            self._last_update_time = now
+            self._last_count_done = count_done
+            self.callback(count_done, self.count_total)
+
+
+class LogWriter(object):
+    """
+    Buffers the log entries of a run and writes them in batches: the text log files (as with
+    add_entry_to_log_file), the DPErrorLog/RDErrorLog tables (as with add_entry_to_error_table) and, if
+    json_log_file is given, a JSON Lines file with one record per entry. Entries are written when
+    max_entries entries are buffered and on flush(); the error table rows are committed with the session.
+    """
+    def __init__(self, db_session=None, json_log_file=None, max_entries=1000):
+        self.db_session = db_session
+        self.json_log_file = json_log_file
+        self.max_entries = max_entries
+        # log file -> lines to append
+        self._log_lines = {}
+        # error table name -> rows to insert
+        self._error_rows = {}
+        self._json_records = []
+        self._entry_count = 0
+
+    def add_entry(self, log_file, graipid, ftype, message, action_taken, err_table_name=None):
+        if err_table_name is not None:
+            if err_table_name not in (DP_ERROR_LOG_TABLE_NAME, RD_ERROR_LOG_TABLE_NAME):
+                raise Exception("{} is not a valid table name for logging error.".format(err_table_name))
+            self._error_rows.setdefault(err_table_name, []).append((graipid, ftype, message, action_taken))
+
+        if log_file is not None:
+            self._log_lines.setdefault(log_file, []).append("{}, {}, {}, {} \n".format(graipid, ftype, message,
+                                                                                       action_taken))
+        if self.json_log_file is not None:
+            self._json_records.append({'time': time.strftime("%Y-%m-%d %H:%M:%S"), 'id': graipid, 'type': ftype,
+                                       'message': message, 'action_taken': action_taken,
+                                       'error_table': err_table_name})
+        self._entry_count += 1
+        if self._entry_count >= self.max_entries:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered entries to the error tables and the log files
+        """
+        cursor = self.db_session.cursor() if self._error_rows else None
+        for err_table_name, rows in self._error_rows.items():
+            if err_table_name == DP_ERROR_LOG_TABLE_NAME:
+                sql_insert = "INSERT INTO {} (GRAIPDID, DrainType, ErrorMessage, ActionTaken) VALUES(?, ?, ?, ?)"
+            else:
+                sql_insert = "INSERT INTO {} (GRAIPRID, RoadType, ErrorMessage, ActionTaken) VALUES(?, ?, ?, ?)"
+            cursor.executemany(sql_insert.format(err_table_name), rows)
+        self._error_rows = {}
+        self.flush_files()
+
+    def flush_files(self):
+        """
+        Writes the buffered entries to the log files only and drops the buffered error table rows (e.g.,
+        when the session is being rolled back after an error)
+        """
+        for log_file, lines in self._log_lines.items():
+            with open(log_file, 'a') as file_obj:
+                file_obj.writelines(lines)
+        if self._json_records:
+            with open(self.json_log_file, 'a') as file_obj:
+                for record in self._json_records:
+                    file_obj.write(json.dumps(record, default=str) + '\n')
+        self._log_lines = {}
+        self._error_rows = {}
+        self._json_records = []
+        self._entry_count = 0
+
+
+class DefinitionChoices(object):
+    """
+    What can be done with a value that is not in a definitions table. This is what the Define Value
+    dialog offers the user and what gets used when running in uninterrupted mode.
+    """
+    def __init__(self, definitions, definition_ids, matching_index, is_match_found, default_definition,
+                 default_id, next_id):
+        self.definitions = definitions
+        self.definition_ids = definition_ids
+        self.matching_index = matching_index
+        self.is_match_found = is_match_found
+        self.default_definition = default_definition
+        self.default_id = default_id
+        self.next_id = next_id
+
+
+def create_log_file(graip_db_file, log_file, log_type):
+    with open(log_file, 'w') as file_obj:
+        file_obj.write("GRAIP Database File:{}".format(graip_db_file) + '\n')
+        file_obj.write(time.strftime("%m-%d-%Y %H:%M:%S") + '\n')
+        if log_type == 'DP':
+            file_obj.write("GRAIPDID, Drain Type, Error Message, Action Taken \n")
+        else:
+            file_obj.write("GRAIPDID, Road Type, Error Message, Action Taken \n")
+
+
+def clear_data_tables(db_session):
+    cursor = db_session.cursor()
+    cursor.execute("DELETE FROM DrainPoints")
+    cursor.execute("DELETE FROM RoadLines")
+    drain_type_def_rows = cursor.execute("SELECT TableName FROM DrainTypeDefinitions").fetchall()
+    for row in drain_type_def_rows:
+        cursor.execute("DELETE FROM {}".format(row.TableName))
+    db_session.commit()
+
+
+def get_shapefile_attribute_column_names(shp_file):
+    gdal_driver = ogr.GetDriverByName(GDALFileDriver.ShapeFile())
+    data_source = gdal_driver.Open(shp_file, 0)
+    layer = data_source.GetLayer(0)
+    attribute_names = [att_name for att_name, _ in _get_attribute_field_indexes(layer.GetLayerDefn())]
+    data_source.Destroy()
+    return attribute_names
+
+
+def read_shapefile_batches(shp_file, field_names, batch_size=FEATURE_BATCH_SIZE, include_feature_ids=False,
+                           start_index=0, end_index=None):
+    """
+    Generates the attribute values of the features of a shapefile in batches of at most batch_size
+    features. Each batch is a dict of field name -> list of the values of that field (in feature order)
+    for the fields in field_names, and FEATURE_ID_KEY -> list of the feature IDs if include_feature_ids is
+    True. The field indexes are looked up once per shapefile and only one batch is held in memory at a time.
+    Field names are matched ignoring case, as by feature.GetField(); the batches are keyed by field_names.
+    Only the features from record start_index up to (not including) record end_index are read - the feature
+    ID of a shapefile feature is its record index, deleted records included.
+    """
+    gdal_driver = ogr.GetDriverByName(GDALFileDriver.ShapeFile())
+    data_source = gdal_driver.Open(shp_file, 0)
+    layer = data_source.GetLayer(0)
+    try:
+        field_indexes = dict((att_name.lower(), field_index)
+                             for att_name, field_index in _get_attribute_field_indexes(layer.GetLayerDefn()))
+        columns = []
+        for field_name in field_names:
+            if field_name.lower() not in field_indexes:
+                raise Exception("Field '{}' was not found in shapefile {}.".format(field_name, shp_file))
+            columns.append((field_name, field_indexes[field_name.lower()]))
+
+        batch = _new_batch(columns, include_feature_ids)
+        batch_count = 0
+        if start_index > 0:
+            layer.SetNextByIndex(start_index)
+        for feature in iter(layer.GetNextFeature, None):
+            if end_index is not None and feature.GetFID() >= end_index:
+                break
+            for field_name, field_index in columns:
+                batch[field_name].append(feature.GetField(field_index))
+            if include_feature_ids:
+                batch[FEATURE_ID_KEY].append(feature.GetFID())
+            batch_count += 1
+            if batch_count == batch_size:
+                yield batch
+                batch = _new_batch(columns, include_feature_ids)
+                batch_count = 0
+        if batch_count > 0:
+            yield batch
+    finally:
+        data_source.Destroy()
+
+
+def _new_batch(columns, include_feature_ids):
+    batch = dict((field_name, []) for field_name, _ in columns)
+    if include_feature_ids:
+        batch[FEATURE_ID_KEY] = []
+    return batch
+
+
+def _get_attribute_field_indexes(layer_definition):
+    # (field name, field index) of the attribute fields of a layer in field order
+    field_indexes = []
+    for i in range(layer_definition.GetFieldCount()):
+        att_name = layer_definition.GetFieldDefn(i).GetName()
+        if att_name != 'FID' and att_name != 'Shape':
+            field_indexes.append((att_name, i))
+    return field_indexes
+
+
+def get_definition_choices(cursor, def_table_name, missing_field_value):
+    sql_select = "SELECT * FROM {}".format(def_table_name)
+    def_rows = cursor.execute(sql_select).fetchall()
+    # definitions are in the 2nd column of the definitions table
+    definitions = [row[1] for row in def_rows]
+    # definitions ID values are in the 1st column of the definitions table
+    definition_ids = [row[0] for row in def_rows]
+
+    matching_index, field_match_found = matching.DefinitionMatcher(definitions).match(missing_field_value)
+
+    # see default value exists in definitions table
+    sql_select = "SELECT * FROM {} WHERE Description LIKE '%Default%'".format(def_table_name)
+    def_row = cursor.execute(sql_select).fetchone()
+    if def_row:
+        default_definition = def_row[1]
+        default_id = def_row[0]
+    else:
+        default_definition = None
+        default_id = 0
+
+    # in case of adding a new entry to the definition table, find the next id that will be used for this
+    # new definition record
+    # first determine the field name of the ID field in the definition table (this is the first column of the
+    # table)
+    def_column = cursor.columns(table=def_table_name).fetchone()
+    # now use the def_column.column_name to find the maximum value for this field
+    sql_select = "SELECT MAX({}) AS max_id FROM {}".format(def_column.column_name, def_table_name)
+    row = cursor.execute(sql_select).fetchone()
+    next_id = 0
+    if row:
+        next_id = row.max_id + 1
+
+    return DefinitionChoices(definitions=definitions, definition_ids=definition_ids,
+                             matching_index=matching_index, is_match_found=field_match_found,
+                             default_definition=default_definition, default_id=default_id, next_id=next_id)
+
+
+def save_definition_action(cursor, action, def_table_name, from_value, to_value, definition_id,
+                           description=None, multiplier=None, definitions_index=None):
+    """
+    Records the action taken for a value that is not in a definitions table and returns the
+    action taken message for the log. If given, definitions_index (graip_db.DefinitionsIndex) is
+    updated as well.
+    """
+    if action in (ACTION_REASSIGN_VALUE, ACTION_USE_DEFAULT):
+        sql_insert = "INSERT INTO ValueReassigns (FromField, ToField, DefinitionID, DefinitionTable) " \
+                     "VALUES (?, ?, ?, ?)"
+        data = (from_value, to_value, definition_id, def_table_name)
+        if action == ACTION_REASSIGN_VALUE:
+            action_taken_msg = "Reassigned value as {}".format(to_value)
+        else:
+            action_taken_msg = "Used Default - {}".format(to_value)
+    elif action == ACTION_ADD_NEW:
+        if multiplier is None:
+            sql_insert = "INSERT INTO {} VALUES (?, ?, ?)".format(def_table_name)
+            data = (definition_id, to_value, description)
+        else:
+            sql_insert = "INSERT INTO {} VALUES (?, ?, ?, ?)".format(def_table_name)
+            data = (definition_id, to_value, description, multiplier)
+        action_taken_msg = "Added to definition table as ID {}".format(definition_id)
+    else:
+        raise Exception("{} is not a valid action for a missing definition value.".format(action))
+
+    cursor.execute(sql_insert, data)
+    if definitions_index is not None:
+        if action == ACTION_ADD_NEW:
+            definitions_index.add_definition(def_table_name, definition_id, to_value)
+        else:
+            definitions_index.add_value_reassign(def_table_name, from_value, definition_id)
+    return action_taken_msg
+
+
+def add_entry_to_error_table(db_session, err_table_name, graipid, ftype, err_msg, action_taken):
+    # the entry is committed with the next commit of the session
+    if err_table_name not in (DP_ERROR_LOG_TABLE_NAME, RD_ERROR_LOG_TABLE_NAME):
+        raise Exception("{} is not a valid table name for logging error.".format(err_table_name))
+
+    cursor = db_session.cursor()
+    if err_table_name == DP_ERROR_LOG_TABLE_NAME:
+        sql_insert = "INSERT INTO {} (GRAIPDID, DrainType, ErrorMessage, ActionTaken) VALUES(?, ?, ?, ?)"
+        sql_insert = sql_insert.format(DP_ERROR_LOG_TABLE_NAME)
+    else:
+        sql_insert = "INSERT INTO {} (GRAIPRID, RoadType, ErrorMessage, ActionTaken) VALUES(?, ?, ?, ?)"
+        sql_insert = sql_insert.format(RD_ERROR_LOG_TABLE_NAME)
+
+    data = (graipid, ftype, err_msg, action_taken)
+    cursor.execute(sql_insert, data)
+
+
+def add_entry_to_log_file(log_file, graipid, ftype, message, action_taken):
+    with open(log_file, 'a') as file_obj:
+        text_to_write = "{}, {}, {}, {} \n"
+        text_to_write = text_to_write.format(graipid, ftype, message, action_taken)
+        file_obj.write(text_to_write)
+
+
+def check_for_orphans_and_duplicates(db_session, dp_log_file, rd_log_file):
+    """
+    Finds drain points not linked to any road line (orphan drain points), road lines not linked to any
+    drain point (orphan road segments) and drain points sharing a DrainID, and writes them to the log files
+    and the error tables. Each table is read once and the checks are done with in memory sets.
+    Returns the GRAIPDIDs of the orphan drain points, the GRAIPRIDs of the orphan road segments and the
+    GRAIPDIDs of the drain points with a duplicate DrainID.
+    """
+    cursor = db_session.cursor()
+    drain_type_names = dict((row.DrainTypeID, row.DrainTypeName) for row in
+                            cursor.execute("SELECT DrainTypeID, DrainTypeName FROM DrainTypeDefinitions"))
+    dp_rows = cursor.execute("SELECT GRAIPDID, DrainTypeID, DrainID, CTime FROM DrainPoints "
+                             "ORDER BY GRAIPDID").fetchall()
+    rd_rows = cursor.execute("SELECT GRAIPRID, GRAIPDID1, GRAIPDID2 FROM RoadLines ORDER BY GRAIPRID").fetchall()
+
+    graipdids = set(dp_row.GRAIPDID for dp_row in dp_rows)
+    linked_graipdids = set()
+    for rd_row in rd_rows:
+        linked_graipdids.add(rd_row.GRAIPDID1)
+        linked_graipdids.add(rd_row.GRAIPDID2)
+
+    # drain points without collection time have no DrainID
+    drain_id_counts = Counter(dp_row.DrainID for dp_row in dp_rows
+                              if dp_row.DrainID is not None and not is_no_collection_time(dp_row.CTime))
+
+    log_writer = LogWriter(db_session)
+    orphan_graipdids = []
+    duplicate_graipdids = []
+    for dp_row in dp_rows:
+        drain_type_name = drain_type_names.get(dp_row.DrainTypeID, None)
+        if dp_row.GRAIPDID not in linked_graipdids:
+            orphan_graipdids.append(dp_row.GRAIPDID)
+            log_writer.add_entry(dp_log_file, dp_row.GRAIPDID, drain_type_name, "Orphan Drain Point", "Nothing",
+                                 err_table_name=DP_ERROR_LOG_TABLE_NAME)
+
+        # check if there are duplicate drainids in DrainPoints table
+        if drain_id_counts.get(dp_row.DrainID, 0) > 1 and not is_no_collection_time(dp_row.CTime):
+            duplicate_graipdids.append(dp_row.GRAIPDID)
+            msg = "Duplicate DrainID:{}".format(dp_row.DrainID)
+            log_writer.add_entry(dp_log_file, dp_row.GRAIPDID, drain_type_name, msg, "Nothing",
+                                 err_table_name=DP_ERROR_LOG_TABLE_NAME)
+
+    orphan_graiprids = []
+    for rd_row in rd_rows:
+        if rd_row.GRAIPDID1 not in graipdids and rd_row.GRAIPDID2 not in graipdids:
+            orphan_graiprids.append(rd_row.GRAIPRID)
+            log_writer.add_entry(rd_log_file, rd_row.GRAIPRID, "Road Line", "Orphan Road Segment", "Nothing",
+                                 err_table_name=RD_ERROR_LOG_TABLE_NAME)
+
+    log_writer.flush()
+    db_session.commit()
+    return orphan_graipdids, orphan_graiprids, duplicate_graipdids
+
+
+def is_data_type_match(db_session, table_name, col_name, data_value):
+    return db_session.schema.is_data_type_match(table_name, col_name, data_value)
+
+
+def get_drain_id(time_in, date_in, vehicle_id):
+    time_24_format = get_time_24_format(time_in)
+    dt_obj = date_in
+    # get 2 digit year
+    year = int(str(dt_obj.year)[2:])
+    drain_id = (year * 1000000000) + (dt_obj.month * 10000000) + (dt_obj.day * 100000) + \
+               (time_24_format * 10) + vehicle_id
+    return drain_id
+
+
+def get_time_24_format(time_in):
+    """
+    Returns a collection time as a number in 24 hour format (e.g., 2230 for 10:29:45pm). time_in is either a 12
+    hour time string (seconds over 30 round up to the next minute) or a 24 hour time as a number or string.
+    The am/pm suffix is matched ignoring case and is optional for a time string in 24 hour format.
+    """
+    if not isinstance(time_in, basestring):
+        return time_in
+    time = time_in.strip().lower()
+    try:
+        if ':' not in time:
+            return int(float(time))
+        # remove am/pm
+        time_hour, time_min, time_sec = [int(part) for part in time.rstrip('apm ').split(":")]
+    except ValueError:
+        raise Exception("'{}' is not a valid collection time.".format(time_in))
+    if time_sec > 30:
+        time_min += 1
+    if "p" in time and time_hour != 12:
+        time_hour += 12
+
+    if "a" in time and time_hour == 12:
+        time_hour = 0
+    return (time_hour * 100) + time_min
+
+
+def compute_drain_id(time_in, date_in, vehicle_id):
+    """
+    Returns the DrainID for the collection time, date and vehicle ID of a drain point (or a road end) as
+    the float stored in the database, or None if the collection time is NO_COLLECTION_TIME.
+    Dates and vehicle IDs can be given as read from the shapefile.
+    """
+    if is_no_collection_time(time_in):
+        return None
+    # DrainID is of data type double in graip database
+    return float(get_drain_id(time_in, to_datetime(date_in), int(vehicle_id)))
+
+
+def compute_drain_ids(times_in, dates_in, vehicle_ids):
+    """
+    compute_drain_id() for whole columns of collection times, dates and vehicle IDs (e.g., lists or numpy
+    arrays). Returns a numpy float64 array of DrainIDs with NaN for NO_COLLECTION_TIME - or without numpy,
+    a list with None for NO_COLLECTION_TIME.
+    """
+    if numpy is None:
+        return [compute_drain_id(time_in, date_in, vehicle_id)
+                for time_in, date_in, vehicle_id in zip(times_in, dates_in, vehicle_ids)]
+
+    times = numpy.asarray(times_in, dtype=object)
+    drain_ids = numpy.empty(len(times), dtype=numpy.float64)
+    drain_ids.fill(numpy.nan)
+    if len(times) == 0:
+        return drain_ids
+
+    # a time is parsed once (get_time_24_format) for all the features collected at that time
+    time_indexes = {}
+    time_index = numpy.array([time_indexes.setdefault(time_in, len(time_indexes)) for time_in in times],
+                             dtype=numpy.int64)
+    unique_times = sorted(time_indexes, key=time_indexes.get)
+    is_unique_time_valid = numpy.array([not is_no_collection_time(time_in) for time_in in unique_times], dtype=bool)
+    unique_time_24_format = numpy.array([get_time_24_format(time_in) if is_time_valid else 0
+                                         for time_in, is_time_valid in zip(unique_times, is_unique_time_valid)],
+                                        dtype=numpy.float64)
+    is_valid = is_unique_time_valid[time_index]
+    time_24_format = unique_time_24_format[time_index][is_valid]
+
+    # a survey has only a few distinct dates - parse each of them once
+    date_indexes = {}
+    date_index = numpy.array([date_indexes.setdefault(date_in, len(date_indexes))
+                              for date_in in numpy.asarray(dates_in, dtype=object)[is_valid]], dtype=numpy.int64)
+    unique_dates = [to_datetime(date_in) for date_in in sorted(date_indexes, key=date_indexes.get)]
+    # get 2 digit year
+    years = numpy.array([dt_obj.year % 100 for dt_obj in unique_dates], dtype=numpy.float64)[date_index]
+    months = numpy.array([dt_obj.month for dt_obj in unique_dates], dtype=numpy.float64)[date_index]
+    days = numpy.array([dt_obj.day for dt_obj in unique_dates], dtype=numpy.float64)[date_index]
+    vehicles = numpy.asarray(vehicle_ids, dtype=object)[is_valid].astype(numpy.int64)
+
+    drain_ids[is_valid] = (years * 1000000000) + (months * 10000000) + (days * 100000) + \
+                          (time_24_format * 10) + vehicles
+    return drain_ids
+
+
+def is_no_collection_time(time_in):
+    if isinstance(time_in, basestring):
+        return time_in.strip() == str(NO_COLLECTION_TIME)
+    return time_in == NO_COLLECTION_TIME
+
+
+def to_datetime(date_in):
+    if isinstance(date_in, basestring):
+        for date_format in DATE_FORMATS:
+            try:
+                return datetime.strptime(date_in.strip(), date_format)
+            except ValueError:
+                pass
+        raise Exception("'{}' is not a valid date.".format(date_in))
+    return date_in
+
+
+def get_table_column_data_type(db_session, table_name, col_name):
+    return db_session.schema.get_column_data_type(table_name, col_name)
@@ -0,0 +1,923 @@
+"""
+Database backends for the GRAIP database. All database access goes through connect(), which returns a
+connection with the pyodbc interface (cursor.execute(sql, *params), rows with attribute access,
+cursor.columns(table=...)) for the backend matching the database file extension:
+    *.mdb, *.accdb              - MS Access through pyodbc (Windows only)
+    *.sqlite, *.sqlite3, *.db   - SQLite through the sqlite3 module of the standard library
+"""
+
+import os
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import pyodbc
+except ImportError:
+    # pyodbc (and the MS Access driver) is only needed for the Access backend
+    pyodbc = None
+
+MS_ACCESS_CONNECTION = "Driver={Microsoft Access Driver (*.mdb, *.accdb)};DBQ=%s;"
+
+# ODBC SQL data type codes (same values as the pyodbc.SQL_* constants)
+SQL_CHAR = 1
+SQL_NUMERIC = 2
+SQL_DECIMAL = 3
+SQL_INTEGER = 4
+SQL_SMALLINT = 5
+SQL_FLOAT = 6
+SQL_REAL = 7
+SQL_DOUBLE = 8
+SQL_VARCHAR = 12
+SQL_TYPE_DATE = 91
+SQL_TYPE_TIMESTAMP = 93
+SQL_LONGVARCHAR = -1
+SQL_BIGINT = -5
+SQL_TINYINT = -6
+SQL_BIT = -7
+SQL_WCHAR = -8
+SQL_WVARCHAR = -9
+SQL_WLONGVARCHAR = -10
+
+TEXT_DATA_TYPES = (SQL_CHAR, SQL_VARCHAR, SQL_WCHAR, SQL_WLONGVARCHAR, SQL_WVARCHAR, SQL_LONGVARCHAR)
+INTEGER_DATA_TYPES = (SQL_TINYINT, SQL_SMALLINT, SQL_INTEGER, SQL_BIGINT, SQL_NUMERIC)
+FLOAT_DATA_TYPES = (SQL_DECIMAL, SQL_FLOAT, SQL_DOUBLE, SQL_REAL)
+DATE_DATA_TYPES = (SQL_TYPE_DATE, SQL_TYPE_TIMESTAMP)
+
+# tables of the GRAIP database other than the drain type attribute tables and the definition tables
+# (those two sets of tables are named in DrainTypeDefinitions.TableName and MetaData.DefinitionTable)
+GRAIP_SCHEMA = [
+    ("DrainPoints", [("GRAIPDID", "INTEGER PRIMARY KEY"), ("DrainTypeID", "INTEGER"), ("CDate", "DATETIME"),
+                     ("CTime", "VARCHAR(20)"), ("VehicleID", "INTEGER"), ("DrainID", "DOUBLE"),
+                     ("StreamConnectID", "INTEGER DEFAULT 2"), ("OrphanID", "INTEGER"),
+                     ("DischargeToID", "INTEGER"), ("Comments", "VARCHAR(255)"), ("FillErosion", "INTEGER"),
+                     ("LinkCascadeID", "INTEGER"), ("In_Xing_FillID", "INTEGER")]),
+    ("RoadLines", [("GRAIPRID", "INTEGER PRIMARY KEY"), ("CDate", "DATETIME"), ("CTime1", "VARCHAR(20)"),
+                   ("CTime2", "VARCHAR(20)"), ("VehicleID", "INTEGER"), ("OrigDrainID1", "DOUBLE"),
+                   ("OrigDrainID2", "DOUBLE"), ("GRAIPDID1", "INTEGER"), ("GRAIPDID2", "INTEGER"),
+                   ("StreamConnect1ID", "INTEGER"), ("StreamConnect2ID", "INTEGER"),
+                   ("RoadNetworkID", "INTEGER"), ("SurfaceTypeID", "INTEGER"), ("FlowPathVeg1ID", "INTEGER"),
+                   ("FlowPathVeg2ID", "INTEGER"), ("Comments", "VARCHAR(255)")]),
+    ("DrainTypeDefinitions", [("DrainTypeID", "INTEGER PRIMARY KEY"), ("DrainTypeName", "VARCHAR(50)"),
+                              ("TableName", "VARCHAR(50)")]),
+    ("RoadNetworkDefinitions", [("RoadNetworkID", "INTEGER PRIMARY KEY AUTOINCREMENT"),
+                                ("RoadNetwork", "VARCHAR(50)"), ("BaseRate", "DOUBLE"),
+                                ("Description", "VARCHAR(255)")]),
+    ("FieldMatches", [("AttTableID", "INTEGER"), ("DBField", "VARCHAR(50)"), ("DBFField", "VARCHAR(50)")]),
+    ("MetaData", [("IDFieldName", "VARCHAR(50)"), ("DefinitionTable", "VARCHAR(50)")]),
+    ("ValueReassigns", [("FromField", "VARCHAR(255)"), ("ToField", "VARCHAR(255)"), ("DefinitionID", "INTEGER"),
+                        ("DefinitionTable", "VARCHAR(50)")]),
+    ("DPErrorLog", [("ID", "INTEGER PRIMARY KEY AUTOINCREMENT"), ("GRAIPDID", "INTEGER"),
+                    ("DrainType", "VARCHAR(50)"), ("ErrorMessage", "TEXT"), ("ActionTaken", "VARCHAR(255)")]),
+    ("RDErrorLog", [("ID", "INTEGER PRIMARY KEY AUTOINCREMENT"), ("GRAIPRID", "INTEGER"),
+                    ("RoadType", "VARCHAR(50)"), ("ErrorMessage", "TEXT"), ("ActionTaken", "VARCHAR(255)")]),
+    ("FileSetup", [("GRAIP_DB_File", "VARCHAR(255)"), ("DEM_Path", "VARCHAR(255)"), ("Road_Shapefiles", "TEXT"),
+                   ("DrainPoints_Shapefiles", "TEXT")]),
+    ("FileSetupCheckpoints", [("FileOrder", "INTEGER"), ("ShpType", "VARCHAR(2)"), ("ShpFile", "TEXT"),
+                              ("FileHash", "VARCHAR(40)"), ("MappingHash", "VARCHAR(40)"), ("Status", "VARCHAR(20)"),
+                              ("FirstID", "INTEGER"), ("LastID", "INTEGER")]),
+    ("ImportedFeatures", [("ShpType", "VARCHAR(2)"), ("ShpFile", "TEXT"), ("FeatureID", "INTEGER"),
+                          ("RecordID", "INTEGER"), ("AttributeHash", "VARCHAR(40)")]),
+    ("MappingProfiles", [("ShpType", "VARCHAR(2)"), ("DrainTypeName", "VARCHAR(50)"), ("SchemaHash", "VARCHAR(40)"),
+                         ("FieldOrder", "INTEGER"), ("DBField", "VARCHAR(50)"), ("DBFField", "VARCHAR(50)")]),
+]
+
+# tables holding the configuration of a GRAIP database that are copied when a database is created from
+# an existing GRAIP database
+GRAIP_CONFIG_TABLE_NAMES = ("DrainTypeDefinitions", "RoadNetworkDefinitions", "FieldMatches", "MetaData",
+                            "ValueReassigns")
+
+# tables that are emptied when a database is reset (see reset_database()), next to the drain type attribute
+# tables - all other tables (the configuration, definition and mapping tables) are kept
+GRAIP_DATA_TABLE_NAMES = ("DrainPoints", "RoadLines", "DPErrorLog", "RDErrorLog", "FileSetupCheckpoints",
+                          "ImportedFeatures")
+
+# the empty GRAIP database that new GRAIP databases are made from
+TEMPLATE_DB_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'GRAIP_DB', "GRAIP.mdb")
+
+MS_ACCESS_DRIVER = "Microsoft Access Driver (*.mdb, *.accdb)"
+# SQLConfigDataSource request for configuring a system data source - used to compact an MS Access database
+ODBC_ADD_SYS_DSN = 4
+
+
+class AccessBackend(object):
+    name = "MS Access"
+    file_extensions = ('.mdb', '.accdb')
+
+    def connect(self, db_file):
+        if pyodbc is None:
+            raise Exception("pyodbc is required for using the MS Access database {}.".format(db_file))
+        return pyodbc.connect(MS_ACCESS_CONNECTION % db_file)
+
+    def create_database(self, db_file, source_db_file=None):
+        raise Exception("A new MS Access GRAIP database can only be made by copying the GRAIP.mdb template.")
+
+    def reset_database(self, db_file, template_db_file=None):
+        """
+        Replaces the MS Access database with a copy of the template GRAIP database with the configuration,
+        definition and mapping tables of the database copied into it. Deleting the data from a large MS Access
+        database is slow and does not make the file any smaller.
+        """
+        if template_db_file is None:
+            raise Exception("The GRAIP.mdb template is required for resetting MS Access database {}.".format(db_file))
+        reset_db_file = _get_temp_db_file(db_file, 'reset')
+        shutil.copyfile(template_db_file, reset_db_file)
+        try:
+            src_conn = connect(db_file)
+            try:
+                dest_conn = connect(reset_db_file)
+                try:
+                    _copy_kept_tables(src_conn.cursor(), dest_conn.cursor())
+                    dest_conn.commit()
+                finally:
+                    dest_conn.close()
+            finally:
+                src_conn.close()
+            _replace_db_file(reset_db_file, db_file)
+        finally:
+            if os.path.exists(reset_db_file):
+                os.remove(reset_db_file)
+
+    def compact_database(self, db_file):
+        """
+        Compacts the MS Access database with the COMPACT_DB request of the MS Access ODBC driver (Windows only)
+        """
+        try:
+            import ctypes
+            config_data_source = ctypes.windll.ODBCCP32.SQLConfigDataSource
+        except (ImportError, AttributeError):
+            raise Exception("MS Access database {} can only be compacted on Windows.".format(db_file))
+        compacted_db_file = _get_temp_db_file(db_file, 'compact')
+        try:
+            attributes = 'COMPACT_DB="{}" "{}" General\0'.format(db_file, compacted_db_file)
+            if not config_data_source(0, ODBC_ADD_SYS_DSN, MS_ACCESS_DRIVER, attributes):
+                raise Exception("Failed to compact MS Access database {}.".format(db_file))
+            _replace_db_file(compacted_db_file, db_file)
+        finally:
+            if os.path.exists(compacted_db_file):
+                os.remove(compacted_db_file)
+
+
+class SQLiteBackend(object):
+    name = "SQLite"
+    file_extensions = ('.sqlite', '.sqlite3', '.db')
+
+    def connect(self, db_file):
+        return SQLiteConnection(db_file)
+
+    def create_database(self, db_file, source_db_file=None):
+        """
+        Creates a SQLite GRAIP database. If source_db_file (a GRAIP database of any backend) is given,
+        the configuration and definition tables are copied from it so that the new database is ready
+        for importing shapefiles.
+        """
+        if os.path.exists(db_file):
+            raise Exception("Database file {} already exists.".format(db_file))
+
+        conn = self.connect(db_file)
+        try:
+            cursor = conn.cursor()
+            for table_name, columns in GRAIP_SCHEMA:
+                cursor.execute(_get_create_table_sql(table_name, columns))
+
+            if source_db_file is not None:
+                src_conn = connect(source_db_file)
+                try:
+                    src_cursor = src_conn.cursor()
+                    for table_name in GRAIP_CONFIG_TABLE_NAMES:
+                        _copy_table_rows(src_cursor, cursor, table_name)
+                    create_definition_and_attribute_tables(cursor)
+                    for row in cursor.execute("SELECT DISTINCT DefinitionTable FROM MetaData").fetchall():
+                        _copy_table_rows(src_cursor, cursor, row.DefinitionTable)
+                finally:
+                    src_conn.close()
+            conn.commit()
+        finally:
+            conn.close()
+
+    def reset_database(self, db_file, template_db_file=None):
+        """
+        Drops and creates again the data tables (GRAIP_DATA_TABLE_NAMES and the drain type attribute tables)
+        of the SQLite database, each with the same CREATE TABLE statement it was made with. The template is
+        not needed.
+        """
+        conn = self.connect(db_file)
+        try:
+            cursor = conn.cursor()
+            table_names = list(GRAIP_DATA_TABLE_NAMES)
+            table_names += [row.TableName for row in
+                            cursor.execute("SELECT TableName FROM DrainTypeDefinitions").fetchall()]
+            sql_select = "SELECT sql FROM sqlite_master WHERE type='table' AND name=? COLLATE NOCASE"
+            for table_name in table_names:
+                table_row = cursor.execute(sql_select, table_name).fetchone()
+                if table_row is not None:
+                    cursor.execute("DROP TABLE {}".format(_quote_name(table_name)))
+                    cursor.execute(table_row.sql)
+            create_missing_tables(cursor, GRAIP_DATA_TABLE_NAMES)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def compact_database(self, db_file):
+        conn = self.connect(db_file)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+
+class SQLiteRow(object):
+    """
+    Row returned by a SQLiteCursor. Like a pyodbc row it can be indexed and the column values can be accessed
+    as attributes (column names are case insensitive as in MS Access).
+    """
+    __slots__ = ('cursor_description', '_values', '_col_index')
+
+    def __init__(self, col_index, values, description=None):
+        self._col_index = col_index
+        self._values = tuple(values)
+        self.cursor_description = description
+
+    def __getattr__(self, name):
+        try:
+            return self._values[self._col_index[name.lower()]]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, index):
+        return self._values[index]
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self._values)
+
+
+class SQLiteRows(list):
+    def fetchone(self):
+        return self[0] if self else None
+
+    def fetchall(self):
+        return list(self)
+
+
+class SQLiteCursor(object):
+    """
+    sqlite3 cursor with the parts of the pyodbc cursor interface used by the preprocessor
+    """
+    def __init__(self, sqlite_conn):
+        self._cursor = sqlite_conn.cursor()
+        self._col_index = {}
+
+    def execute(self, sql, *params):
+        # pyodbc accepts the parameters either as a sequence or as separate arguments
+        if len(params) == 1 and isinstance(params[0], (tuple, list)):
+            params = params[0]
+        self._cursor.execute(sql, tuple(params))
+        self._set_col_index()
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(sql, seq_of_params)
+        return self
+
+    def fetchone(self):
+        values = self._cursor.fetchone()
+        if values is None:
+            return None
+        return SQLiteRow(self._col_index, values, self._cursor.description)
+
+    def fetchall(self):
+        return [SQLiteRow(self._col_index, values, self._cursor.description) for values in self._cursor.fetchall()]
+
+    def __iter__(self):
+        for values in self._cursor:
+            yield SQLiteRow(self._col_index, values, self._cursor.description)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def columns(self, table):
+        col_index = {'table_name': 0, 'column_name': 1, 'data_type': 2, 'type_name': 3, 'ordinal_position': 4}
+        rows = SQLiteRows()
+        for col in self._cursor.execute("PRAGMA table_info({})".format(_quote_name(table))).fetchall():
+            # col: (cid, name, type, notnull, dflt_value, pk)
+            type_name = col[2].upper()
+            rows.append(SQLiteRow(col_index, (table, col[1], _get_sql_data_type(type_name), type_name, col[0] + 1)))
+        return rows
+
+    def tables(self, table=None):
+        col_index = {'table_name': 0, 'table_type': 1}
+        sql_select = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+        rows = SQLiteRows()
+        for row in self._cursor.execute(sql_select).fetchall():
+            if table is None or row[0].lower() == table.lower():
+                rows.append(SQLiteRow(col_index, (row[0], 'TABLE')))
+        return rows
+
+    def close(self):
+        self._cursor.close()
+
+    def _set_col_index(self):
+        if self._cursor.description is not None:
+            self._col_index = dict((col[0].lower(), i) for i, col in enumerate(self._cursor.description))
+        else:
+            self._col_index = {}
+
+
+class SQLiteConnection(object):
+    """
+    sqlite3 connection with the parts of the pyodbc connection interface used by the preprocessor
+    """
+    def __init__(self, db_file):
+        self.db_file = db_file
+        # the wizard imports on a worker thread with the connection of the session opened on the GUI thread -
+        # the session is never used by both threads at the same time
+        self._conn = sqlite3.connect(db_file, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        # return text as str as the MS Access backend does
+        self._conn.text_factory = str
+
+    def cursor(self):
+        return SQLiteCursor(self._conn)
+
+    def execute(self, sql, *params):
+        return self.cursor().execute(sql, *params)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+class ConnectionPool(object):
+    """
+    A small pool of connections to one database for read only lookups
+    """
+    def __init__(self, db_file, size=2):
+        self.db_file = db_file
+        self.size = size
+        self._idle_connections = []
+        self._connection_count = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._idle_connections:
+                return self._idle_connections.pop()
+            self._connection_count += 1
+        try:
+            return connect(self.db_file)
+        except Exception:
+            with self._lock:
+                self._connection_count -= 1
+            raise
+
+    def release(self, conn):
+        with self._lock:
+            if len(self._idle_connections) < self.size:
+                self._idle_connections.append(conn)
+                return
+            self._connection_count -= 1
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self._lock:
+            idle_connections = self._idle_connections
+            self._idle_connections = []
+            self._connection_count -= len(idle_connections)
+        for conn in idle_connections:
+            conn.close()
+
+
+class SchemaCache(object):
+    """
+    Column names and SQL data types of the GRAIP tables. The catalog of a table is read only once per
+    session - DrainPoints, RoadLines and the drain type attribute tables on load(), any other table on
+    first use. The schema does not change during an import.
+    """
+    def __init__(self, db_session):
+        self.db_session = db_session
+        # table name -> {column name: SQL data type}, columns in table order
+        self._table_columns = {}
+        self._table_column_names = {}
+
+    def load(self):
+        with self.db_session.read_cursor() as cursor:
+            table_names = ["DrainPoints", "RoadLines"]
+            table_names += [row.TableName for row in
+                            cursor.execute("SELECT TableName FROM DrainTypeDefinitions").fetchall()]
+            for table_name in table_names:
+                self._load_table(cursor, table_name)
+
+    def get_column_names(self, table_name):
+        self._ensure_table(table_name)
+        return self._table_column_names[table_name]
+
+    def get_column_data_type(self, table_name, col_name):
+        self._ensure_table(table_name)
+        return self._table_columns[table_name].get(col_name, None)
+
+    def is_data_type_match(self, table_name, col_name, data_value):
+        data_type = self.get_column_data_type(table_name, col_name)
+        validator = DATA_TYPE_VALIDATORS.get(data_type, None)
+        if validator is None:
+            return False
+        return validator(data_value)
+
+    def clear(self):
+        self._table_columns = {}
+        self._table_column_names = {}
+
+    def __getstate__(self):
+        # a loaded schema can be passed to worker processes, without the database session
+        state = self.__dict__.copy()
+        state['db_session'] = None
+        return state
+
+    def _ensure_table(self, table_name):
+        if table_name not in self._table_columns:
+            with self.db_session.read_cursor() as cursor:
+                self._load_table(cursor, table_name)
+
+    def _load_table(self, cursor, table_name):
+        column_rows = cursor.columns(table=table_name).fetchall()
+        self._table_column_names[table_name] = [row.column_name for row in column_rows]
+        self._table_columns[table_name] = dict((row.column_name, row.data_type) for row in column_rows)
+
+
+class DefinitionsIndex(object):
+    """
+    In memory index of the MetaData table, the definition tables listed in it and the ValueReassigns table
+    for translating shapefile values to definition IDs. Values are matched case insensitively. The index
+    is loaded once per session and is kept up to date as definitions are added or values are reassigned.
+    """
+    def __init__(self, db_session):
+        self.db_session = db_session
+        # field name -> definition table name
+        self._definition_tables = {}
+        # definition table name -> {definition value: definition ID}
+        self._definitions = {}
+        # definition table name -> {reassigned value: definition ID}
+        self._value_reassigns = {}
+
+    def load(self):
+        with self.db_session.read_cursor() as cursor:
+            for row in cursor.execute("SELECT IDFieldName, DefinitionTable FROM MetaData").fetchall():
+                self._definition_tables[_fold(row.IDFieldName)] = row.DefinitionTable
+
+            for def_table_name in set(self._definition_tables.values()):
+                definitions = self._definitions.setdefault(_fold(def_table_name), {})
+                for row in cursor.execute("SELECT * FROM {}".format(def_table_name)).fetchall():
+                    # first column has the definition ID and the second column has the definition value
+                    if row[1] is not None:
+                        definitions.setdefault(_fold(row[1]), row[0])
+
+            sql_select = "SELECT FromField, DefinitionID, DefinitionTable FROM ValueReassigns"
+            for row in cursor.execute(sql_select).fetchall():
+                if row.FromField is not None:
+                    value_reassigns = self._value_reassigns.setdefault(_fold(row.DefinitionTable), {})
+                    value_reassigns.setdefault(_fold(row.FromField), row.DefinitionID)
+
+    def get_definition_table(self, field_name):
+        """
+        Returns the name of the definition table for field_name or None if the field has no definition table
+        """
+        return self._definition_tables.get(_fold(field_name), None)
+
+    def get_definition_id(self, def_table_name, value):
+        """
+        Returns the ID of the definition matching value, or else the ID value has been reassigned to, or
+        None if the value is unknown
+        """
+        def_table_key = _fold(def_table_name)
+        value_key = _fold(value)
+        definition_id = self._definitions.get(def_table_key, {}).get(value_key, None)
+        if definition_id is None:
+            definition_id = self._value_reassigns.get(def_table_key, {}).get(value_key, None)
+        return definition_id
+
+    def add_definition(self, def_table_name, definition_id, definition):
+        definitions = self._definitions.setdefault(_fold(def_table_name), {})
+        definitions.setdefault(_fold(definition), definition_id)
+
+    def add_value_reassign(self, def_table_name, from_value, definition_id):
+        value_reassigns = self._value_reassigns.setdefault(_fold(def_table_name), {})
+        value_reassigns.setdefault(_fold(from_value), definition_id)
+
+    def __getstate__(self):
+        # a loaded index can be passed to worker processes, without the database session
+        state = self.__dict__.copy()
+        state['db_session'] = None
+        return state
+
+
+class DatabaseSession(object):
+    """
+    Database access for one preprocessing run: a single connection that is used for all writes during the
+    run and a small pool of connections for read only lookups. Use the session in place of opening a new
+    connection for each database call.
+    While a thread writes with writer_thread() (e.g., the thread importing a shapefile), only that thread can
+    commit or roll back the session.
+    """
+    def __init__(self, db_file, pool_size=2):
+        self.db_file = db_file
+        self.pool = ConnectionPool(db_file, size=pool_size)
+        self._conn = None
+        self._schema = None
+        self._definitions = None
+        # ident of the thread that is the only one allowed to commit or roll back (None for any thread)
+        self._writer_ident = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = connect(self.db_file)
+        return self._conn
+
+    @property
+    def schema(self):
+        if self._schema is None:
+            self._schema = SchemaCache(self)
+            self._schema.load()
+        return self._schema
+
+    @property
+    def definitions(self):
+        if self._definitions is None:
+            self._definitions = DefinitionsIndex(self)
+            self._definitions.load()
+        return self._definitions
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    def commit(self):
+        self._check_writer_thread()
+        if self._conn is not None:
+            self._conn.commit()
+
+    def rollback(self):
+        self._check_writer_thread()
+        if self._conn is not None:
+            self._conn.rollback()
+        # the definitions index may have entries that were just rolled back
+        self._definitions = None
+
+    @contextmanager
+    def writer_thread(self):
+        """
+        Makes the calling thread the only thread that can commit or roll back the session until the block
+        exits, so that no other thread commits the part of a shapefile imported so far
+        """
+        if self._writer_ident is not None:
+            raise Exception("The database is already being written by another import.")
+        self._writer_ident = threading.current_thread().ident
+        try:
+            yield self
+        finally:
+            self._writer_ident = None
+
+    def _check_writer_thread(self):
+        if self._writer_ident is not None and self._writer_ident != threading.current_thread().ident:
+            raise Exception("The database can't be changed while a shapefile is being imported.")
+
+    @contextmanager
+    def read_cursor(self):
+        """
+        Cursor for read only lookups. It does not see changes that are not committed yet by the session
+        connection.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        self.close()
+        return False
+
+
+class BatchWriter(object):
+    """
+    Collects parameterized inserts (or updates by key) for one table and writes them with executemany
+    in batches of batch_size rows. Rows with different sets of columns are written with separate
+    statements so that a column missing from a row still gets the database default value.
+    The writer does not commit - the caller commits once all rows have been flushed.
+    """
+    def __init__(self, cursor, table_name, key_field_name=None, batch_size=500):
+        self.cursor = cursor
+        self.table_name = table_name
+        self.key_field_name = key_field_name
+        self.batch_size = max(1, batch_size)
+        # (sql statement) -> list of parameter tuples
+        self._pending_rows = {}
+        self._pending_count = 0
+
+    def insert(self, row_data):
+        col_names = sorted(row_data.keys())
+        sql_insert = "INSERT INTO {table}({col_names}) VALUES ({params})"
+        sql_insert = sql_insert.format(table=self.table_name, col_names=",".join(col_names),
+                                       params=",".join("?" * len(col_names)))
+        self._add(sql_insert, tuple(row_data[col_name] for col_name in col_names))
+
+    def update(self, row_data, key_value):
+        if self.key_field_name is None:
+            raise Exception("Key field is required for updating {} table.".format(self.table_name))
+        col_names = sorted(col_name for col_name in row_data.keys() if col_name != self.key_field_name)
+        if not col_names:
+            return
+        sql_update = "UPDATE {table} SET {col_names} WHERE {key_field}=?"
+        sql_update = sql_update.format(table=self.table_name,
+                                       col_names=",".join(col_name + "=?" for col_name in col_names),
+                                       key_field=self.key_field_name)
+        self._add(sql_update, tuple(row_data[col_name] for col_name in col_names) + (key_value,))
+
+    def flush(self):
+        for sql, params in self._pending_rows.items():
+            self.cursor.executemany(sql, params)
+        self._pending_rows = {}
+        self._pending_count = 0
+
+    def _add(self, sql, params):
+        self._pending_rows.setdefault(sql, []).append(params)
+        self._pending_count += 1
+        if self._pending_count >= self.batch_size:
+            self.flush()
+
+
+_backends = [AccessBackend(), SQLiteBackend()]
+
+
+def register_backend(backend):
+    """
+    Adds a database backend. A backend needs the attribute file_extensions and the methods
+    connect(db_file), create_database(db_file, source_db_file=None),
+    reset_database(db_file, template_db_file=None) and compact_database(db_file).
+    """
+    _backends.insert(0, backend)
+
+
+def get_backend(db_file):
+    file_ext = os.path.splitext(db_file)[1].lower()
+    for backend in _backends:
+        if file_ext in backend.file_extensions:
+            return backend
+    raise Exception("No database backend available for database file {}.".format(db_file))
+
+
+def connect(db_file):
+    return get_backend(db_file).connect(db_file)
+
+
+def create_database(db_file, source_db_file=None):
+    get_backend(db_file).create_database(db_file, source_db_file=source_db_file)
+
+
+def create_database_from_template(db_file, template_db_file=TEMPLATE_DB_FILE):
+    """
+    Creates a GRAIP database that is ready for importing shapefiles: a copy of the template GRAIP database for
+    MS Access, else a database with the configuration and definitions copied from the template
+    """
+    if is_access_database(db_file):
+        shutil.copyfile(template_db_file, db_file)
+    else:
+        create_database(db_file, source_db_file=template_db_file)
+
+
+def reset_database(db_file, template_db_file=None):
+    """
+    Deletes all imported data from a GRAIP database, keeping its configuration, definition and mapping tables.
+    This is much faster than deleting the records of a large database (see core.clear_data_tables()).
+    There must be no open connections to the database.
+    """
+    get_backend(db_file).reset_database(db_file, template_db_file=template_db_file)
+
+
+def compact_database(db_file):
+    """
+    Gives the space of deleted records back to the file system. There must be no open connections to the
+    database.
+    """
+    get_backend(db_file).compact_database(db_file)
+
+
+def is_access_database(db_file):
+    return isinstance(get_backend(db_file), AccessBackend)
+
+
+def create_definition_and_attribute_tables(cursor):
+    """
+    Creates the definition tables listed in the MetaData table and the drain type attribute tables listed
+    in the DrainTypeDefinitions table (with the fields from FieldMatches) that don't exist yet
+    """
+    # avoid circular import
+    import core
+
+    existing_tables = set(row.table_name.lower() for row in cursor.tables())
+    id_field_names = set()
+    for row in cursor.execute("SELECT IDFieldName, DefinitionTable FROM MetaData").fetchall():
+        id_field_names.add(row.IDFieldName)
+        if row.DefinitionTable.lower() in existing_tables:
+            continue
+        columns = [(row.IDFieldName, "INTEGER PRIMARY KEY"), ("Definition", "VARCHAR(255)"),
+                   ("Description", "VARCHAR(255)")]
+        if row.IDFieldName in core.MULTIPLIER_FIELD_NAMES:
+            columns.append(("Multiplier", "DOUBLE"))
+        cursor.execute(_get_create_table_sql(row.DefinitionTable, columns))
+        existing_tables.add(row.DefinitionTable.lower())
+
+    for dp_type_row in cursor.execute("SELECT DrainTypeID, TableName FROM DrainTypeDefinitions").fetchall():
+        if dp_type_row.TableName.lower() in existing_tables:
+            continue
+        columns = [("GRAIPDID", "INTEGER PRIMARY KEY")]
+        field_rows = cursor.execute("SELECT DBField FROM FieldMatches WHERE AttTableID=?",
+                                    dp_type_row.DrainTypeID).fetchall()
+        for field_row in field_rows:
+            field_name = field_row.DBField
+            if field_name in core.DP_TABLE_FIELD_NAMES or field_name == "PipeDimID(oval)":
+                continue
+            if dp_type_row.TableName == "StrXingAtt" and field_name == "FillDepthID":
+                columns.append(("FillDepth", "DOUBLE"))
+            elif field_name in id_field_names:
+                columns.append((field_name, "INTEGER"))
+            else:
+                columns.append((field_name, "VARCHAR(255)"))
+        cursor.execute(_get_create_table_sql(dp_type_row.TableName, columns))
+        existing_tables.add(dp_type_row.TableName.lower())
+
+
+def create_missing_tables(cursor, table_names):
+    """
+    Creates the tables in table_names (tables of GRAIP_SCHEMA) that don't exist yet - for tables added to
+    the schema after a database was made
+    """
+    existing_tables = set(row.table_name.lower() for row in cursor.tables())
+    for table_name, columns in GRAIP_SCHEMA:
+        if table_name in table_names and table_name.lower() not in existing_tables:
+            cursor.execute(_get_create_table_sql(table_name, columns))
+
+
+def _copy_table_rows(src_cursor, dest_cursor, table_name):
+    src_cursor.execute("SELECT * FROM {}".format(_quote_name(table_name)))
+    col_names = [col[0] for col in src_cursor.description]
+    rows = [tuple(row) for row in src_cursor.fetchall()]
+    if rows:
+        sql_insert = "INSERT INTO {} ({}) VALUES ({})".format(_quote_name(table_name),
+                                                             ",".join(_quote_name(c) for c in col_names),
+                                                             ",".join("?" * len(col_names)))
+        dest_cursor.executemany(sql_insert, rows)
+
+
+def _copy_kept_tables(src_cursor, dest_cursor):
+    # copy the tables that are kept when a database is reset to a copy of the template GRAIP database
+    create_missing_tables(dest_cursor, [table_name for table_name, _ in GRAIP_SCHEMA])
+    src_table_names = set(row.table_name.lower() for row in src_cursor.tables())
+    table_names = [table_name for table_name, _ in GRAIP_SCHEMA if table_name not in GRAIP_DATA_TABLE_NAMES]
+    for table_name in table_names:
+        if table_name.lower() in src_table_names:
+            dest_cursor.execute("DELETE FROM {}".format(_quote_name(table_name)))
+            _copy_table_rows(src_cursor, dest_cursor, table_name)
+    create_definition_and_attribute_tables(dest_cursor)
+    for row in dest_cursor.execute("SELECT DISTINCT DefinitionTable FROM MetaData").fetchall():
+        dest_cursor.execute("DELETE FROM {}".format(_quote_name(row.DefinitionTable)))
+        _copy_table_rows(src_cursor, dest_cursor, row.DefinitionTable)
+
+
+def _get_temp_db_file(db_file, suffix):
+    db_file_wo_ext, db_file_ext = os.path.splitext(db_file)
+    return "{}_{}{}".format(db_file_wo_ext, suffix, db_file_ext)
+
+
+def _replace_db_file(new_db_file, db_file):
+    # os.rename() can't replace an existing file on Windows
+    os.remove(db_file)
+    os.rename(new_db_file, db_file)
+
+
+def _get_create_table_sql(table_name, columns):
+    col_defs = ",".join("{} {}".format(_quote_name(col_name), col_type) for col_name, col_type in columns)
+    return "CREATE TABLE {} ({})".format(_quote_name(table_name), col_defs)
+
+
+def _quote_name(name):
+    return "[{}]".format(name)
+
+
+def _get_sql_data_type(type_name):
+    # map a SQLite declared column type to the ODBC SQL data type code
+    if "CHAR" in type_name or "TEXT" in type_name or "CLOB" in type_name:
+        return SQL_VARCHAR
+    if "INT" in type_name:
+        return SQL_INTEGER
+    if "DOUBLE" in type_name or "FLOA" in type_name or "REAL" in type_name:
+        return SQL_DOUBLE
+    if "DATE" in type_name or "TIME" in type_name:
+        return SQL_TYPE_TIMESTAMP
+    return SQL_NUMERIC
+
+
+def _convert_datetime(value):
+    # dates are stored either in ISO format or as written from the shapefile (e.g., 01/12/2016 or 2016/12/01)
+    for date_format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d", "%m/%d/%Y", "%Y/%m/%d"):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    return value
+
+
+def _fold(value):
+    # key for case insensitive matching of definition values
+    if isinstance(value, basestring):
+        return value.lower()
+    return str(value).lower()
+
+
+def _is_text_value(data_value):
+    return type(data_value) is str
+
+
+def _is_integer_value(data_value):
+    if type(data_value) is int or type(data_value) is float:
+        return True
+    try:
+        int(data_value)
+        return True
+    except:
+        try:
+            float(data_value)
+            return True
+        except:
+            return False
+
+
+def _is_float_value(data_value):
+    return type(data_value) is float or type(data_value) is int
+
+
+def _is_date_value(data_value):
+    if type(data_value) is datetime:
+        return True
+    if isinstance(data_value, basestring) and len(data_value) >= 8:
+        # here we are checking only 2 date format (e.g., 01/12/2016 and 2016/12/01)
+        for date_format in ("%m/%d/%Y", "%Y/%m/%d"):
+            try:
+                datetime.strptime(data_value, date_format)
+                return True
+            except ValueError:
+                pass
+    return False
+
+
+# SQL data type -> function checking that a value can be written to a column of that type
+DATA_TYPE_VALIDATORS = {}
+for _data_types, _validator in ((TEXT_DATA_TYPES, _is_text_value), (INTEGER_DATA_TYPES, _is_integer_value),
+                                (FLOAT_DATA_TYPES, _is_float_value), (DATE_DATA_TYPES, _is_date_value)):
+    for _data_type in _data_types:
+        DATA_TYPE_VALIDATORS[_data_type] = _validator
+
+sqlite3.register_converter("DATETIME", _convert_datetime)
@@ -0,0 +1,323 @@
+"""
+Command line entry point for running the preprocessor without the wizard, e.g. as a scheduled task:
+
+    python graip_preprocess.py --db Project.mdb --dp Sump.shp Ditch.shp --rd Roads.shp --uninterrupted
+
+The run has the same steps as the wizard: file setup, drain point import, road line import and consolidation.
+Shapefiles imported by the previous run that have not changed since are skipped and changed shapefiles are
+imported again incrementally. Progress is written to stdout as JSON Lines (one JSON object per event with the
+event name in 'event') and the exit code tells how the run ended (EXIT_* below). With --processes, drain point
+shapefiles imported for the first time are read in that many worker processes.
+
+The mapping file (--mapping) is a JSON file with the choices made on the wizard pages:
+    {
+        "shapefiles": {
+            "Sump.shp": {"drain_type": "Sump", "field_matches": [["CDate", "DATE"], ["CTime", "TIME"]]},
+            "Roads.shp": {"road_network": "Forest Roads"}
+        },
+        "rules": ["closest_match", "use_default", "add_new"],
+        "table_rules": {"CondDefinitions": ["use_default"]},
+        "value_overrides": {"CondDefinitions": {"Fine": "Good"}}
+    }
+Shapefiles are looked up by path or by file name. As in the wizard, the drain type of a shapefile without an
+entry is matched with the shapefile name, the first road network is used and the field matches are taken from
+the mapping profile of the shapefile or matched using the FieldMatches table. rules, table_rules and
+value_overrides set up the resolution.ResolutionPolicy for the values that are not in the definitions tables.
+
+Without --uninterrupted nothing is imported if the shapefiles to import have values that are not in the
+definitions tables and not in value_overrides: the values are written to stdout (unknown_value events) and the
+run ends with EXIT_UNKNOWN_VALUES.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+import checkpoints
+import consolidate
+import core
+import graip_db
+import import_engine
+import mapping_profiles
+import matching
+import resolution
+
+EXIT_OK = 0
+# the run failed - see the error event
+EXIT_ERROR = 1
+# invalid command line arguments (the exit code of argparse)
+EXIT_USAGE = 2
+# values not in the definitions tables need a value override or --uninterrupted
+EXIT_UNKNOWN_VALUES = 3
+
+# DEM_Path written to the FileSetup table, as by the wizard
+DEM_FILE_PATH = "path will be set in future version"
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    try:
+        exit_code = run(args)
+    except KeyboardInterrupt:
+        write_event('error', message="Preprocessing was interrupted")
+        exit_code = EXIT_ERROR
+    except Exception as ex:
+        write_event('error', message=get_error_message(ex))
+        exit_code = EXIT_ERROR
+    write_event('finished', exit_code=exit_code)
+    return exit_code
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog='graip_preprocess',
+                                     description="Imports drain point and road line shapefiles into a GRAIP "
+                                                 "database and consolidates them without the wizard.")
+    parser.add_argument('--db', required=True,
+                        help="GRAIP database file (*.mdb, *.sqlite) - made from the GRAIP.mdb template if it "
+                             "does not exist")
+    parser.add_argument('--dp', required=True, nargs='+', metavar='SHP_FILE', help="drain point shapefiles")
+    parser.add_argument('--rd', required=True, nargs='+', metavar='SHP_FILE', help="road line shapefiles")
+    parser.add_argument('--mapping', help="JSON file with the drain types, road networks, field matches and "
+                                          "value resolution of the shapefiles")
+    parser.add_argument('--uninterrupted', action='store_true',
+                        help="resolve values not in the definitions tables without stopping")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="number of worker processes reading the drain point shapefiles imported for the "
+                             "first time (default: 1)")
+    parser.add_argument('--working-directory',
+                        help="directory for the log files and consolidated files (default: database directory)")
+    parser.add_argument('--output-format', choices=consolidate.OUTPUT_FORMATS, default=consolidate.SHAPEFILE_FORMAT,
+                        help="format of the consolidated files")
+    parser.add_argument('--include-attributes', action='store_true',
+                        help="write the database attributes to the consolidated files")
+    parser.add_argument('--json-log', help="JSON Lines file for the log entries of the run")
+    parser.add_argument('--reset', action='store_true',
+                        help="reset the database before importing (keeps definitions and field matches)")
+    parser.add_argument('--compact', action='store_true', help="compact the database after preprocessing")
+    return parser.parse_args(argv)
+
+
+def run(args):
+    """
+    Runs the preprocessing for the parsed command line arguments and returns the exit code
+    """
+    db_file = os.path.abspath(args.db)
+    dp_shp_files = [os.path.abspath(shp_file) for shp_file in args.dp]
+    rd_shp_files = [os.path.abspath(shp_file) for shp_file in args.rd]
+    for shp_file in dp_shp_files + rd_shp_files:
+        if not os.path.isfile(shp_file):
+            raise Exception("Shapefile {} does not exist.".format(shp_file))
+    mapping = load_mapping(args.mapping)
+    working_directory = os.path.abspath(args.working_directory or os.path.dirname(db_file))
+
+    if not os.path.isfile(db_file):
+        write_event('create_database', db_file=db_file)
+        graip_db.create_database_from_template(db_file)
+    elif args.reset:
+        write_event('reset_database', db_file=db_file)
+        graip_db.reset_database(db_file, template_db_file=graip_db.TEMPLATE_DB_FILE)
+
+    db_file_name_wo_ext = os.path.basename(db_file).split('.')[0]
+    dp_log_file = os.path.join(working_directory, db_file_name_wo_ext + 'DP.log')
+    rd_log_file = os.path.join(working_directory, db_file_name_wo_ext + 'RD.log')
+    with graip_db.DatabaseSession(db_file) as db_session:
+        exit_code = preprocess(db_session, args, mapping, dp_shp_files, rd_shp_files, dp_log_file, rd_log_file,
+                               working_directory)
+
+    if exit_code == EXIT_OK and args.compact:
+        write_event('compact_database', db_file=db_file)
+        graip_db.compact_database(db_file)
+    return exit_code
+
+
+def preprocess(db_session, args, mapping, dp_shp_files, rd_shp_files, dp_log_file, rd_log_file,
+               working_directory):
+    # file setup
+    cursor = db_session.cursor()
+    cursor.execute("DELETE FROM FileSetup")
+    cursor.execute("INSERT INTO FileSetup(GRAIP_DB_File, DEM_Path, Road_Shapefiles, DrainPoints_Shapefiles) "
+                   "VALUES (?, ?, ?, ?)", db_session.db_file, DEM_FILE_PATH, ','.join(rd_shp_files),
+                   ','.join(dp_shp_files))
+    db_session.commit()
+    core.create_log_file(graip_db_file=db_session.db_file, log_file=dp_log_file, log_type='DP')
+    core.create_log_file(graip_db_file=db_session.db_file, log_file=rd_log_file, log_type='RD')
+    shp_files = [('DP', shp_file) for shp_file in dp_shp_files] + [('RD', shp_file) for shp_file in rd_shp_files]
+    run_checkpoints = checkpoints.restore_checkpoints(db_session, shp_files)
+
+    resolution_policy = resolution.ResolutionPolicy(db_session,
+                                                    rules=mapping.get('rules', resolution.DEFAULT_RULES),
+                                                    table_rules=mapping.get('table_rules', None),
+                                                    value_overrides=mapping.get('value_overrides', None))
+    engine = import_engine.ImportEngine(db_session, dp_log_file, rd_log_file, is_uninterrupted=True,
+                                        progress_callback=report_import_progress,
+                                        log_writer=core.LogWriter(db_session, json_log_file=args.json_log),
+                                        resolution_policy=resolution_policy)
+
+    # decide what to do with each shapefile before importing any of them
+    imports = []
+    is_dp_changed = False
+    for shp_type, shp_file in shp_files:
+        spec, field_matches, attribute_names = get_import_spec(db_session, shp_type, shp_file, mapping)
+        checkpoint = run_checkpoints[(shp_type, shp_file)]
+        import_call = checkpoints.get_import_call(engine, checkpoint, spec, is_dp_changed=is_dp_changed)
+        if shp_type == 'DP' and import_call is not None:
+            is_dp_changed = True
+        imports.append((spec, field_matches, attribute_names, checkpoint, import_call))
+
+    if not args.uninterrupted:
+        specs = [import_entry[0] for import_entry in imports if import_entry[4] is not None]
+        unknown_values = [unknown_value for unknown_value in engine.scan_unknown_values(specs)
+                          if not resolution_policy.has_override(unknown_value.value,
+                                                                unknown_value.definition_table_name)]
+        for unknown_value in unknown_values:
+            write_event('unknown_value', value=unknown_value.value, field_name=unknown_value.field_name,
+                        definition_table=unknown_value.definition_table_name, count=unknown_value.count,
+                        shp_files=unknown_value.shp_files)
+        if unknown_values:
+            return EXIT_UNKNOWN_VALUES
+
+    imports_by_file = dict(((import_entry[0].shp_type, import_entry[0].shp_file), import_entry)
+                           for import_entry in imports)
+
+    def start_import(spec):
+        checkpoint = imports_by_file[(spec.shp_type, spec.shp_file)][3]
+        write_event('import_shapefile', shp_type=spec.shp_type, shp_file=spec.shp_file,
+                    is_update=checkpoint.is_imported)
+        checkpoints.start_import(db_session, checkpoint)
+
+    def commit_import(spec):
+        _, field_matches, attribute_names, checkpoint, _ = imports_by_file[(spec.shp_type, spec.shp_file)]
+        first_id, last_id = engine.get_imported_id_range(spec)
+        checkpoints.commit_import(db_session, checkpoint, spec, first_id, last_id)
+        mapping_profiles.save_profile(db_session, spec.shp_type, spec.drain_type_name, attribute_names,
+                                      field_matches)
+
+    for import_group in get_import_groups(engine, imports, args.processes):
+        spec, _, _, _, import_call = import_group[0]
+        try:
+            if import_call is None:
+                write_event('skip_shapefile', shp_type=spec.shp_type, shp_file=spec.shp_file)
+            elif len(import_group) > 1:
+                engine.import_drain_point_files([import_entry[0] for import_entry in import_group],
+                                                processes=args.processes, start_callback=start_import,
+                                                commit_callback=commit_import)
+            else:
+                import_function, import_args = import_call
+                start_import(spec)
+                import_function(*import_args)
+                commit_import(spec)
+        except:
+            db_session.rollback()
+            raise
+
+    write_event('check_orphans')
+    core.check_for_orphans_and_duplicates(db_session, dp_log_file, rd_log_file)
+    consolidation_engine = consolidate.ConsolidationEngine(working_directory,
+                                                           progress_callback=report_consolidation_progress,
+                                                           output_format=args.output_format, db_session=db_session,
+                                                           include_attributes=args.include_attributes)
+    consolidation_engine.run(dp_shp_files, rd_shp_files)
+    for layer_name in ("DrainPoints", "RoadLines"):
+        write_event('consolidated_layer', layer_name=layer_name,
+                    file=consolidation_engine.get_consolidated_file(layer_name),
+                    field_names=consolidation_engine.get_field_names(layer_name))
+    return EXIT_OK
+
+
+def get_import_groups(engine, imports, processes):
+    """
+    Splits the imports into the groups imported in one go: with processes > 1, consecutive drain point
+    shapefiles imported for the first time are read by a pool of worker processes (see
+    ImportEngine.import_drain_point_files()). Any other import is a group of its own.
+    """
+    def is_pooled(import_entry):
+        import_call = import_entry[4]
+        return processes > 1 and import_call is not None and import_call[0] == engine.import_drain_points
+
+    import_groups = []
+    for import_entry in imports:
+        if is_pooled(import_entry) and import_groups and is_pooled(import_groups[-1][-1]):
+            import_groups[-1].append(import_entry)
+        else:
+            import_groups.append([import_entry])
+    return import_groups
+
+
+def load_mapping(mapping_file):
+    if mapping_file is None:
+        return {}
+    with open(mapping_file, 'r') as file_obj:
+        return json.load(file_obj)
+
+
+def get_import_spec(db_session, shp_type, shp_file, mapping):
+    """
+    Returns the import_engine.ShapefileImportSpec, the (target field, source field) pairs and the attribute
+    field names of a shapefile, made from its entry in the mapping file or else chosen as in the wizard
+    """
+    shp_file_mapping = get_shapefile_mapping(mapping, shp_file)
+    attribute_names = core.get_shapefile_attribute_column_names(shp_file)
+    drain_type_name = None
+    road_network_name = None
+    with db_session.read_cursor() as cursor:
+        if shp_type == 'DP':
+            drain_type_name = shp_file_mapping.get('drain_type', None)
+            if drain_type_name is None:
+                drain_type_names = [row.DrainTypeName for row in
+                                    cursor.execute("SELECT DrainTypeName FROM DrainTypeDefinitions").fetchall()]
+                if not drain_type_names:
+                    raise Exception("There are no drain types in the GRAIP database.")
+                drain_type_name = drain_type_names[matching.match_drain_type(os.path.basename(shp_file),
+                                                                             drain_type_names)]
+        else:
+            road_network_name = shp_file_mapping.get('road_network', None)
+            if road_network_name is None:
+                rd_network_def_row = cursor.execute("SELECT RoadNetwork FROM RoadNetworkDefinitions").fetchone()
+                if rd_network_def_row is not None:
+                    road_network_name = rd_network_def_row.RoadNetwork
+
+    if 'field_matches' in shp_file_mapping:
+        field_matches = [(str(target_field_name), None if src_field_name is None else str(src_field_name))
+                         for target_field_name, src_field_name in shp_file_mapping['field_matches']]
+    else:
+        field_matches = mapping_profiles.get_field_matches(db_session, shp_type, drain_type_name, attribute_names)
+    spec = import_engine.ShapefileImportSpec(shp_type=shp_type, shp_file=shp_file, field_matches=field_matches,
+                                             drain_type_name=drain_type_name, road_network_name=road_network_name)
+    return spec, field_matches, attribute_names
+
+
+def get_shapefile_mapping(mapping, shp_file):
+    # the entry of the mapping file for a shapefile, keyed by the shapefile path or name
+    for key, shp_file_mapping in mapping.get('shapefiles', {}).items():
+        if os.path.abspath(key) == shp_file or key.lower() == os.path.basename(shp_file).lower():
+            return shp_file_mapping
+    return {}
+
+
+def report_import_progress(shp_file, count_done, count_total):
+    write_event('progress', shp_file=shp_file, count_done=count_done, count_total=count_total)
+
+
+def report_consolidation_progress(layer_name, count_done, count_total):
+    write_event('progress', layer_name=layer_name, count_done=count_done, count_total=count_total)
+
+
+def write_event(event, **fields):
+    fields['event'] = event
+    sys.stdout.write(json.dumps(fields, default=str, sort_keys=True) + '\n')
+    sys.stdout.flush()
+
+
+def get_error_message(exception):
+    err_message = str(exception)
+    # database errors from pyodbc have the driver message as the 2nd argument
+    if len(exception.args) > 1:
+        err_message = "{}\n{}".format(exception.args[0], exception.args[1])
+    return err_message
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
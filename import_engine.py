@@ -0,0 +1,972 @@
+"""
+Headless import of drain point and road line shapefiles into a GRAIP database. The wizard pages in
+preprocessor.pyw are thin clients of the ImportEngine; it can equally be driven from a script without
+a QApplication.
+
+Importing a shapefile has two steps: the features are read and transformed to database rows by running
+the field mapping plan (FieldMappingPlan) compiled for the shapefile (transform_features), and the rows are
+then written to the database by the ImportEngine, which also resolves the values that need the database
+(or the user). The first step does not use the database and so it can run in worker processes.
+"""
+
+import os
+import collections
+import hashlib
+import itertools
+import multiprocessing
+import threading
+
+from osgeo import ogr
+
+import core
+import graip_db
+import resolution
+
+# attribute values that can't be transformed without the database
+ISSUE_TYPE_MISMATCH = 'type_mismatch'
+ISSUE_UNKNOWN_DEFINITION = 'unknown_definition'
+
+# the features imported from each shapefile: feature ID -> GRAIPDID/GRAIPRID and attribute hash
+IMPORTED_FEATURES_TABLE_NAME = "ImportedFeatures"
+
+
+class ShapefileImportSpec(object):
+    """
+    What to import from one shapefile. field_matches is an ordered list of (target field, source field)
+    pairs as shown in the wizard's field match table. A source field of None (or '<No Match Use Default>')
+    means that the database default is used for the target field.
+    """
+    def __init__(self, shp_type, shp_file, field_matches, drain_type_name=None, road_network_name=None):
+        if shp_type not in ('DP', 'RD'):
+            raise Exception("{} is not a valid shapefile type.".format(shp_type))
+        if shp_type == 'DP' and not drain_type_name:
+            raise Exception("Drain type is required for importing drain point shapefile {}.".format(shp_file))
+
+        self.shp_type = shp_type
+        self.shp_file = shp_file
+        self.field_matches = [(target_fld, None if src_fld == core.NO_MATCH_USE_DEFAULT else src_fld)
+                              for target_fld, src_fld in field_matches]
+        self.drain_type_name = drain_type_name
+        self.road_network_name = road_network_name
+
+
+class PendingValue(object):
+    """
+    A shapefile attribute value that is resolved when the feature is written to the database: a value not
+    matching the column data type (ISSUE_TYPE_MISMATCH) or a value not in the definitions table
+    (ISSUE_UNKNOWN_DEFINITION)
+    """
+    def __init__(self, issue, is_att_row, table_name, field_name, src_field_name, att_value,
+                 definition_table_name=None):
+        self.issue = issue
+        self.is_att_row = is_att_row
+        self.table_name = table_name
+        self.field_name = field_name
+        self.src_field_name = src_field_name
+        self.att_value = att_value
+        self.definition_table_name = definition_table_name
+
+
+class TransformedFeature(object):
+    """
+    The database rows of one shapefile feature: row_data for the DrainPoints or RoadLines table and
+    att_row_data for the drain type attribute table. The GRAIPDID/GRAIPRID is set by the writer.
+    feature_id is the ID of the feature in the shapefile and attribute_hash the hash of its source field values.
+    """
+    def __init__(self, row_data):
+        self.row_data = row_data
+        self.att_row_data = {}
+        self.pending_values = []
+        self.feature_id = None
+        self.attribute_hash = None
+
+    def set_value(self, is_att_row, field_name, value):
+        if value is None:
+            return
+        if is_att_row:
+            self.att_row_data[field_name] = value
+        else:
+            self.row_data[field_name] = value
+
+
+class UnknownValue(object):
+    """
+    A distinct shapefile value that is neither in the definitions table of its field nor in ValueReassigns.
+    count is the number of times the value was found and shp_files the shapefiles it was found in.
+    """
+    def __init__(self, value, field_name, definition_table_name, is_multiplier=False):
+        self.value = value
+        self.field_name = field_name
+        self.definition_table_name = definition_table_name
+        self.is_multiplier = is_multiplier
+        self.count = 0
+        self.shp_files = []
+
+
+class ImportEngine(object):
+    """
+    Imports drain point and road line shapefiles to a GRAIP database using the database session
+    (graip_db.DatabaseSession) of the run. The caller owns the session and closes it.
+
+    progress_callback(shp_file, count_done, count_total) is called at most max_progress_rate times per second
+    (see core.ProgressThrottle) and once more when a shapefile is complete.
+    message_callback(title, message) is called for data type mismatches in step by step mode.
+    define_value_callback(value, field_name, def_table_name, is_multiplier) is called in step by step mode
+    for a value not found in a definitions table and must return (definition_id, action_taken_msg). Without
+    it (or in uninterrupted mode) such values are resolved by resolution_policy (resolution.ResolutionPolicy),
+    which by default makes the choice the Define Value dialog preselects.
+
+    Each shapefile is imported in one transaction: rows are written in batches of batch_size rows and
+    committed once the whole shapefile has been imported. On error the caller rolls back the session.
+    Log entries go through log_writer (core.LogWriter) and are written at the end of each shapefile or when
+    the import of a shapefile fails.
+
+    cancel() may be called from another thread than the one running the import: the shapefile being imported
+    then fails with an exception before it is committed.
+    """
+    def __init__(self, db_session, dp_log_file, rd_log_file, is_uninterrupted=True, progress_callback=None,
+                 message_callback=None, define_value_callback=None, batch_size=500, log_writer=None,
+                 resolution_policy=None, max_progress_rate=10):
+        self.db_session = db_session
+        self.dp_log_file = dp_log_file
+        self.rd_log_file = rd_log_file
+        self.is_uninterrupted = is_uninterrupted
+        self.progress_callback = progress_callback
+        self.max_progress_rate = max_progress_rate
+        self.message_callback = message_callback
+        self.define_value_callback = define_value_callback
+        self.batch_size = batch_size
+        self.log_writer = log_writer if log_writer is not None else core.LogWriter(db_session)
+        if resolution_policy is None:
+            resolution_policy = resolution.ResolutionPolicy(db_session, batch_size=batch_size)
+        self.resolution_policy = resolution_policy
+        # DrainID -> (GRAIPDID, StreamConnectID) of the drain points in the database for linking roads to
+        # drain points - rebuilt after drain points have been imported
+        self._drain_point_links = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def run(self, dp_specs, rd_specs, processes=None):
+        """
+        Imports all drain point shapefiles followed by all road line shapefiles. Drain points need to be
+        in the database before roads are imported so that roads can be linked to their drain points.
+        With processes > 1 the drain point shapefiles are read in that many worker processes.
+        """
+        self.import_drain_point_files(dp_specs, processes=processes)
+        for spec in rd_specs:
+            self.import_road_lines(spec)
+
+    def import_drain_points(self, spec):
+        """
+        Imports one drain point shapefile. A shapefile imported before is imported again with
+        update_drain_points().
+        Returns the first GRAIPDID used for this shapefile.
+        """
+        plan = self.compile_plan(spec)
+        features = transform_features(spec.shp_file, plan, self.db_session.definitions)
+        return self._write_drain_points(spec, plan.att_table_name, features, get_feature_count(spec.shp_file))
+
+    def import_drain_point_files(self, specs, processes=None, start_callback=None, commit_callback=None):
+        """
+        Imports drain point shapefiles. With processes > 1 the shapefiles are read and transformed in batches of
+        core.FEATURE_BATCH_SIZE features in a pool of worker processes while this process writes the rows of
+        each batch as soon as it is ready. The workers are at most 2 batches per process ahead of the writer
+        so that only those batches are held in memory. The rows are written in the order of specs so GRAIPDIDs
+        are assigned the same as when importing the shapefiles one after the other.
+        start_callback(spec) is called before a shapefile is written and commit_callback(spec) once it has
+        been committed (e.g., to record the import in the checkpoints).
+        Returns the first GRAIPDID used for each shapefile.
+        """
+        if processes is None or processes < 2:
+            first_graipids = []
+            for spec in specs:
+                if start_callback is not None:
+                    start_callback(spec)
+                first_graipids.append(self.import_drain_points(spec))
+                if commit_callback is not None:
+                    commit_callback(spec)
+            return first_graipids
+
+        # the plans and a copy of the definitions index are passed to each worker once - values the workers
+        # can't resolve with the index are resolved by the writer
+        plans = [self.compile_plan(spec) for spec in specs]
+        feature_counts = [get_feature_count(spec.shp_file) for spec in specs]
+        batch_ranges = [_get_batch_ranges(feature_count) for feature_count in feature_counts]
+        tasks = [(spec.shp_file, plan_index, start_index, end_index)
+                 for plan_index, (spec, ranges) in enumerate(zip(specs, batch_ranges))
+                 for start_index, end_index in ranges]
+        pool = multiprocessing.Pool(processes=processes, initializer=_init_worker,
+                                    initargs=(plans, self.db_session.definitions))
+        try:
+            batches = _imap_bounded(pool, _transform_features_task, tasks, 2 * processes)
+            first_graipids = []
+            for spec, plan, feature_count, ranges in zip(specs, plans, feature_counts, batch_ranges):
+                features = itertools.chain.from_iterable(itertools.islice(batches, len(ranges)))
+                if start_callback is not None:
+                    start_callback(spec)
+                first_graipids.append(self._write_drain_points(spec, plan.att_table_name, features,
+                                                               feature_count))
+                if commit_callback is not None:
+                    commit_callback(spec)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return first_graipids
+
+    def import_road_lines(self, spec):
+        """
+        Imports one road line shapefile. A shapefile imported before is imported again with
+        update_road_lines().
+        Returns the first GRAIPRID used for this shapefile.
+        """
+        plan = self.compile_plan(spec)
+        features = transform_features(spec.shp_file, plan, self.db_session.definitions)
+        return self._write_road_lines(spec, features, get_feature_count(spec.shp_file))
+
+    def update_drain_points(self, spec, is_forced=False):
+        """
+        Imports a drain point shapefile again after it has changed. Its features are compared with the
+        features last imported from it (ImportedFeatures) by feature ID and attribute hash: only new, changed
+        and deleted features are written and all other records are left as they are. The GRAIPDIDs of the
+        features already imported are kept. With is_forced (e.g., when the field matches have changed) all
+        features are written again, still keeping their GRAIPDIDs.
+        Returns the first GRAIPDID of the records of the shapefile.
+        """
+        plan = self.compile_plan(spec)
+        imported_features = self.get_imported_features(spec)
+        features = transform_features(spec.shp_file, plan, self.db_session.definitions)
+        return self._write_drain_points(spec, plan.att_table_name, features, get_feature_count(spec.shp_file),
+                                        imported_features=imported_features, is_forced=is_forced)
+
+    def update_road_lines(self, spec, is_forced=False):
+        """
+        Imports a road line shapefile again after it has changed, writing only new, changed and deleted
+        features and keeping the GRAIPRIDs of the features already imported (see update_drain_points()).
+        Road lines need to be written again (is_forced) to link them to changed drain points.
+        Returns the first GRAIPRID of the records of the shapefile.
+        """
+        plan = self.compile_plan(spec)
+        imported_features = self.get_imported_features(spec)
+        features = transform_features(spec.shp_file, plan, self.db_session.definitions)
+        return self._write_road_lines(spec, features, get_feature_count(spec.shp_file),
+                                      imported_features=imported_features, is_forced=is_forced)
+
+    def get_imported_features(self, spec):
+        """
+        Returns feature ID -> (GRAIPDID/GRAIPRID, attribute hash) of the features last imported from the
+        shapefile of spec
+        """
+        cursor = self.db_session.cursor()
+        graip_db.create_missing_tables(cursor, (IMPORTED_FEATURES_TABLE_NAME,))
+        sql_select = "SELECT FeatureID, RecordID, AttributeHash FROM {} WHERE ShpType=? AND " \
+                     "ShpFile=?".format(IMPORTED_FEATURES_TABLE_NAME)
+        return dict((row.FeatureID, (row.RecordID, row.AttributeHash))
+                    for row in cursor.execute(sql_select, spec.shp_type, spec.shp_file).fetchall())
+
+    def get_imported_id_range(self, spec):
+        """
+        Returns the first and last GRAIPDID/GRAIPRID of the records imported from the shapefile of spec
+        ((None, None) if there are none)
+        """
+        sql_select = "SELECT MIN(RecordID) AS FirstID, MAX(RecordID) AS LastID FROM {} WHERE ShpType=? AND " \
+                     "ShpFile=?".format(IMPORTED_FEATURES_TABLE_NAME)
+        row = self.db_session.cursor().execute(sql_select, spec.shp_type, spec.shp_file).fetchone()
+        return row.FirstID, row.LastID
+
+    def scan_unknown_values(self, specs, plans=None):
+        """
+        Reads the fields having a definitions table of the shapefiles of specs without writing to the
+        database and returns the distinct values (UnknownValue) that are not in the definitions, in the order
+        they were found. Once these values have been defined (e.g., with core.save_definition_action()) the
+        shapefiles are imported without calling define_value_callback. plans are the field mapping plans of
+        the shapefiles if already compiled.
+        """
+        if plans is None:
+            plans = [self.compile_plan(spec) for spec in specs]
+        definitions = self.db_session.definitions
+        unknown_values = []
+        # (definitions table, value) -> UnknownValue, or None for values in the definitions
+        scanned_values = {}
+        for spec, plan in zip(specs, plans):
+            field_mappings = [field_mapping for field_mapping in plan.field_mappings
+                              if field_mapping.definition_table_name is not None]
+            if not field_mappings:
+                continue
+            src_field_names = list(set(field_mapping.src_field_name for field_mapping in field_mappings))
+            for batch in core.read_shapefile_batches(spec.shp_file, src_field_names):
+                self._check_cancelled()
+                for field_mapping in field_mappings:
+                    def_table_name = field_mapping.definition_table_name
+                    for att_value in batch[field_mapping.src_field_name]:
+                        if not att_value:
+                            continue
+                        att_value = plan.clean_value(att_value)
+                        key = (def_table_name.lower(), att_value.lower() if isinstance(att_value, basestring)
+                               else att_value)
+                        if key not in scanned_values:
+                            unknown_value = None
+                            if definitions.get_definition_id(def_table_name, att_value) is None:
+                                unknown_value = UnknownValue(att_value, field_mapping.field_name, def_table_name,
+                                                             field_mapping.field_name in core.MULTIPLIER_FIELD_NAMES)
+                                unknown_values.append(unknown_value)
+                            scanned_values[key] = unknown_value
+                        unknown_value = scanned_values[key]
+                        if unknown_value is not None:
+                            unknown_value.count += 1
+                            if spec.shp_file not in unknown_value.shp_files:
+                                unknown_value.shp_files.append(spec.shp_file)
+        return unknown_values
+
+    def compile_plan(self, spec):
+        """
+        Returns the field mapping plan (FieldMappingPlan) for importing the shapefile of spec
+        """
+        cursor = self.db_session.cursor()
+        if spec.shp_type == 'RD':
+            rd_network_def_row = cursor.execute("SELECT RoadNetworkID FROM RoadNetworkDefinitions WHERE "
+                                                "RoadNetwork=?", spec.road_network_name).fetchone()
+            road_network_id = rd_network_def_row.RoadNetworkID if rd_network_def_row is not None else None
+            return FieldMappingPlan.compile_road_lines(spec, road_network_id, self.db_session.definitions,
+                                                       self.db_session.schema)
+
+        # find drain type attribute table name - this is the table to which we will be writing data in addition
+        # to writing data to the DrainPoints table
+        drain_type_def_row = cursor.execute("SELECT DrainTypeID, TableName FROM DrainTypeDefinitions WHERE "
+                                            "DrainTypeName=?", spec.drain_type_name).fetchone()
+        if drain_type_def_row is None:
+            raise Exception("No matching drain type attribute table was found")
+        return FieldMappingPlan.compile_drain_points(spec, drain_type_def_row.DrainTypeID,
+                                                     drain_type_def_row.TableName, self.db_session.definitions,
+                                                     self.db_session.schema)
+
+    def _write_drain_points(self, spec, att_table_name, features, feature_count, imported_features=None,
+                            is_forced=False):
+        try:
+            return self._write_drain_point_rows(spec, att_table_name, features, feature_count, imported_features,
+                                                is_forced)
+        except:
+            # keep the log entries of the failed shapefile - the caller rolls back the session
+            self.log_writer.flush_files()
+            self.resolution_policy.clear()
+            raise
+
+    def _write_road_lines(self, spec, features, feature_count, imported_features=None, is_forced=False):
+        try:
+            return self._write_road_line_rows(spec, features, feature_count, imported_features, is_forced)
+        except:
+            # keep the log entries of the failed shapefile - the caller rolls back the session
+            self.log_writer.flush_files()
+            self.resolution_policy.clear()
+            raise
+
+    def _write_drain_point_rows(self, spec, att_table_name, features, feature_count, imported_features,
+                                is_forced):
+        cursor = self.db_session.cursor()
+        feature_tracker = _ImportedFeatureTracker(cursor, spec, imported_features, is_forced, self.batch_size)
+        graipid = self._get_next_id(cursor, "DrainPoints", "GRAIPDID")
+        first_graipid = graipid
+
+        dp_writer = graip_db.BatchWriter(cursor, "DrainPoints", batch_size=self.batch_size)
+        dp_att_writer = graip_db.BatchWriter(cursor, att_table_name, batch_size=self.batch_size)
+        # drain points for which the DrainID can only be set after they have been written
+        read_back_graipids = set()
+        progress = core.ProgressThrottle(self._get_shp_file_progress_callback(spec.shp_file), feature_count,
+                                         max_rate=self.max_progress_rate)
+        progress_counter = 0
+        track_field_mismatch = []
+        # for each drain point in shapefile
+        for feature in features:
+            progress_counter += 1
+            self._check_cancelled()
+            progress.update(progress_counter)
+            feature_graipid = feature_tracker.get_record_id(feature, graipid)
+            if feature_graipid is None:
+                # the feature has not changed
+                continue
+            if feature_graipid == graipid:
+                graipid += 1
+            elif not is_forced:
+                # the feature has changed - its records are written again
+                cursor.execute("DELETE FROM DrainPoints WHERE GRAIPDID=?", feature_graipid)
+                cursor.execute("DELETE FROM {} WHERE GRAIPDID=?".format(att_table_name), feature_graipid)
+
+            dp_row_data = feature.row_data
+            dp_row_data['GRAIPDID'] = feature_graipid
+            feature.att_row_data['GRAIPDID'] = feature_graipid
+            self._resolve_pending_values(feature, spec.shp_file, feature_graipid, spec.drain_type_name,
+                                         track_field_mismatch, core.DP_ERROR_LOG_TABLE_NAME)
+
+            # set data for the DrainID field in DrainPoints table
+            if not self._set_drain_id(dp_row_data, 'DrainID', 'CTime'):
+                read_back_graipids.add(feature_graipid)
+
+            # insert data to DrainPoints table
+            dp_writer.insert(dp_row_data)
+
+            # insert data to matching attribute table
+            dp_att_writer.insert(feature.att_row_data)
+
+        progress.update(progress_counter, force=True)
+        dp_writer.flush()
+        dp_att_writer.flush()
+        feature_tracker.finish()
+
+        if read_back_graipids:
+            sql_select = "SELECT GRAIPDID, CDate, CTime, VehicleID FROM DrainPoints " \
+                         "WHERE GRAIPDID>=? AND GRAIPDID<=?"
+            dp_rows = [dp_row for dp_row in cursor.execute(sql_select, min(read_back_graipids),
+                                                           max(read_back_graipids)).fetchall()
+                       if dp_row.GRAIPDID in read_back_graipids]
+            drain_ids = core.compute_drain_ids([dp_row.CTime for dp_row in dp_rows],
+                                               [dp_row.CDate for dp_row in dp_rows],
+                                               [dp_row.VehicleID for dp_row in dp_rows])
+            drain_id_data = [(float(drain_id), dp_row.GRAIPDID) for drain_id, dp_row in zip(drain_ids, dp_rows)
+                             if _is_drain_id(drain_id)]
+            if drain_id_data:
+                cursor.executemany("UPDATE DrainPoints SET DrainID=? WHERE GRAIPDID=?", drain_id_data)
+
+        self._check_cancelled()
+        self.resolution_policy.flush()
+        self.log_writer.flush()
+        if imported_features is not None:
+            first_graipid = self.get_imported_id_range(spec)[0]
+        self.db_session.commit()
+        self._drain_point_links = None
+        return first_graipid
+
+    def _write_road_line_rows(self, spec, features, feature_count, imported_features, is_forced):
+        cursor = self.db_session.cursor()
+        rd_network_type = spec.road_network_name
+        feature_tracker = _ImportedFeatureTracker(cursor, spec, imported_features, is_forced, self.batch_size)
+        graipid = self._get_next_id(cursor, "RoadLines", "GRAIPRID")
+        first_graiprid = graipid
+
+        rd_writer = graip_db.BatchWriter(cursor, "RoadLines", batch_size=self.batch_size)
+        drain_point_links = self._get_drain_point_links(cursor)
+        # road lines for which the OrigDrainID fields can only be set after they have been written
+        read_back_graiprids = set()
+        progress = core.ProgressThrottle(self._get_shp_file_progress_callback(spec.shp_file), feature_count,
+                                         max_rate=self.max_progress_rate)
+        progress_counter = 0
+        track_field_mismatch = []
+        # for each road line in shapefile
+        for feature in features:
+            progress_counter += 1
+            self._check_cancelled()
+            progress.update(progress_counter)
+            feature_graiprid = feature_tracker.get_record_id(feature, graipid)
+            if feature_graiprid is None:
+                # the feature has not changed
+                continue
+            if feature_graiprid == graipid:
+                graipid += 1
+            elif not is_forced:
+                # the feature has changed - its record is written again
+                cursor.execute("DELETE FROM RoadLines WHERE GRAIPRID=?", feature_graiprid)
+
+            rd_row_data = feature.row_data
+            rd_row_data['GRAIPRID'] = feature_graiprid
+            self._resolve_pending_values(feature, spec.shp_file, feature_graiprid, rd_network_type,
+                                         track_field_mismatch, core.DP_ERROR_LOG_TABLE_NAME)
+
+            # set data for the DrainID fields in RoadLines table
+            is_drain_id1_set = self._set_drain_id(rd_row_data, 'OrigDrainID1', 'CTime1')
+            is_drain_id2_set = self._set_drain_id(rd_row_data, 'OrigDrainID2', 'CTime2')
+            if is_drain_id1_set and is_drain_id2_set:
+                # populate the GRAIPDID1, GRAIPDID2, StreamConnect1ID, StreamConnect2ID
+                rd_row_data.update(self._link_road_to_drain_points(feature_graiprid,
+                                                                   rd_row_data.get('OrigDrainID1', None),
+                                                                   rd_row_data.get('OrigDrainID2', None),
+                                                                   drain_point_links, rd_network_type))
+            else:
+                read_back_graiprids.add(feature_graiprid)
+
+            # insert data to RoadLines table
+            rd_writer.insert(rd_row_data)
+
+        progress.update(progress_counter, force=True)
+        rd_writer.flush()
+        feature_tracker.finish()
+
+        if read_back_graiprids:
+            sql_select = "SELECT GRAIPRID, CDate, CTime1, CTime2, VehicleID FROM RoadLines " \
+                         "WHERE GRAIPRID>=? AND GRAIPRID<=?"
+            rd_rows = [rd_row for rd_row in cursor.execute(sql_select, min(read_back_graiprids),
+                                                           max(read_back_graiprids)).fetchall()
+                       if rd_row.GRAIPRID in read_back_graiprids]
+            cdates = [rd_row.CDate for rd_row in rd_rows]
+            vehicle_ids = [rd_row.VehicleID for rd_row in rd_rows]
+            orig_drain_ids1 = core.compute_drain_ids([rd_row.CTime1 for rd_row in rd_rows], cdates, vehicle_ids)
+            orig_drain_ids2 = core.compute_drain_ids([rd_row.CTime2 for rd_row in rd_rows], cdates, vehicle_ids)
+            rd_writer = graip_db.BatchWriter(cursor, "RoadLines", key_field_name="GRAIPRID",
+                                             batch_size=self.batch_size)
+            for rd_row, orig_drain_id1, orig_drain_id2 in zip(rd_rows, orig_drain_ids1, orig_drain_ids2):
+                orig_drain_id1 = float(orig_drain_id1) if _is_drain_id(orig_drain_id1) else None
+                orig_drain_id2 = float(orig_drain_id2) if _is_drain_id(orig_drain_id2) else None
+                rd_row_data = self._link_road_to_drain_points(rd_row.GRAIPRID, orig_drain_id1, orig_drain_id2,
+                                                              drain_point_links, rd_network_type)
+                if orig_drain_id1 is not None:
+                    rd_row_data['OrigDrainID1'] = orig_drain_id1
+                if orig_drain_id2 is not None:
+                    rd_row_data['OrigDrainID2'] = orig_drain_id2
+                rd_writer.update(rd_row_data, rd_row.GRAIPRID)
+            rd_writer.flush()
+
+        self._check_cancelled()
+        self.resolution_policy.flush()
+        self.log_writer.flush()
+        if imported_features is not None:
+            first_graiprid = self.get_imported_id_range(spec)[0]
+        self.db_session.commit()
+        return first_graiprid
+
+    def _resolve_pending_values(self, feature, shp_file, graipid, ftype, track_field_mismatch, err_table_name):
+        """
+        Resolves the attribute values of a feature that could not be transformed without the database.
+        A type mismatch is reported once per field and the database default is used for it. A value not in
+        the definitions table is translated to a definition ID.
+        """
+        definitions_index = self.db_session.definitions
+        for pending_value in feature.pending_values:
+            field_name = pending_value.field_name
+            att_value = pending_value.att_value
+            if pending_value.issue == ISSUE_TYPE_MISMATCH:
+                # show message describing the mismatch
+                if field_name not in track_field_mismatch:
+                    track_field_mismatch.append(field_name)
+                    action_taken_msg = "A default value will be used"
+                    log_message = "Type mismatch between field '{target_fld_name}' in database and " \
+                                  "value '{value}' in field '{source_fld_name}' in shapefile " \
+                                  "'{shp_file}'.".format(target_fld_name=field_name, value=att_value,
+                                                         source_fld_name=pending_value.src_field_name,
+                                                         shp_file=os.path.basename(shp_file))
+                    msg = log_message + " {}.".format(action_taken_msg)
+
+                    if not self.is_uninterrupted and self.message_callback is not None:
+                        self.message_callback("Mismatch", msg)
+
+                    # the database default is written in place of the value so the mismatch goes to the log
+                    # file only (Ref: getIDFromDefinitionTable function in modGeneralFunction)
+                    self.log_writer.add_entry(self.dp_log_file, graipid, ftype, log_message, action_taken_msg)
+                continue
+
+            # the value may have been defined or reassigned for an earlier feature after the feature
+            # was transformed
+            definition_table_name = pending_value.definition_table_name
+            value_matching_id = definitions_index.get_definition_id(definition_table_name, att_value)
+            if value_matching_id is None:
+                # for details on how to resolve a missing definition value
+                # refer to vb module modGeneralFunctions and function getIDFromDefinitionTable
+                is_multiplier = field_name in core.MULTIPLIER_FIELD_NAMES
+                if not self.is_uninterrupted and self.define_value_callback is not None:
+                    value_matching_id, action_taken_msg = self.define_value_callback(att_value, field_name,
+                                                                                     definition_table_name,
+                                                                                     is_multiplier)
+                else:
+                    value_matching_id, action_taken_msg = self.resolution_policy.resolve(
+                        att_value, definition_table_name, is_multiplier)
+
+                # write to the log table and the log text file
+                log_message = "Value '{}' in field '{}' is not in the '{}' definitions table."
+                log_message = log_message.format(att_value, field_name, definition_table_name)
+                self.log_writer.add_entry(self.dp_log_file, graipid, ftype, log_message, action_taken_msg,
+                                          err_table_name=err_table_name)
+
+            feature.set_value(pending_value.is_att_row, field_name, value_matching_id)
+
+    def _get_drain_point_links(self, cursor):
+        """
+        Returns a map of DrainID -> (GRAIPDID, StreamConnectID) of all drain points in the database
+        """
+        if self._drain_point_links is None:
+            self._drain_point_links = {}
+            sql_select = "SELECT GRAIPDID, DrainID, StreamConnectID FROM DrainPoints WHERE DrainID IS NOT NULL " \
+                         "ORDER BY GRAIPDID"
+            for dp_row in cursor.execute(sql_select).fetchall():
+                self._drain_point_links.setdefault(dp_row.DrainID, (dp_row.GRAIPDID, dp_row.StreamConnectID))
+        return self._drain_point_links
+
+    def _link_road_to_drain_points(self, graiprid, orig_drain_id1, orig_drain_id2, drain_point_links, ftype):
+        """
+        Returns the GRAIPDID1, GRAIPDID2, StreamConnect1ID and StreamConnect2ID field values of a road line
+        from the drain points at its two ends
+        Ref: frmPPWizard3 (importValuesToDatabase) in old graip
+        """
+        rd_row_data = {}
+        # check to see if the 1st and the 2nd drainpoint records exist
+        dp_link = drain_point_links.get(orig_drain_id1, None)
+        if dp_link is not None:
+            rd_row_data['GRAIPDID1'], rd_row_data['StreamConnect1ID'] = dp_link
+
+        dp_link = drain_point_links.get(orig_drain_id2, None)
+        if dp_link is not None:
+            rd_row_data['GRAIPDID2'], rd_row_data['StreamConnect2ID'] = dp_link
+
+        # if no drainpoints write to the log
+        if not rd_row_data:
+            # not written to the error table here - core.check_for_orphans_and_duplicates() writes the road lines
+            # linked to no drain point to the RDErrorLog table as orphan road segments
+            self.log_writer.add_entry(self.dp_log_file, graiprid, ftype, "Doesn't drain", "Nothing")
+        return rd_row_data
+
+    def _set_drain_id(self, row_data, drain_id_field_name, time_field_name):
+        """
+        Sets the DrainID field (DrainID or OrigDrainID1/2) of row_data from the collection time, date and
+        vehicle ID in row_data. Returns False if any of those is not in row_data (the database default is used
+        for it) in which case the DrainID field can only be set once the row has been written.
+        """
+        if time_field_name not in row_data or 'CDate' not in row_data or 'VehicleID' not in row_data:
+            return False
+        drain_id = core.compute_drain_id(row_data[time_field_name], row_data['CDate'], row_data['VehicleID'])
+        if drain_id is not None:
+            row_data[drain_id_field_name] = drain_id
+        return True
+
+    def _get_next_id(self, cursor, table_name, id_field_name):
+        sql_select = "SELECT MAX({id_fld})AS Max_ID FROM {table}".format(id_fld=id_field_name, table=table_name)
+        row = cursor.execute(sql_select).fetchone()
+        if row[0] is not None:
+            return row.Max_ID + 1
+        return 0
+
+    def _check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise Exception("Import was cancelled")
+
+    def _get_shp_file_progress_callback(self, shp_file):
+        if self.progress_callback is None:
+            return None
+
+        def shp_file_progress_callback(count_done, count_total):
+            self.progress_callback(shp_file, count_done, count_total)
+        return shp_file_progress_callback
+
+
+def get_feature_count(shp_file):
+    gdal_driver = ogr.GetDriverByName(core.GDALFileDriver.ShapeFile())
+    data_source = gdal_driver.Open(shp_file, 0)
+    feature_count = data_source.GetLayer(0).GetFeatureCount()
+    data_source.Destroy()
+    return feature_count
+
+
+def transform_features(shp_file, plan, definitions, start_index=0, end_index=None):
+    """
+    Generates a TransformedFeature for each feature of a shapefile by running the field mapping plan
+    (FieldMappingPlan) of the shapefile. Uses the definitions index (graip_db.DefinitionsIndex) but not
+    the database. start_index and end_index limit the features to a range of records (see
+    core.read_shapefile_batches()).
+    """
+    src_field_names = plan.get_source_field_names()
+    for batch in core.read_shapefile_batches(shp_file, src_field_names, include_feature_ids=True,
+                                             start_index=start_index, end_index=end_index):
+        feature_ids = batch[core.FEATURE_ID_KEY]
+        columns = [batch[field_mapping.src_field_name] for field_mapping in plan.field_mappings]
+        rows = zip(*columns) if columns else [()] * len(feature_ids)
+        for feature_id, values in zip(feature_ids, rows):
+            feature = plan.transform(values, definitions)
+            feature.feature_id = feature_id
+            feature.attribute_hash = get_attribute_hash(values)
+            yield feature
+
+
+def get_attribute_hash(values):
+    """
+    Returns the hash of the source field values of a feature
+    """
+    return hashlib.sha1(repr(values)).hexdigest()
+
+
+def delete_imported_records(cursor, shp_type, shp_file, keep_features=False):
+    """
+    Deletes the records imported from a shapefile: DrainPoints and drain type attribute table records or
+    RoadLines records. Their ImportedFeatures records are deleted as well unless keep_features is True.
+    """
+    sql_select = "SELECT RecordID FROM {} WHERE ShpType=? AND ShpFile=?".format(IMPORTED_FEATURES_TABLE_NAME)
+    table_names, id_field_name = _get_record_tables(cursor, shp_type)
+    for table_name in table_names:
+        cursor.execute("DELETE FROM {} WHERE {} IN ({})".format(table_name, id_field_name, sql_select), shp_type,
+                       shp_file)
+    if not keep_features:
+        cursor.execute("DELETE FROM {} WHERE ShpType=? AND ShpFile=?".format(IMPORTED_FEATURES_TABLE_NAME),
+                       shp_type, shp_file)
+
+
+class _ImportedFeatureTracker(object):
+    # keeps the ImportedFeatures records of the shapefile being written up to date and, if the shapefile has
+    # been imported before (imported_features), finds the features that need to be written
+    def __init__(self, cursor, spec, imported_features, is_forced, batch_size):
+        self.cursor = cursor
+        self.spec = spec
+        self.imported_features = imported_features
+        self.is_forced = is_forced
+        self._feature_writer = graip_db.BatchWriter(cursor, IMPORTED_FEATURES_TABLE_NAME, batch_size=batch_size)
+        # (attribute hash, shapefile type, record ID) of the changed features
+        self._changed_features = []
+        graip_db.create_missing_tables(cursor, (IMPORTED_FEATURES_TABLE_NAME,))
+        if imported_features is None:
+            # all features of the shapefile are imported again
+            cursor.execute("DELETE FROM {} WHERE ShpType=? AND ShpFile=?".format(IMPORTED_FEATURES_TABLE_NAME),
+                           spec.shp_type, spec.shp_file)
+        elif is_forced:
+            # the records of all features are written again with the IDs they have
+            delete_imported_records(cursor, spec.shp_type, spec.shp_file, keep_features=True)
+
+    def get_record_id(self, feature, next_id):
+        """
+        Returns the GRAIPDID/GRAIPRID to write the feature to (next_id for a new feature) or None if the
+        feature is the same as when it was last imported
+        """
+        imported_feature = None
+        if self.imported_features is not None:
+            imported_feature = self.imported_features.pop(feature.feature_id, None)
+        if imported_feature is None:
+            self._feature_writer.insert({'ShpType': self.spec.shp_type, 'ShpFile': self.spec.shp_file,
+                                         'FeatureID': feature.feature_id, 'RecordID': next_id,
+                                         'AttributeHash': feature.attribute_hash})
+            return next_id
+        record_id, attribute_hash = imported_feature
+        if attribute_hash == feature.attribute_hash:
+            return record_id if self.is_forced else None
+        self._changed_features.append((feature.attribute_hash, self.spec.shp_type, record_id))
+        return record_id
+
+    def finish(self):
+        """
+        Writes the changes to the ImportedFeatures records and deletes the records of the features that are
+        no longer in the shapefile
+        """
+        self._feature_writer.flush()
+        if self._changed_features:
+            sql_update = "UPDATE {} SET AttributeHash=? WHERE ShpType=? AND " \
+                         "RecordID=?".format(IMPORTED_FEATURES_TABLE_NAME)
+            self.cursor.executemany(sql_update, self._changed_features)
+        if not self.imported_features:
+            return
+        record_ids = [(record_id,) for record_id, _ in self.imported_features.values()]
+        table_names, id_field_name = _get_record_tables(self.cursor, self.spec.shp_type)
+        for table_name in table_names:
+            self.cursor.executemany("DELETE FROM {} WHERE {}=?".format(table_name, id_field_name), record_ids)
+        sql_delete = "DELETE FROM {} WHERE ShpType=? AND RecordID=?".format(IMPORTED_FEATURES_TABLE_NAME)
+        self.cursor.executemany(sql_delete, [(self.spec.shp_type, record_id) for record_id, in record_ids])
+        self.imported_features = {}
+
+
+def _get_record_tables(cursor, shp_type):
+    # the tables with the records imported from a shapefile and the name of their ID field
+    if shp_type == 'DP':
+        drain_type_def_rows = cursor.execute("SELECT TableName FROM DrainTypeDefinitions").fetchall()
+        return ["DrainPoints"] + [row.TableName for row in drain_type_def_rows], "GRAIPDID"
+    return ["RoadLines"], "GRAIPRID"
+
+
+class FieldMapping(object):
+    """
+    How the values of one shapefile field are written to the database: the target table and field, the
+    definition table for translating values to definition IDs (None for values written as they are) and
+    the SQL data type of the target field for checking those values (None if there is no such field)
+    """
+    def __init__(self, src_field_name, is_att_row, table_name, field_name, definition_table_name=None,
+                 data_type=None):
+        self.src_field_name = src_field_name
+        self.is_att_row = is_att_row
+        self.table_name = table_name
+        self.field_name = field_name
+        self.definition_table_name = definition_table_name
+        self.data_type = data_type
+        self.is_data_type_match = graip_db.DATA_TYPE_VALIDATORS.get(data_type, None)
+
+
+class FieldMappingPlan(object):
+    """
+    The field matches of a shapefile compiled for importing its features: the fixed values of the rows
+    (e.g., DrainTypeID) and a FieldMapping for each matched shapefile field. A plan is compiled once per
+    shapefile (compile_drain_points, compile_road_lines) and passed to the worker processes reading the
+    shapefile.
+    """
+    def __init__(self, shp_type, row_data, field_mappings, att_table_name=None):
+        self.shp_type = shp_type
+        self.row_data = row_data
+        self.field_mappings = field_mappings
+        self.att_table_name = att_table_name
+
+    @classmethod
+    def compile_drain_points(cls, spec, drain_type_id, att_table_name, definitions, schema):
+        # Fill StreamConnectID field for stream crossing or sump
+        if att_table_name == "StrXingAtt":
+            stream_connect_id = 2
+        elif att_table_name == "SumpAtt":
+            stream_connect_id = 1
+        else:
+            # this seems to be the database default value for the StreamConnectID field
+            stream_connect_id = 2
+
+        field_mappings = []
+        for match_index, (dp_target_field_name, dp_src_field_name) in enumerate(spec.field_matches):
+            if dp_src_field_name is None:
+                if dp_target_field_name in ('CDate', 'CTime', 'VehicleID'):
+                    msg = dp_target_field_name + " can't take default values"
+                    raise Exception(msg)
+
+                # TODO: probably we have to display the define value dialog here too
+                continue
+
+            # if this is the PipeDimID(oval) field, then merge with PipeDimID field
+            if att_table_name == "StrXingAtt" and dp_target_field_name == "PipeDimID(oval)":
+                field_name = spec.field_matches[match_index - 1][0]
+                # TODO: change the FieldMatch table so that it has FillDepth in place of FillDepthID
+                # so that the following elif is not needed
+            elif att_table_name == "StrXingAtt" and dp_target_field_name == "FillDepthID":
+                field_name = "FillDepth"
+            else:
+                field_name = dp_target_field_name
+
+            if field_name in core.DP_TABLE_FIELD_NAMES:
+                is_att_row, table_name = False, "DrainPoints"
+            else:
+                is_att_row, table_name = True, att_table_name
+            field_mappings.append(_compile_field_mapping(dp_src_field_name, is_att_row, table_name, field_name,
+                                                         definitions, schema))
+
+        row_data = {'DrainTypeID': drain_type_id, 'StreamConnectID': stream_connect_id, 'Comments': ''}
+        return cls('DP', row_data, field_mappings, att_table_name=att_table_name)
+
+    @classmethod
+    def compile_road_lines(cls, spec, road_network_id, definitions, schema):
+        # get column names of the RoadLines table
+        rd_table_field_names = schema.get_column_names("RoadLines")
+
+        field_mappings = []
+        for rd_target_field_name, rd_src_field_name in spec.field_matches:
+            if rd_src_field_name is None:
+                if rd_target_field_name in ('CDate', 'CTime1', 'CTime2', 'VehicleID'):
+                    msg = rd_target_field_name + " can't take default values"
+                    raise Exception(msg)
+
+                # TODO: probably we have to display the define value dialog here too
+                continue
+
+            field_mappings.append(_compile_field_mapping(rd_src_field_name, False, "RoadLines", rd_target_field_name,
+                                                         definitions, schema, table_field_names=rd_table_field_names))
+
+        row_data = {'Comments': ''}
+        if road_network_id is not None:
+            row_data['RoadNetworkID'] = road_network_id
+        return cls('RD', row_data, field_mappings)
+
+    def get_source_field_names(self):
+        return [field_mapping.src_field_name for field_mapping in self.field_mappings]
+
+    def clean_value(self, att_value):
+        if self.shp_type == 'DP' and isinstance(att_value, basestring):
+            # replace any single quotes or a double quote in the value
+            att_value = att_value.replace("'", "")
+            att_value = att_value.replace('"', "")
+        return att_value
+
+    def transform(self, values, definitions):
+        """
+        Returns the TransformedFeature for the values of the source fields of a feature (in the order of the
+        field mappings). Values of fields having a definition table are translated to the matching definition
+        ID. A value that does not match the field data type or is not in the definitions table is added to
+        the pending values of the feature.
+        """
+        feature = TransformedFeature(dict(self.row_data))
+        for field_mapping, att_value in zip(self.field_mappings, values):
+            # if a value/data exists in the shapefile
+            if not att_value:
+                continue
+
+            att_value = self.clean_value(att_value)
+
+            # if no matching definition table was found then write the original data value
+            if field_mapping.definition_table_name is None:
+                # check datatype of the column with the value being assigned
+                if field_mapping.is_data_type_match is not None and field_mapping.is_data_type_match(att_value):
+                    feature.set_value(field_mapping.is_att_row, field_mapping.field_name, att_value)
+                else:
+                    feature.pending_values.append(PendingValue(ISSUE_TYPE_MISMATCH, field_mapping.is_att_row,
+                                                               field_mapping.table_name, field_mapping.field_name,
+                                                               field_mapping.src_field_name, att_value))
+                continue
+
+            # found a matching Definition Table - look up the value in the definitions and then in the values
+            # already reassigned with the Define Value dialog
+            value_matching_id = definitions.get_definition_id(field_mapping.definition_table_name, att_value)
+            if value_matching_id is None:
+                feature.pending_values.append(PendingValue(ISSUE_UNKNOWN_DEFINITION, field_mapping.is_att_row,
+                                                           field_mapping.table_name, field_mapping.field_name,
+                                                           field_mapping.src_field_name, att_value,
+                                                           field_mapping.definition_table_name))
+            else:
+                feature.set_value(field_mapping.is_att_row, field_mapping.field_name, value_matching_id)
+        return feature
+
+
+def _compile_field_mapping(src_field_name, is_att_row, table_name, field_name, definitions, schema,
+                           table_field_names=None):
+    # check if there is a DefinitionTable in MetaData table matching the field_name
+    definition_table_name = definitions.get_definition_table(field_name)
+    if table_field_names is not None and field_name not in table_field_names:
+        if definition_table_name is not None:
+            raise Exception("'{}' field name is not in {} table".format(field_name, table_name))
+        # values of this field are always a type mismatch
+        return FieldMapping(src_field_name, is_att_row, table_name, field_name)
+
+    data_type = None
+    if definition_table_name is None:
+        data_type = schema.get_column_data_type(table_name, field_name)
+    return FieldMapping(src_field_name, is_att_row, table_name, field_name, definition_table_name, data_type)
+
+
+# field mapping plans and definitions index of a worker process of ImportEngine.import_drain_point_files()
+_worker_plans = None
+_worker_definitions = None
+
+
+def _init_worker(plans, definitions):
+    global _worker_plans, _worker_definitions
+    _worker_plans = plans
+    _worker_definitions = definitions
+
+
+def _transform_features_task(task):
+    # runs in a worker process of ImportEngine.import_drain_point_files() - transforms one batch of features
+    shp_file, plan_index, start_index, end_index = task
+    return list(transform_features(shp_file, _worker_plans[plan_index], _worker_definitions, start_index,
+                                   end_index))
+
+
+def _get_batch_ranges(feature_count):
+    # (start index, end index) of the batches of records of a shapefile of feature_count features - the last
+    # batch is open ended in case the feature count leaves out deleted records
+    batch_size = core.FEATURE_BATCH_SIZE
+    start_indexes = range(0, max(feature_count, 1), batch_size)
+    return [(start_index, start_index + batch_size) for start_index in start_indexes[:-1]] + \
+           [(start_indexes[-1], None)]
+
+
+def _imap_bounded(pool, func, tasks, max_pending):
+    # pool.imap() submitting at most max_pending tasks ahead of the results taken, so that results do not
+    # pile up in memory when they are taken slower than the workers produce them
+    pending_results = collections.deque()
+    for task in tasks:
+        if len(pending_results) == max_pending:
+            yield pending_results.popleft().get()
+        pending_results.append(pool.apply_async(func, (task,)))
+    while pending_results:
+        yield pending_results.popleft().get()
+
+
+def _is_drain_id(drain_id):
+    # core.compute_drain_ids() returns NaN (or None) for a drain point without collection time
+    return drain_id is not None and drain_id == drain_id
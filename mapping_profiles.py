@@ -0,0 +1,121 @@
+"""
+Field mapping profiles: the (target field, source field) pairs last used for importing a shapefile with a given
+set of attribute fields. Profiles are kept in the MappingProfiles table of the GRAIP database, keyed by the
+shapefile type, the drain type (drain points only) and a hash of the shapefile attribute field names, so that
+the field match table for the next shapefile from the same crew template is filled in from the profile instead
+of being matched again from the FieldMatches table.
+"""
+
+import hashlib
+
+import core
+import graip_db
+import matching
+
+
+def get_schema_hash(attribute_names):
+    """
+    Returns the hash of the attribute field names of a shapefile (in field order, ignoring case)
+    """
+    schema_text = "\n".join(att_name.lower() for att_name in attribute_names)
+    if isinstance(schema_text, unicode):
+        schema_text = schema_text.encode('utf-8')
+    return hashlib.sha1(schema_text).hexdigest()
+
+
+def get_field_matches(db_session, shp_type, drain_type_name, attribute_names):
+    """
+    Returns the list of (target field, source field) pairs for importing a shapefile with attribute_names: the
+    profile for the shapefile if there is one, else the pairs matched using the FieldMatches table
+    """
+    field_matches = load_profile(db_session, shp_type, drain_type_name, attribute_names)
+    if field_matches is None:
+        field_matches = match_fields(db_session, shp_type, drain_type_name, attribute_names)
+    return field_matches
+
+
+def match_fields(db_session, shp_type, drain_type_name, attribute_names):
+    """
+    Returns the list of (target field, source field) pairs matching the target fields of the drain type (or of
+    road lines) with the shapefile fields attribute_names using the FieldMatches table. Target fields without
+    a matching shapefile field get core.NO_MATCH_USE_DEFAULT.
+    """
+    src_field_names = [core.NO_MATCH_USE_DEFAULT] + list(attribute_names)
+    field_name_matcher = matching.FieldNameMatcher(src_field_names)
+    with db_session.read_cursor() as cursor:
+        if shp_type == 'DP':
+            drain_type_def_row = cursor.execute("SELECT DrainTypeID FROM DrainTypeDefinitions "
+                                                "WHERE DrainTypeName = ?", drain_type_name).fetchone()
+            if drain_type_def_row is None:
+                raise Exception("{} is not a drain type in the GRAIP database.".format(drain_type_name))
+            att_table_id = drain_type_def_row.DrainTypeID
+        else:
+            # the road line fields are in FieldMatches with AttTableID 0
+            att_table_id = 0
+
+        # find the target field names in the database corresponding to the shapefile being imported
+        field_name_rows = cursor.execute("SELECT DBField FROM FieldMatches WHERE AttTableID = ?",
+                                         att_table_id).fetchall()
+        field_matches = []
+        for field_name_row in field_name_rows:
+            target_field_name = field_name_row.DBField
+            src_field_name = core.NO_MATCH_USE_DEFAULT
+            source_field_row = cursor.execute("SELECT DBFField FROM FieldMatches WHERE DBField = ?",
+                                              target_field_name).fetchone()
+            if source_field_row:
+                # check if the DBFField value matches (if at least first 3 chars need to match) with any of
+                # the shapefile fields - a shapefile field is matched to one target field only, except for an
+                # exact match of a road line field
+                matching_field, is_exact_match = field_name_matcher.match(source_field_row.DBFField)
+                used_field_names = [used_field_name for _, used_field_name in field_matches]
+                if is_exact_match and shp_type == 'RD':
+                    src_field_name = source_field_row.DBFField
+                else:
+                    if is_exact_match:
+                        matching_field = source_field_row.DBFField
+                    if matching_field is not None and matching_field not in used_field_names:
+                        src_field_name = matching_field
+            field_matches.append((target_field_name, src_field_name))
+    return field_matches
+
+
+def load_profile(db_session, shp_type, drain_type_name, attribute_names):
+    """
+    Returns the list of (target field, source field) pairs of the profile matching a shapefile with
+    attribute_names, or None if there is no such profile
+    """
+    with db_session.read_cursor() as cursor:
+        if not cursor.tables(table="MappingProfiles").fetchall():
+            return None
+        sql_select = "SELECT DBField, DBFField FROM MappingProfiles WHERE ShpType=? AND DrainTypeName=? AND " \
+                     "SchemaHash=? ORDER BY FieldOrder"
+        rows = cursor.execute(sql_select, shp_type, drain_type_name or '',
+                              get_schema_hash(attribute_names)).fetchall()
+
+    field_matches = [(row.DBField, row.DBFField) for row in rows]
+    if not field_matches:
+        return None
+    # a profile can only be used if all its source fields are in the shapefile
+    valid_src_field_names = set(attribute_names)
+    valid_src_field_names.add(core.NO_MATCH_USE_DEFAULT)
+    if any(src_field_name not in valid_src_field_names for _, src_field_name in field_matches):
+        return None
+    return field_matches
+
+
+def save_profile(db_session, shp_type, drain_type_name, attribute_names, field_matches):
+    """
+    Saves field_matches, a list of (target field, source field) pairs, as the profile for shapefiles with
+    attribute_names replacing any existing profile for them
+    """
+    cursor = db_session.cursor()
+    graip_db.create_missing_tables(cursor, ("MappingProfiles",))
+    schema_hash = get_schema_hash(attribute_names)
+    cursor.execute("DELETE FROM MappingProfiles WHERE ShpType=? AND DrainTypeName=? AND SchemaHash=?",
+                   shp_type, drain_type_name or '', schema_hash)
+    profile_rows = [(shp_type, drain_type_name or '', schema_hash, field_order, target_field_name, src_field_name)
+                    for field_order, (target_field_name, src_field_name) in enumerate(field_matches)]
+    if profile_rows:
+        cursor.executemany("INSERT INTO MappingProfiles (ShpType, DrainTypeName, SchemaHash, FieldOrder, DBField, "
+                           "DBFField) VALUES (?,?,?,?,?,?)", profile_rows)
+    db_session.commit()
@@ -0,0 +1,116 @@
+"""
+Prefix matching of names used by the wizard to preselect choices: shapefile fields for the target fields in the
+field match table, the drain type of a drain point shapefile and the definition for a value that is not in a
+definitions table. A name matches a choice if they start with the same 3 characters (ignoring case); failing
+that, a choice sharing only the first character is used where noted. The choices are normalized once so that
+matching a name does not depend on the number of choices.
+"""
+
+# number of leading characters that need to be the same for a match
+MIN_PREFIX_LENGTH = 3
+
+
+class FieldNameMatcher(object):
+    """
+    Matches field names (e.g., DBFField values of the FieldMatches table) with the field names of a shapefile
+    """
+    def __init__(self, shp_field_names):
+        # lower case field name -> first shapefile field with that name
+        self._field_names = {}
+        # lower case first 3 characters -> first shapefile field starting with them
+        self._field_name_prefixes = {}
+        for shp_field_name in shp_field_names:
+            key = shp_field_name.lower()
+            self._field_names.setdefault(key, shp_field_name)
+            if len(shp_field_name) >= MIN_PREFIX_LENGTH:
+                self._field_name_prefixes.setdefault(key[:MIN_PREFIX_LENGTH], shp_field_name)
+
+    def match(self, field_name):
+        """
+        Returns (shapefile field name, is_exact_match) for the shapefile field having the same name as
+        field_name (ignoring case) or else the first shapefile field starting with the same 3 characters as
+        field_name. Returns (None, False) if there is no matching field.
+        """
+        key = field_name.lower()
+        shp_field_name = self._field_names.get(key, None)
+        if shp_field_name is not None:
+            return shp_field_name, True
+        if len(field_name) >= MIN_PREFIX_LENGTH:
+            return self._field_name_prefixes.get(key[:MIN_PREFIX_LENGTH], None), False
+        return None, False
+
+
+class DefinitionMatcher(object):
+    """
+    Matches values with the definitions of a definitions table ignoring spaces and case
+    """
+    def __init__(self, definitions):
+        # first 3 characters -> index of the first definition starting with them
+        self._prefix_indexes = {}
+        # first character -> ((index, 2nd character) of the last definition starting with that character,
+        # index of the last one of those having another 2nd character)
+        self._first_char_indexes = {}
+        for index, definition in enumerate(definitions):
+            if not isinstance(definition, basestring):
+                continue
+            key = _get_definition_key(definition)
+            if len(key) < MIN_PREFIX_LENGTH:
+                continue
+            self._prefix_indexes.setdefault(key[:MIN_PREFIX_LENGTH], index)
+            last_index = None
+            if key[0] in self._first_char_indexes:
+                (prev_index, prev_second_char), prev_last_index = self._first_char_indexes[key[0]]
+                last_index = prev_index if prev_second_char != key[1] else prev_last_index
+            self._first_char_indexes[key[0]] = ((index, key[1]), last_index)
+
+    def match(self, value):
+        """
+        Returns (index of the matching definition, is_match_found). The matching definition is the first
+        definition starting with the same 3 characters as value. If there is none, the index is that of the
+        last definition sharing only the first character with value (or 0) and is_match_found is False.
+        """
+        key = _get_definition_key(value)
+        if len(key) < MIN_PREFIX_LENGTH:
+            return 0, False
+        index = self._prefix_indexes.get(key[:MIN_PREFIX_LENGTH], None)
+        if index is not None:
+            return index, True
+        if key[0] in self._first_char_indexes:
+            (index, second_char), last_index = self._first_char_indexes[key[0]]
+            if second_char != key[1]:
+                return index, False
+            if last_index is not None:
+                return last_index, False
+        return 0, False
+
+
+def match_drain_type(shp_file_name, drain_type_names):
+    """
+    Returns the index of the drain type for a drain point shapefile: the first drain type the shapefile name
+    starts with (at least 3 characters) or else the last drain type sharing only the first character with
+    the shapefile name (or 0)
+    """
+    shp_file_key = shp_file_name.lower()
+    matching_index = 0
+    for index, drain_type_name in enumerate(drain_type_names):
+        # a drain type name is matched on all but its last character
+        match_length = min(_get_common_prefix_length(drain_type_name.lower(), shp_file_key),
+                           len(drain_type_name) - 1)
+        if match_length >= MIN_PREFIX_LENGTH:
+            return index
+        if match_length == 1:
+            matching_index = index
+    return matching_index
+
+
+def _get_definition_key(definition):
+    return definition.replace(" ", "").lower()
+
+
+def _get_common_prefix_length(name1, name2):
+    length = 0
+    for char1, char2 in zip(name1, name2):
+        if char1 != char2:
+            break
+        length += 1
+    return length
@@ -1,13 +1,16 @@
 import sys
 import os
-import shutil
-
-import pyodbc
-from osgeo import ogr
+import multiprocessing
 
 from PySide.QtGui import *
 from PySide.QtCore import *
 
+import checkpoints
+import consolidate
+import core
+import graip_db
+import import_engine
+import mapping_profiles
 import utils
 
 
@@ -24,6 +27,10 @@ class Preprocessor(QWizard):
         self.dp_log_file = None
         self.rd_log_file = None
         self.is_uninterrupted = False
+        self.output_format = consolidate.SHAPEFILE_FORMAT
+        self.include_attributes = False
+        self.is_reset_database = False
+        self.is_compact_database = False
         self.options_dlg = utils.OptionsDialog()
 
         self.setWindowTitle("GRAIP Preprocessor (Version 2.0)")
@@ -52,6 +59,9 @@ class Preprocessor(QWizard):
         self.show()
         # Run the qt application
         qt_app.exec_()
+        file_setup_page = self.page(0)
+        if file_setup_page.db_session is not None:
+            file_setup_page.db_session.close()
 
 
 class FileSetupPage(QWizardPage):
@@ -60,8 +70,18 @@ class FileSetupPage(QWizardPage):
         self.wizard = parent
         self.wizard.btn_options.clicked.connect(self.show_options_dialog)
         self.working_directory = None
-        self.dp_shp_file_processing_track_dict = {}
-        self.rd_shp_file_processing_track_dict = {}
+        # (shapefile type, shapefile) -> checkpoints.Checkpoint of the shapefiles of the run
+        self.checkpoints = {}
+        # set once drain point records have been written by the run
+        self.is_dp_changed = False
+        # (shapefile type, shapefile) -> import_engine.ShapefileImportSpec of the shapefiles scanned for values
+        # not in the definitions tables, None until the first shapefile is imported (see
+        # utils.ImportWizardPage.define_unknown_values())
+        self.scanned_specs = None
+        # actions chosen in the Define Values dialog for the values not in the definitions tables that have not
+        # been found by an import yet (see utils.ResolveValuesDialog)
+        self.value_decisions = {}
+        self.db_session = None
         self.form_layout = QFormLayout()
         self.msg_label = QLabel()
         self.msg_label.setText("The GRAIP Preprocessor is a tool to import USDA Forest Service road inventory "
@@ -69,7 +89,7 @@ class FileSetupPage(QWizardPage):
         self.msg_label.setWordWrap(True)
         self.form_layout.addRow("", self.msg_label)
 
-        self.group_box_mdb_file = QGroupBox("GRAIP Database (*.mdb)")
+        self.group_box_mdb_file = QGroupBox("GRAIP Database (*.mdb, *.sqlite)")
         self.line_edit_mdb_file = QLineEdit()
         self.btn_browse_mdb_file = QPushButton('....')
         self.btn_browse_mdb_file.clicked.connect(self.browse_db_file)
@@ -152,6 +172,10 @@ class FileSetupPage(QWizardPage):
         self.dp_log_file = self.wizard.dp_log_file
         self.rd_log_file = self.wizard.rd_log_file
         self.is_uninterrupted = self.wizard.is_uninterrupted
+        self.output_format = self.wizard.output_format
+        self.include_attributes = self.wizard.include_attributes
+        self.is_reset_database = self.wizard.is_reset_database
+        self.is_compact_database = self.wizard.is_compact_database
 
         # make some of the page fields available to other pages
         # make the list widget for drain point shapefiles available to other pages of this wizard
@@ -168,8 +192,12 @@ class FileSetupPage(QWizardPage):
             msg_box.setText("Before you can set options, select GRAIP database file.")
             msg_box.exec_()
         else:
-            self.dp_log_file, self.rd_log_file, self.is_uninterrupted = self.wizard.options_dlg.get_data_from_dialog(
-                self.dp_log_file, self.rd_log_file, self.is_uninterrupted)
+            self.dp_log_file, self.rd_log_file, self.is_uninterrupted, self.output_format, \
+                self.include_attributes, self.is_reset_database, self.is_compact_database = \
+                self.wizard.options_dlg.get_data_from_dialog(self.dp_log_file, self.rd_log_file,
+                                                             self.is_uninterrupted, self.output_format,
+                                                             self.include_attributes, self.is_reset_database,
+                                                             self.is_compact_database)
 
     def isComplete(self, *args, **kwargs):
         # NOTE: in this function DO NOT display any error message box
@@ -249,11 +277,17 @@ class FileSetupPage(QWizardPage):
 
         # write file setup data to the FileSetup table
         graip_db_file = self.line_edit_mdb_file.text()
-        conn = pyodbc.connect(utils.MS_ACCESS_CONNECTION % graip_db_file)
-        cursor = conn.cursor()
+        # one database session is used by all pages for the rest of the run
+        if self.db_session is not None:
+            self.db_session.close()
+        if self.is_reset_database:
+            # start over - much faster than deleting the records of a large database
+            graip_db.reset_database(graip_db_file, template_db_file=graip_db.TEMPLATE_DB_FILE)
+        self.db_session = graip_db.DatabaseSession(graip_db_file)
+        cursor = self.db_session.cursor()
         # delete all data from FileSetup table
-        cursor.execute("DELETE * FROM FileSetup")
-        conn.commit()
+        cursor.execute("DELETE FROM FileSetup")
+        self.db_session.commit()
 
         # insert data to FileSetup table
         db_file = self.line_edit_mdb_file.text()
@@ -263,8 +297,7 @@ class FileSetupPage(QWizardPage):
         rd_shp_files = ','.join(rd_shp_file_list)
         cursor.execute("INSERT INTO FileSetup(GRAIP_DB_File, DEM_Path, Road_Shapefiles, DrainPoints_Shapefiles) "
                        "VALUES (?, ?, ?, ?)", db_file, dem_file_path, rd_shp_files, dp_shp_files)
-        conn.commit()
-        conn.close()
+        self.db_session.commit()
 
         # check if there exists 'DrainPoints.shp' or 'RoadLines.shp file at the same location as the db file
         # and prompt user if it needs to be deleted and then delete it if user says so
@@ -284,11 +317,17 @@ class FileSetupPage(QWizardPage):
             self.dp_log_file = os.path.join(self.working_directory, db_file_name_wo_ext + 'DP.log')
             self.rd_log_file = os.path.join(self.working_directory, db_file_name_wo_ext + 'RD.log')
 
-        utils.create_log_file(graip_db_file=graip_db_file, log_file=self.dp_log_file, log_type='DP')
-        utils.create_log_file(graip_db_file=graip_db_file, log_file=self.rd_log_file, log_type='RD')
-
-        # cleanup graip database relevant tables in preparation for loading new data
-        utils.clear_data_tables(graip_db_file)
+        core.create_log_file(graip_db_file=graip_db_file, log_file=self.dp_log_file, log_type='DP')
+        core.create_log_file(graip_db_file=graip_db_file, log_file=self.rd_log_file, log_type='RD')
+
+        # cleanup graip database relevant tables in preparation for loading new data - the data of the
+        # shapefiles that were imported by the previous run and have not changed since is kept
+        shp_files = [('DP', shp_file) for shp_file in dp_shp_file_list] + \
+                    [('RD', shp_file) for shp_file in rd_shp_file_list]
+        self.checkpoints = checkpoints.restore_checkpoints(self.db_session, shp_files)
+        self.is_dp_changed = False
+        self.scanned_specs = None
+        self.value_decisions = {}
         # hide the Options button
         self.wizard.btn_options.hide()
         return True
@@ -349,7 +388,7 @@ class FileSetupPage(QWizardPage):
     def browse_db_file(self):
         working_dir = self.working_directory if self.working_directory is not None else os.getcwd()
         graip_db_file, _ = QFileDialog.getSaveFileName(None, 'Enter GRAIP Database Filename', working_dir,
-                                                       filter="MS Access (*.mdb)",
+                                                       filter="MS Access (*.mdb);;SQLite (*.sqlite)",
                                                        options=QFileDialog.DontConfirmOverwrite)
         # check if the cancel was clicked on the file dialog
         if len(graip_db_file) == 0:
@@ -364,9 +403,7 @@ class FileSetupPage(QWizardPage):
         # if the database file does not exists then copy the empty database
         # as the filename provided by the user
         if not os.path.isfile(graip_db_file):
-            this_script_dir = os.path.dirname(os.path.realpath(__file__))
-            empty_graip_db_file = os.path.join(this_script_dir, 'GRAIP_DB', "GRAIP.mdb")
-            shutil.copyfile(empty_graip_db_file, graip_db_file)
+            self.create_graip_db_file(graip_db_file)
         else:
             # prompt the user if the existing db file to be overwritten
             msg_box = utils.GraipMessageBox()
@@ -378,17 +415,14 @@ class FileSetupPage(QWizardPage):
             response = msg_box.exec_()
             if response == QMessageBox.Yes:
                 os.remove(graip_db_file)
-                this_script_dir = os.path.dirname(os.path.realpath(__file__))
-                empty_graip_db_file = os.path.join(this_script_dir, 'GRAIP_DB', "GRAIP.mdb")
-                shutil.copyfile(empty_graip_db_file, graip_db_file)
+                self.create_graip_db_file(graip_db_file)
 
             else:
                 # read file setup data from the FileSetup table and populate various file inputs
                 # in this wizard page
-                conn = pyodbc.connect(utils.MS_ACCESS_CONNECTION % graip_db_file)
-                cursor = conn.cursor()
-                file_setup_row = cursor.execute("SELECT * FROM FileSetup").fetchone()
-                conn.close()
+                with graip_db.DatabaseSession(graip_db_file) as db_session:
+                    with db_session.read_cursor() as cursor:
+                        file_setup_row = cursor.execute("SELECT * FROM FileSetup").fetchone()
                 if file_setup_row:
                     self.line_edit_dem_file.setText(file_setup_row.DEM_Path)
                     road_shp_files = file_setup_row.Road_Shapefiles.split(',')
@@ -403,16 +437,19 @@ class FileSetupPage(QWizardPage):
         self.line_edit_mdb_file.setText(graip_db_file)
         self.completeChanged.emit()
 
+    def create_graip_db_file(self, graip_db_file):
+        graip_db.create_database_from_template(graip_db_file)
+
 
 class DrainPointPage(utils.ImportWizardPage):
 
     def initializePage(self, *args, **kwargs):
         self.progress_bar.setValue(0)
-        graip_db_file = self.wizard.line_edit_mdb_file.text()
 
         if self.field_match_table_wizard is None:
             dp_shapefile = self.line_edit_imported_file.text()
-            self.dp_type_combo_box = utils.populate_drain_type_combobox(graip_db_file, self.dp_type_combo_box)
+            self.dp_type_combo_box = utils.populate_drain_type_combobox(self.wizard.db_session,
+                                                                        self.dp_type_combo_box)
             self.dp_type_combo_box = utils.set_index_dp_type_combo_box(dp_shapefile, self.dp_type_combo_box)
             # populate the field match table based on the drain point shapefile being imported
             self.populate_matching_fields_table()
@@ -425,298 +462,22 @@ class DrainPointPage(utils.ImportWizardPage):
 
         is_error = False
         try:
-            graip_db_file = self.wizard.line_edit_mdb_file.text()
-            conn = pyodbc.connect(utils.MS_ACCESS_CONNECTION % graip_db_file)
-            cursor = conn.cursor()
-            dp_table_field_names = ['GRAIPDID', 'DrainTypeID', 'CDate', 'CTime', 'VehicleID', 'DrainID',
-                                    'StreamConnectID', 'OrphanID', 'DischargeToID', 'Comments', 'FillErosion',
-                                    'LinkCascadeID', 'In_Xing_FillID']
-
-            drain_type_name = self.dp_type_combo_box.currentText()
-            # find drain type attribute table name - this is the table to which we will be writing data in addition
-            # to writing data to the DrainPoints table
-            drain_type_def_row = cursor.execute("SELECT DrainTypeID, TableName FROM DrainTypeDefinitions WHERE "
-                                                "DrainTypeName=?", drain_type_name).fetchone()
-            if drain_type_def_row:
-                # check if the drainpoints file has been processed before
-                update_main_dp_table = False
-                dp_shapefile = self.line_edit_imported_file.text()
-                if dp_shapefile in self.wizard.dp_shp_file_processing_track_dict:
-                    graipid = self.wizard.dp_shp_file_processing_track_dict[dp_shapefile]
-                    # delete all records from the matching attribute table
-                    cursor.execute("DELETE * FROM {}".format(drain_type_def_row.TableName))
-                    conn.commit()
-                    # In this case we will be updating records in the DrainPoints table
-                    update_main_dp_table = True
-                else:
-                    # find out the next GRAIPDID from the DrainPoints table
-                    dp_row = cursor.execute("SELECT MAX(GRAIPDID)AS Max_GRAIPDID FROM DrainPoints").fetchone()
-                    if dp_row[0] is not None:
-                        graipid = dp_row.Max_GRAIPDID + 1
-                    else:
-                        graipid = 0
-
-                    self.wizard.dp_shp_file_processing_track_dict[dp_shapefile] = graipid
-            else:
-                raise Exception("No matching drain type attribute table was found")
-
-            # open drainpoint shapefile
-            gdal_driver = ogr.GetDriverByName(utils.GDALFileDriver.ShapeFile())
-            data_source = gdal_driver.Open(dp_shapefile, 1)
-            layer = data_source.GetLayer(0)
-
-            # set progress bar
-            progress_bar_max = len(layer)
-            self.progress_bar.setMaximum(progress_bar_max)
-            progress_bar_counter = 0
-            track_field_mismatch = []
-            # for each drain point in shapefile
-            for dp in layer:
-                # Fill StreamConnectID field for stream crossing or sump
-                if drain_type_def_row.TableName == "StrXingAtt":
-                    stream_connect_id = 2
-                elif drain_type_def_row.TableName == "SumpAtt":
-                    stream_connect_id = 1
-                else:
-                    # this seems to be the database default value for the StreamConnectID field
-                    stream_connect_id = 2
-
-                fld_match_table_model = self.field_match_table_wizard.table_model
-
-                # collect data to be inserted to both the DrainPoints table and shapefile specific attribute table
-
-                dp_row_data = {'GRAIPDID': graipid, 'DrainTypeID': drain_type_def_row.DrainTypeID,
-                               'StreamConnectID': stream_connect_id, 'Comments': ''}
-
-                dp_att_row_data = {'GRAIPDID': graipid}
-
-                # for each field name imported from the shape file (table grid source column (col#2))
-                for row in range(fld_match_table_model.rowCount()):
-                    # find the source column name (2nd column of the table)
-                    dp_src_field_name = str(fld_match_table_model.index(row, 1).data())
-                    dp_target_field_name = str(fld_match_table_model.index(row, 0).data())
-                    # if a matching source field name exists
-                    if dp_src_field_name != self.no_match_use_default:
-                        # get the value for that field from the shapefile
-                        dp_att_value = dp.GetField(dp_src_field_name)
-                        # if a value/data exists in the shapefile
-                        if dp_att_value:
-                            # replace any single quotes or a double quote in the value
-                            if isinstance(dp_att_value, basestring):
-                                dp_att_value = dp_att_value.replace("'", "")
-                                dp_att_value = dp_att_value.replace('"', "")
-
-                            # if this is the PipeDimID(oval) field, then merge with PipeDimID field
-                            if drain_type_def_row.TableName == "StrXingAtt" \
-                                    and fld_match_table_model.index(row, 0).data() == "PipeDimID(oval)":
-                                prev_row = row - 1
-                                field_name = fld_match_table_model.index(prev_row, 0).data()
-                                # TODO: change the FieldMatch table so that it has FillDepth in place of FillDepthID
-                                # so that the following elif is not needed
-                            elif drain_type_def_row.TableName == "StrXingAtt" \
-                                    and fld_match_table_model.index(row, 0).data() == "FillDepthID":
-                                field_name = "FillDepth"
-                            else:
-                                field_name = fld_match_table_model.index(row, 0).data()
-
-                            # check if there is a DefinitionTable in MetaData table matching the field_name
-                            metadata_row = cursor.execute("SELECT DefinitionTable FROM MetaData WHERE IDFieldName=?",
-                                                          field_name).fetchone()
-
-                            # if no matching definition table was found then write the original data value
-                            if metadata_row is None:
-                                is_type_match = False
-                                if field_name in dp_table_field_names:
-                                    # check datatype of the column with the value being assigned
-                                    is_type_match = utils.is_data_type_match(graip_db_file,
-                                                                             "DrainPoints", field_name,
-                                                                             dp_att_value)
-                                    if is_type_match:
-                                        dp_row_data[field_name] = dp_att_value
-
-                                else:
-                                    is_type_match = utils.is_data_type_match(graip_db_file,
-                                                                             drain_type_def_row.TableName, field_name,
-                                                                             dp_att_value)
-                                    if is_type_match:
-                                        dp_att_row_data[field_name] = dp_att_value
-
-                                if not is_type_match:
-                                    # show message describing the mismatch
-                                    dp_shapefile_basename = os.path.basename(dp_shapefile)
-                                    if field_name not in track_field_mismatch:
-                                        track_field_mismatch.append(field_name)
-                                        action_taken_msg = "A default value will be used"
-                                        log_message = "Type mismatch between field '{target_fld_name}' in database and " \
-                                                      "value '{value}' in field '{source_fld_name}' in shapefile " \
-                                                      "'{shp_file}'.".format(target_fld_name=field_name, value=dp_att_value,
-                                                                             source_fld_name=dp_src_field_name,
-                                                                             shp_file=dp_shapefile_basename)
-                                        msg = log_message + " {}.".format(action_taken_msg)
-
-                                        if not self.wizard.is_uninterrupted:
-                                            msg_box = utils.GraipMessageBox()
-                                            msg_box.setIcon(QMessageBox.Information)
-                                            msg_box.setText(msg)
-                                            msg_box.setWindowTitle("Mismatch")
-                                            msg_box.exec_()
-
-                                        # TODO: need to write to the log file and other bits of processing
-                                        # Ref to getIDFromDefinitionTable function in modGeneralFunction
-                                        utils.add_entry_to_log_file(self.wizard.dp_log_file, graipid, drain_type_name,
-                                                                    log_message, action_taken_msg)
-
-                            else:
-                                # found a matching Definition Table
-                                definition_table_name = metadata_row.DefinitionTable
-                                # definition_table_name = definition_table_name.replace("'", "''")
-                                sql_select = "SELECT * FROM {}".format(definition_table_name)
-                                definition_table_rows = cursor.execute(sql_select).fetchall()
-                                value_matching_id = None
-                                for table_row in definition_table_rows:
-                                    # second column has the definition values
-                                    if table_row[1].lower() == dp_att_value.lower():
-                                        # first column has the definition ID
-                                        value_matching_id = table_row[0]
-                                        break
-
-                                if value_matching_id is None:
-                                    # check to see if already done Define Value dialog for this value, If so, use that
-                                    # value - no need to show Define Value dialog
-                                    sql_select = "SELECT * FROM ValueReassigns WHERE FromField=? AND DefinitionTable=?"
-                                    params = (dp_att_value, definition_table_name)
-                                    value_assigns_row = cursor.execute(sql_select, params).fetchone()
-                                    if value_assigns_row:
-                                        value_matching_id = value_assigns_row.DefinitionID
-                                    else:
-                                        # need to show Define Value dialog
-                                        # for details on how to setup the DefineValueDialog
-                                        # refer to vb module modGeneralFunctions and function getIDFromDefinitionTable
-                                        if field_name in ('FlowPathVeg1ID', 'FlowPathVeg2ID', 'SurfaceTypeID'):
-                                            define_value_dlg = utils.DefineValueDialog(missing_field_value=dp_att_value,
-                                                                                       missing_field_name=field_name,
-                                                                                       graip_db_file=graip_db_file,
-                                                                                       def_table_name=definition_table_name,
-                                                                                       is_multiplier=True)
-                                        else:
-                                            define_value_dlg = utils.DefineValueDialog(missing_field_value=dp_att_value,
-                                                                                       missing_field_name=field_name,
-                                                                                       graip_db_file=graip_db_file,
-                                                                                       def_table_name=definition_table_name)
-                                        if not self.wizard.is_uninterrupted:
-                                            define_value_dlg.show()
-                                            define_value_dlg.exec_()
-                                            if define_value_dlg.is_cancel:
-                                                raise Exception("Aborting processing of this shapefile")
-                                        else:
-                                            define_value_dlg.accept()
-
-                                        value_matching_id = define_value_dlg.definition_id
-                                        action_taken_msg = define_value_dlg.action_taken_msg
-                                        # write to the log table
-                                        log_message = "Value '{}' in field '{}' is not in the '{}' definitions table."
-                                        log_message = log_message.format(dp_att_value, field_name, definition_table_name)
-                                        utils.add_entry_to_error_table(graip_db_file, utils.DP_ERROR_LOG_TABLE_NAME,
-                                                                       graipid, drain_type_name, log_message,
-                                                                       action_taken_msg)
-                                        # write to the log text file
-                                        utils.add_entry_to_log_file(self.wizard.dp_log_file, graipid, drain_type_name,
-                                                                    log_message, action_taken_msg)
-
-                                    if field_name in dp_table_field_names:
-                                        dp_row_data[field_name] = value_matching_id
-                                    else:
-                                        dp_att_row_data[field_name] = value_matching_id
-                                else:
-                                    if field_name in dp_table_field_names:
-                                        dp_row_data[field_name] = value_matching_id
-                                    else:
-                                        dp_att_row_data[field_name] = value_matching_id
-                    else:
-                        if dp_target_field_name in ('CDate', 'CTime', 'VehicleID'):
-                            msg = dp_target_field_name + " can't take default values"
-                            raise Exception(msg)
-
-                        # TODO: probably we have to display the define value dialog here too
-
-                # insert/update data to DrainPoints table
-                if not update_main_dp_table:
-                    col_names = ",".join(k for k in dp_row_data.keys())
-                    col_values = tuple(dp_row_data.values())
-                    insert_sql = "INSERT INTO DrainPoints({col_names}) VALUES {col_values}"
-                    insert_sql = insert_sql.format(col_names=col_names, col_values=col_values)
-                    cursor.execute(insert_sql)
-                else:
-                    if "GRAIPDID" in dp_row_data:
-                        del dp_row_data['GRAIPDID']
-
-                    col_names = ",".join(k + "=?" for k in dp_row_data.keys())
-                    params = tuple(dp_row_data.values()) + (graipid,)
-                    update_sql = "UPDATE DrainPoints SET {}  WHERE GRAIPDID=?".format(col_names)
-                    cursor.execute(update_sql, params)
-
-                # insert data to matching attribute table
-                col_names = ",".join(k for k in dp_att_row_data.keys())
-
-                if len(dp_att_row_data.values()) > 1:
-                    col_values = tuple(dp_att_row_data.values())
-                    insert_sql = "INSERT INTO {table_name}({col_names}) VALUES {col_values}"
-                else:
-                    col_values = dp_att_row_data.values()[0]
-                    insert_sql = "INSERT INTO {table_name}({col_names}) VALUES ({col_values})"
-
-                insert_sql = insert_sql.format(table_name=drain_type_def_row.TableName, col_names=col_names,
-                                               col_values=col_values)
-                cursor.execute(insert_sql)
-                conn.commit()
-                # set data for the DrainID field in DrainPoints table
-                dp_row = cursor.execute("SELECT * FROM DrainPoints WHERE GRAIPDID=?", graipid).fetchone()
-                if dp_row.CTime != 999:
-                    # TODO: Instead of the following code use the function in utils.py
-                    # remove am/pm
-                    time = dp_row.CTime[:-2]
-                    time_hour, time_min, time_sec = time.split(":")
-                    time_hour = int(time_hour)
-                    time_min = int(time_min)
-                    time_sec = int(time_sec)
-                    if time_sec > 30:
-                        time_min += 1
-                    if "p" in dp_row.CTime and time_hour != 12:
-                        time_hour += 12
-
-                    if "a" in dp_row.CTime and time_hour == 12:
-                        time_hour = 0
-                    time_24_format = (time_hour * 100) + time_min
-
-                    dt_obj = dp_row.CDate
-                    # get 2 digit year
-                    year = int(str(dt_obj.year)[2:])
-                    drain_id = (year * 1000000000) + (dt_obj.month * 10000000) + (dt_obj.day * 100000) + \
-                               (time_24_format * 10) + dp_row.VehicleID
-                    update_sql = "UPDATE DrainPoints SET DrainID=? WHERE GRAIPDID=?"
-                    # DrainID is of data type double in graip database
-                    drain_id = float(drain_id)
-                    data = (drain_id, graipid)
-                    cursor.execute(update_sql, data)
-                    conn.commit()
-
-                graipid += 1
-                # update progress bar
-                progress_bar_counter += 1
-                self.progress_bar.setValue(progress_bar_counter)
-                qApp.processEvents()
-            conn.close()
-        except (pyodbc.DatabaseError, pyodbc.DataError) as ex:
-            is_error = True
-            utils.handle_exception(ex)
+            dp_shapefile = self.line_edit_imported_file.text()
+            field_matches = self.get_field_matches()
+            spec = import_engine.ShapefileImportSpec(shp_type='DP', shp_file=dp_shapefile,
+                                                     field_matches=field_matches,
+                                                     drain_type_name=self.dp_type_combo_box.currentText())
+            engine = self.create_import_engine()
+            # if the drainpoints file has been processed before only its changes are written to the
+            # DrainPoints table
+            self.import_shapefile(engine, spec)
+            self.save_mapping_profile(field_matches)
         except Exception as ex:
             # TODO: write the error to the log file
             is_error = True
+            self.wizard.db_session.rollback()
             utils.handle_exception(ex)
         finally:
-            if conn and is_error:
-                conn.close()
-
             # return True will take to the next page. return False will keep on the same page
             return not is_error
 
@@ -736,60 +497,26 @@ class DrainPointPage(utils.ImportWizardPage):
 class RoadLinePage(utils.ImportWizardPage):
 
     def initializePage(self, *args, **kwargs):
-        graip_db_file = self.wizard.line_edit_mdb_file.text()
-        conn = pyodbc.connect(utils.MS_ACCESS_CONNECTION % graip_db_file)
-        cursor = conn.cursor()
         # populate the field match table based on the road line shapefile being imported
         if self.field_match_table_wizard is None:
             rd_shapefile = self.line_edit_imported_file.text()
-            shp_file_attribute_names = utils.get_shapefile_attribute_column_names(rd_shapefile)
-            self.no_match_use_default = '<No Match Use Default>'
-            shp_file_attribute_names = [self.no_match_use_default] + shp_file_attribute_names
+            self.shp_file_attribute_names = core.get_shapefile_attribute_column_names(rd_shapefile)
+            self.no_match_use_default = core.NO_MATCH_USE_DEFAULT
+            shp_file_attribute_names = [self.no_match_use_default] + self.shp_file_attribute_names
             table_headers = ['Target Field', 'Matching Source Field']
-            # TODO: populate the Road Network combobox by loading data from the RoadNetworkDefinitions table
-            rd_network_def_rows = cursor.execute("SELECT * FROM RoadNetworkDefinitions").fetchall()
+            # use the field matches last used for a shapefile with the same fields if there is a profile for it
+            field_matches = mapping_profiles.get_field_matches(self.wizard.db_session, 'RD', None,
+                                                               self.shp_file_attribute_names)
+            with self.wizard.db_session.read_cursor() as cursor:
+                # TODO: populate the Road Network combobox by loading data from the RoadNetworkDefinitions table
+                rd_network_def_rows = cursor.execute("SELECT * FROM RoadNetworkDefinitions").fetchall()
+
             rd_network_values = [row.RoadNetwork for row in rd_network_def_rows]
             self.rd_network_combo_box.addItems(rd_network_values)
             self.update_rd_network_gui_elements()
 
-            # find the target field names in the database corresponding to the shapefile being imported
-            field_name_rows = cursor.execute("SELECT DBField FROM FieldMatches "
-                                             "WHERE AttTableID =0").fetchall()
-            target_field_col_data = [row.DBField for row in field_name_rows]
-
-            source_field_col_data = []
-            for target_fld in target_field_col_data:
-                source_field_row = cursor.execute("SELECT DBFField FROM FieldMatches "
-                                                  "WHERE DBField = ?", target_fld).fetchone()
-                if source_field_row:
-                    # check if the DBFField value matches (if at least first 3 chars need to match)
-                    # with any of the values in the combobox used for the 2nd column of the table
-                    found_match = False
-                    for shp_att_name in shp_file_attribute_names:
-                        if shp_att_name.lower() == source_field_row.DBFField.lower():
-                            source_field_col_data.append(source_field_row.DBFField)
-                            found_match = True
-                            break
-
-                    if not found_match:
-                        match_field = None
-                        for shp_att_name in shp_file_attribute_names:
-                            if len(shp_att_name) > 2 and len(source_field_row.DBFField) > 2:
-                                # match at least any first 3 characters
-                                match_count = 0
-                                for i in range(len(shp_att_name)):
-                                    if i < len(source_field_row.DBFField):
-                                        if shp_att_name[0:i+1].lower() == source_field_row.DBFField[0:i+1].lower():
-                                            match_count += 1
-
-                                if match_count > 2:
-                                    match_field = shp_att_name
-                                    break
-
-                        if match_field is not None and match_field not in source_field_col_data:
-                            source_field_col_data.append(match_field)
-                        else:
-                            source_field_col_data.append(self.no_match_use_default)
+            target_field_col_data = [target_fld for target_fld, _ in field_matches]
+            source_field_col_data = [src_fld for _, src_fld in field_matches]
             target_source_combined = zip(target_field_col_data, source_field_col_data)
             table_data = [[item[0], item[1]] for item in target_source_combined]
             cmb_data = shp_file_attribute_names
@@ -797,7 +524,6 @@ class RoadLinePage(utils.ImportWizardPage):
                                                               cmb_data=cmb_data)
 
             self.v_set_fields_layout.addWidget(self.field_match_table_wizard)
-            conn.close()
 
     def validatePage(self, *args, **kwargs):
         # this function is executed when next button is selected
@@ -807,288 +533,38 @@ class RoadLinePage(utils.ImportWizardPage):
 
         is_error = False
         try:
-            graip_db_file = self.wizard.line_edit_mdb_file.text()
-            conn = pyodbc.connect(utils.MS_ACCESS_CONNECTION % graip_db_file)
-            cursor = conn.cursor()
-            # get column names of the RoadLines table
-            rd_table_field_names = [row.column_name for row in cursor.columns(table="RoadLines")]
-
-            # open roadlines shapefile
-            update_main_rd_table = False
             rd_shapefile = self.line_edit_imported_file.text()
-            if rd_shapefile in self.wizard.rd_shp_file_processing_track_dict:
-                graipid = self.wizard.rd_shp_file_processing_track_dict[rd_shapefile]
-                # delete all records from RoadLines table for this graipid
-                cursor.execute("DELETE * FROM RoadLines WHERE GRAIPRID=?", graipid)
-                conn.commit()
-                update_main_rd_table = True
-            else:
-                # find out the next GRAIPRID from the RoadLines table
-                rd_row = cursor.execute("SELECT MAX(GRAIPRID)AS Max_GRAIPRID FROM RoadLines").fetchone()
-                if rd_row[0] is not None:
-                    graipid = rd_row.Max_GRAIPRID + 1
-                else:
-                    graipid = 0
-                self.wizard.rd_shp_file_processing_track_dict[rd_shapefile] = graipid
-
-            gdal_driver = ogr.GetDriverByName(utils.GDALFileDriver.ShapeFile())
-            data_source = gdal_driver.Open(rd_shapefile, 1)
-            layer = data_source.GetLayer(0)
-
-            # set progress bar
-            progress_bar_max = len(layer)
-            self.progress_bar.setMaximum(progress_bar_max)
-            progress_bar_counter = 0
-            track_field_mismatch = []
-            # for each drain point in shapefile
-            for dp in layer:
-                fld_match_table_model = self.field_match_table_wizard.table_model
-
-                # collect data to be inserted to RoadLines table
-                rd_row_data = {'GRAIPRID': graipid, 'Comments': ''}
-
-                # for each field name imported from the shape file (table grid source column (col#2))
-                for row in range(fld_match_table_model.rowCount()):
-                    # find the source column name (2nd column of the table)
-                    rd_src_field_name = str(fld_match_table_model.index(row, 1).data())
-                    rd_target_field_name = str(fld_match_table_model.index(row, 0).data())
-                    # if a matching source field name exists
-                    if rd_src_field_name != self.no_match_use_default:
-                        # get the value for that field from the shapefile
-                        rd_att_value = dp.GetField(rd_src_field_name)
-                        # if a value/data exists in the shapefile
-                        if rd_att_value:
-                            field_name = fld_match_table_model.index(row, 0).data()
-
-                            # check if there is a DefinitionTable in MetaData table matching the field_name
-                            metadata_row = cursor.execute("SELECT DefinitionTable FROM MetaData WHERE IDFieldName=?",
-                                                          field_name).fetchone()
-
-                            # if no matching definition table was found then write the original data value
-                            if metadata_row is None:
-                                is_type_match = False
-                                if field_name in rd_table_field_names:
-                                    # check datatype of the column with the value being assigned
-                                    is_type_match = utils.is_data_type_match(graip_db_file,
-                                                                             "RoadLines", field_name,
-                                                                             rd_att_value)
-                                    if is_type_match:
-                                        rd_row_data[field_name] = rd_att_value
-
-                                if not is_type_match:
-                                    # show message describing the mismatch
-                                    rd_shapefile_basename = os.path.basename(rd_shapefile)
-                                    if field_name not in track_field_mismatch:
-                                        track_field_mismatch.append(field_name)
-                                        action_taken_msg = "A default value will be used"
-                                        log_message = "Type mismatch between field '{target_fld_name}' in database and " \
-                                                      "value '{value}' in field '{source_fld_name}' in shapefile." \
-                                                      "'{shp_file}'.".format(target_fld_name=field_name, value=rd_att_value,
-                                                                             source_fld_name=rd_src_field_name,
-                                                                             shp_file=rd_shapefile_basename)
-                                        msg = log_message + "{}.".format(action_taken_msg)
-
-                                        if not self.wizard.is_uninterrupted:
-                                            msg_box = utils.GraipMessageBox()
-                                            msg_box.setIcon(QMessageBox.Information)
-                                            msg_box.setText(msg)
-                                            msg_box.setWindowTitle("Mismatch")
-                                            msg_box.exec_()
-
-                                        # TODO: need to write to the log file and other bits of processing
-                                        # Ref to getIDFromDefinitionTable function in modGeneralFunction
-                                        rd_network_type = self.rd_network_combo_box.currentText()
-                                        utils.add_entry_to_log_file(self.wizard.dp_log_file, graipid, rd_network_type,
-                                                                    log_message, action_taken_msg)
-
-                            else:
-                                # found a matching Definition Table
-                                definition_table_name = metadata_row.DefinitionTable
-                                # definition_table_name = definition_table_name.replace("'", "''")
-                                sql_select = "SELECT * FROM {}".format(definition_table_name)
-                                definition_table_rows = cursor.execute(sql_select).fetchall()
-                                value_matching_id = None
-                                for table_row in definition_table_rows:
-                                    # second column has the definition values
-                                    if table_row[1].lower() == rd_att_value.lower():
-                                        # first column has the definition ID
-                                        value_matching_id = table_row[0]
-                                        break
-
-                                if value_matching_id is None:
-                                    # check to see if already done Define Value dialog for this value, If so, use that
-                                    # value - no need to show Define Value dialog
-                                    sql_select = "SELECT * FROM ValueReassigns WHERE FromField=? AND DefinitionTable=?"
-                                    params = (rd_att_value, definition_table_name)
-                                    value_assigns_row = cursor.execute(sql_select, params).fetchone()
-                                    if value_assigns_row:
-                                        value_matching_id = value_assigns_row.DefinitionID
-                                    else:
-                                        # need to show Define Value dialog
-                                        # for details on how to setup the DefineValueDialog
-                                        # refer to vb module modGeneralFunctions and function getIDFromDefinitionTable
-                                        if field_name in ('FlowPathVeg1ID', 'FlowPathVeg2ID', 'SurfaceTypeID'):
-                                            define_value_dlg = utils.DefineValueDialog(missing_field_value=rd_att_value,
-                                                                                       missing_field_name=field_name,
-                                                                                       graip_db_file=graip_db_file,
-                                                                                       def_table_name=definition_table_name,
-                                                                                       is_multiplier=True)
-                                        else:
-                                            define_value_dlg = utils.DefineValueDialog(missing_field_value=rd_att_value,
-                                                                                       missing_field_name=field_name,
-                                                                                       graip_db_file=graip_db_file,
-                                                                                       def_table_name=definition_table_name)
-                                        if not self.wizard.is_uninterrupted:
-                                            define_value_dlg.show()
-                                            define_value_dlg.exec_()
-                                            if define_value_dlg.is_cancel:
-                                                raise Exception("Aborting processing of this shapefile")
-                                        else:
-                                            define_value_dlg.accept()
-
-                                        value_matching_id = define_value_dlg.definition_id
-                                        action_taken_msg = define_value_dlg.action_taken_msg
-                                        # write to the log table
-                                        log_message = "Value '{}' in field '{}' is not in the '{}' definitions table."
-                                        log_message = log_message.format(rd_att_value, field_name, definition_table_name)
-                                        rd_network_type = self.rd_network_combo_box.currentText()
-                                        utils.add_entry_to_error_table(graip_db_file, utils.DP_ERROR_LOG_TABLE_NAME,
-                                                                       graipid, rd_network_type, log_message,
-                                                                       action_taken_msg)
-                                        # write to the log text file
-                                        utils.add_entry_to_log_file(self.wizard.dp_log_file, graipid, rd_network_type,
-                                                                    log_message, action_taken_msg)
-
-                                    if field_name in rd_table_field_names:
-                                        rd_row_data[field_name] = value_matching_id
-                                    else:
-                                        raise Exception("'{}' field name is not in RoadLines table".format(field_name))
-                                else:
-                                    if field_name in rd_table_field_names:
-                                        rd_row_data[field_name] = value_matching_id
-                                    else:
-                                        raise Exception("'{}' field name is not in RoadLines table".format(field_name))
-                    else:
-                        if rd_target_field_name in ('CDate', 'CTime1', 'CTime2' 'VehicleID'):
-                            msg = rd_target_field_name + " can't take default values"
-                            raise Exception(msg)
-
-                        # TODO: probably we have to display the define value dialog here too
-
-                # insert/update data to RoadLines table
-                if not update_main_rd_table:
-                    col_names = ",".join(k for k in rd_row_data.keys())
-                    col_values = tuple(rd_row_data.values())
-                    insert_sql = "INSERT INTO RoadLines({col_names}) VALUES {col_values}"
-                    insert_sql = insert_sql.format(col_names=col_names, col_values=col_values)
-                    cursor.execute(insert_sql)
-                else:
-                    if "GRAIPRID" in rd_row_data:
-                        del rd_row_data['GRAIPRID']
-
-                    col_names = ",".join(k + "=?" for k in rd_row_data.keys())
-                    params = tuple(rd_row_data.values()) + (graipid,)
-                    update_sql = "UPDATE RoadLines SET {}  WHERE GRAIPRID=?".format(col_names)
-                    cursor.execute(update_sql, params)
-
-                conn.commit()
-
-                # update the RoadNetworkID field value in RoadLines table
-                rd_network_type = self.rd_network_combo_box.currentText()
-                rd_network_type_id = self.rd_network_combo_box.findText(rd_network_type)
-                if rd_network_type_id != -1:
-                    rd_network_type_id += 1
-                    update_sql = "UPDATE RoadLines SET RoadNetworkID=? WHERE GRAIPRID=?"
-                    data = (rd_network_type_id, graipid)
-                    cursor.execute(update_sql, data)
-                    conn.commit()
-
-                # set data for the DrainID fields in RoadLines table
-                rd_row = cursor.execute("SELECT * FROM RoadLines WHERE GRAIPRID=?", graipid).fetchone()
-                if rd_row.CTime1 != 999:
-                    drain_id = utils.get_drain_id(rd_row.CTime1, rd_row.CDate, rd_row.VehicleID)
-                    update_sql = "UPDATE RoadLines SET OrigDrainID1=? WHERE GRAIPRID=?"
-                    # DrainID is of data type double in graip database
-                    drain_id = float(drain_id)
-                    data = (drain_id, graipid)
-                    cursor.execute(update_sql, data)
-                    conn.commit()
-
-                if rd_row.CTime2 != 999:
-                    drain_id = utils.get_drain_id(rd_row.CTime2, rd_row.CDate, rd_row.VehicleID)
-                    update_sql = "UPDATE RoadLines SET OrigDrainID2=? WHERE GRAIPRID=?"
-                    # DrainID is of data type double in graip database
-                    drain_id = float(drain_id)
-                    data = (drain_id, graipid)
-                    cursor.execute(update_sql, data)
-                    conn.commit()
-
-                # TODO: populate the GRAIPDID1, GRAIPDID2, StreamConnect1ID, StreamConnect2ID
-                # Ref: frmPPWizard3 (importValuesToDatabase) here is the copied code from old graip
-                has_dp1 = False
-                has_dp2 = False
-                # check to see if the 1st drainpoint record exists
-                rd_row = cursor.execute("SELECT * FROM RoadLines WHERE GRAIPRID=?", graipid).fetchone()
-                dp_row = cursor.execute("SELECT * FROM DrainPoints WHERE DrainID=?", rd_row.OrigDrainID1).fetchone()
-                if dp_row is not None:
-                    update_sql = "UPDATE RoadLines SET GRAIPDID1=? WHERE GRAIPRID=?"
-                    data = (dp_row.GRAIPDID, graipid)
-                    cursor.execute(update_sql, data)
-                    update_sql = "UPDATE RoadLines SET StreamConnect1ID=? WHERE GRAIPRID=?"
-                    data = (dp_row.StreamConnectID, graipid)
-                    cursor.execute(update_sql, data)
-                    conn.commit()
-                    has_dp1 = True
-
-                # check to see if the 2nd drainpoint record exists
-                dp_row = cursor.execute("SELECT * FROM DrainPoints WHERE DrainID=?", rd_row.OrigDrainID2).fetchone()
-                if dp_row is not None:
-                    update_sql = "UPDATE RoadLines SET GRAIPDID2=? WHERE GRAIPRID=?"
-                    data = (dp_row.GRAIPDID, graipid)
-                    cursor.execute(update_sql, data)
-                    update_sql = "UPDATE RoadLines SET StreamConnect2ID=? WHERE GRAIPRID=?"
-                    data = (dp_row.StreamConnectID, graipid)
-                    cursor.execute(update_sql, data)
-                    conn.commit()
-                    has_dp2 = True
-
-                # if no drainpoints write to the log
-                if not has_dp1 and not has_dp2:
-                    utils.add_entry_to_log_file(self.wizard.dp_log_file, graipid, rd_network_type, "Doesn't drain",
-                                                "Nothing")
-                    # TODO: check why we not writing the database log table
-
-                graipid += 1
-                # update progress bar
-                progress_bar_counter += 1
-                self.progress_bar.setValue(progress_bar_counter)
-                qApp.processEvents()
-            conn.close()
+            field_matches = self.get_field_matches()
+            spec = import_engine.ShapefileImportSpec(shp_type='RD', shp_file=rd_shapefile,
+                                                     field_matches=field_matches,
+                                                     road_network_name=self.rd_network_combo_box.currentText())
+            engine = self.create_import_engine()
+            self.import_shapefile(engine, spec)
+            self.save_mapping_profile(field_matches)
+
             # show consolidate shapefiles dialog
             dp_shp_files = utils.get_items_from_list_box(self.wizard.lst_widget_dp_shp_files)
             rd_shp_files = utils.get_items_from_list_box(self.wizard.lst_widget_rd_shp_files)
-            dlg = utils.ConsolidateShapeFiles(graip_db_file=graip_db_file, dp_shp_files=dp_shp_files,
+            dlg = utils.ConsolidateShapeFiles(db_session=self.wizard.db_session, dp_shp_files=dp_shp_files,
                                               rd_shp_files=rd_shp_files,
                                               dp_log_file=self.wizard.dp_log_file,
                                               rd_log_file=self.wizard.rd_log_file,
                                               working_directory=self.wizard.working_directory,
+                                              output_format=self.wizard.output_format,
+                                              include_attributes=self.wizard.include_attributes,
+                                              is_compact_database=self.wizard.is_compact_database,
                                               parent=self)
             self.wizard.hide()
             dlg.show()
             dlg.do_process()
             dlg.exec_()
 
-        except (pyodbc.DatabaseError, pyodbc.DataError) as ex:
-            is_error = True
-            utils.handle_exception(ex)
         except Exception as ex:
             # TODO: write the error to the log file
             is_error = True
+            self.wizard.db_session.rollback()
             utils.handle_exception(ex)
         finally:
-            if conn and is_error:
-                conn.close()
-
             # return True will take to the next page. return False will keep on the same page
             return not is_error
 
@@ -1102,5 +578,9 @@ class RoadLinePage(utils.ImportWizardPage):
             prev_page = self.wizard.wizard.page(prev_page_id)
             prev_page.progress_bar.setValue(0)
 
-app = Preprocessor()
-app.run()
+
+if __name__ == '__main__':
+    # worker processes started on Windows import this module again
+    multiprocessing.freeze_support()
+    app = Preprocessor()
+    app.run()
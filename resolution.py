@@ -0,0 +1,161 @@
+"""
+Resolution of values that are not in a definitions table without asking the user (uninterrupted mode and
+scripted runs). A ResolutionPolicy applies a list of rules to each unknown value using an in memory copy of
+the definitions tables, in place of the Define Value dialog.
+"""
+
+import core
+import matching
+
+# reassign the value to the definition it matches (same first 3 characters)
+RULE_CLOSEST_MATCH = 'closest_match'
+# reassign the value to the default definition of the table
+RULE_USE_DEFAULT = 'use_default'
+# add the value as a new definition
+RULE_ADD_NEW = 'add_new'
+RESOLUTION_RULES = (RULE_CLOSEST_MATCH, RULE_USE_DEFAULT, RULE_ADD_NEW)
+
+# the choice the Define Value dialog preselects
+DEFAULT_RULES = (RULE_CLOSEST_MATCH, RULE_USE_DEFAULT, RULE_ADD_NEW)
+
+
+class ResolutionPolicy(object):
+    """
+    Resolves values that are not in a definitions table by trying the rules (RESOLUTION_RULES) in order until
+    one applies. table_rules overrides the rules for some definitions tables (definitions table name -> rules)
+    and value_overrides reassigns given values (definitions table name -> {value: definition}).
+
+    Each definitions table is read once. New definitions are written right away; the ValueReassigns rows are
+    written in batches of batch_size rows and on flush(). Nothing is committed - the rows are committed with
+    the session. Call clear() after rolling back the session.
+    """
+    def __init__(self, db_session, rules=DEFAULT_RULES, table_rules=None, value_overrides=None, batch_size=500):
+        for rule in list(rules) + [rule for table_rule in (table_rules or {}).values() for rule in table_rule]:
+            if rule not in RESOLUTION_RULES:
+                raise Exception("{} is not a valid rule for resolving a missing definition value.".format(rule))
+
+        self.db_session = db_session
+        self.rules = tuple(rules)
+        self.table_rules = dict((def_table_name.lower(), tuple(table_rule))
+                                for def_table_name, table_rule in (table_rules or {}).items())
+        self.value_overrides = dict((def_table_name.lower(), dict((str(value).lower(), definition)
+                                                                  for value, definition in overrides.items()))
+                                    for def_table_name, overrides in (value_overrides or {}).items())
+        self.batch_size = batch_size
+        # definitions table name -> _DefinitionsTable
+        self._tables = {}
+        self._pending_reassigns = []
+
+    def resolve(self, missing_field_value, def_table_name, is_multiplier=False):
+        """
+        Returns the definition id to use for missing_field_value and the action taken message
+        """
+        table = self._get_table(def_table_name)
+        override = self.value_overrides.get(def_table_name.lower(), {}).get(str(missing_field_value).lower(), None)
+        if override is not None:
+            definition_index = table.get_definition_index(override)
+            if definition_index is None:
+                raise Exception("'{}' is not a definition in the '{}' definitions table.".format(override,
+                                                                                               def_table_name))
+            return self._reassign(table, core.ACTION_REASSIGN_VALUE, missing_field_value,
+                                  table.definitions[definition_index], table.definition_ids[definition_index])
+
+        for rule in self.table_rules.get(def_table_name.lower(), self.rules):
+            if rule == RULE_CLOSEST_MATCH:
+                matching_index, is_match_found = table.get_matcher().match(missing_field_value)
+                if is_match_found:
+                    return self._reassign(table, core.ACTION_REASSIGN_VALUE, missing_field_value,
+                                          table.definitions[matching_index], table.definition_ids[matching_index])
+            elif rule == RULE_USE_DEFAULT:
+                if table.default_definition is not None:
+                    return self._reassign(table, core.ACTION_USE_DEFAULT, missing_field_value,
+                                          table.default_definition, table.default_id)
+            else:
+                return self._add_new(table, missing_field_value, is_multiplier)
+
+        raise Exception("No rule resolves value '{}' that is not in the '{}' definitions "
+                        "table.".format(missing_field_value, def_table_name))
+
+    def has_override(self, missing_field_value, def_table_name):
+        """
+        Returns True if missing_field_value is reassigned by value_overrides
+        """
+        return str(missing_field_value).lower() in self.value_overrides.get(def_table_name.lower(), {})
+
+    def flush(self):
+        """
+        Writes the buffered ValueReassigns rows
+        """
+        if self._pending_reassigns:
+            sql_insert = "INSERT INTO ValueReassigns (FromField, ToField, DefinitionID, DefinitionTable) " \
+                         "VALUES (?, ?, ?, ?)"
+            self.db_session.cursor().executemany(sql_insert, self._pending_reassigns)
+            self._pending_reassigns = []
+
+    def clear(self):
+        """
+        Drops the buffered rows and the definitions read from the database
+        """
+        self._tables = {}
+        self._pending_reassigns = []
+
+    def _reassign(self, table, action, missing_field_value, definition, definition_id):
+        self._pending_reassigns.append((missing_field_value, definition, definition_id, table.name))
+        self.db_session.definitions.add_value_reassign(table.name, missing_field_value, definition_id)
+        if len(self._pending_reassigns) >= self.batch_size:
+            self.flush()
+        if action == core.ACTION_REASSIGN_VALUE:
+            return definition_id, "Reassigned value as {}".format(definition)
+        return definition_id, "Used Default - {}".format(definition)
+
+    def _add_new(self, table, missing_field_value, is_multiplier):
+        definition_id = table.next_id
+        multiplier = "1" if is_multiplier else None
+        action_taken_msg = core.save_definition_action(self.db_session.cursor(), core.ACTION_ADD_NEW, table.name,
+                                                       missing_field_value, missing_field_value, definition_id,
+                                                       description=missing_field_value, multiplier=multiplier,
+                                                       definitions_index=self.db_session.definitions)
+        table.add_definition(definition_id, missing_field_value)
+        return definition_id, action_taken_msg
+
+    def _get_table(self, def_table_name):
+        key = def_table_name.lower()
+        if key not in self._tables:
+            self._tables[key] = _DefinitionsTable(self.db_session.cursor(), def_table_name)
+        return self._tables[key]
+
+
+class _DefinitionsTable(object):
+    # the rows of a definitions table as used for resolving values (see core.get_definition_choices)
+    def __init__(self, cursor, name):
+        self.name = name
+        def_rows = cursor.execute("SELECT * FROM {}".format(name)).fetchall()
+        # definitions are in the 2nd column and definition IDs in the 1st column of the definitions table
+        self.definitions = [row[1] for row in def_rows]
+        self.definition_ids = [row[0] for row in def_rows]
+        self.default_definition = None
+        self.default_id = 0
+        for row in def_rows:
+            if row.Description is not None and 'default' in row.Description.lower():
+                self.default_definition = row[1]
+                self.default_id = row[0]
+                break
+        self.next_id = max(self.definition_ids) + 1 if self.definition_ids else 0
+        self._matcher = None
+
+    def get_matcher(self):
+        if self._matcher is None:
+            self._matcher = matching.DefinitionMatcher(self.definitions)
+        return self._matcher
+
+    def get_definition_index(self, definition):
+        for index, table_definition in enumerate(self.definitions):
+            if str(table_definition).lower() == str(definition).lower():
+                return index
+        return None
+
+    def add_definition(self, definition_id, definition):
+        self.definitions.append(definition)
+        self.definition_ids.append(definition_id)
+        self.next_id = max(self.next_id, definition_id + 1)
+        self._matcher = None
@@ -0,0 +1,158 @@
+"""
+Sample GRAIP databases and shapefiles for the tests: a SQLite GRAIP database with the Sump drain type (attribute
+table SumpAtt with a CondID definition field) and the Main road network, and point shapefiles made with OGR.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from osgeo import ogr
+
+import core
+import graip_db
+import import_engine
+
+SUMP_DRAIN_TYPE_ID = 1
+
+# (DBField, DBFField) rows of FieldMatches for the Sump drain type
+SUMP_FIELD_MATCHES = [("CDate", "CDATE"), ("CTime", "CTIME"), ("VehicleID", "VEHICLE"), ("CondID", "COND"),
+                      ("Depth", "DEPTH")]
+
+# (CondID, CondName, Description) rows of CondDefinitions
+COND_DEFINITIONS = [(1, "Good", "Good condition"), (2, "Poor", "Default value"), (3, "Buried", "Buried outlet")]
+
+# (field name, OGR field type) of the sample drain point shapefiles
+SUMP_SHP_FIELDS = [("CDATE", ogr.OFTString), ("CTIME", ogr.OFTString), ("VEHICLE", ogr.OFTInteger),
+                   ("COND", ogr.OFTString), ("DEPTH", ogr.OFTReal)]
+
+# field matches and (field name, OGR field type) of the sample road line shapefiles
+RD_FIELD_MATCHES = [("CDate", "CDATE"), ("CTime1", "CTIME1"), ("CTime2", "CTIME2"), ("VehicleID", "VEHICLE")]
+RD_SHP_FIELDS = [("CDATE", ogr.OFTString), ("CTIME1", ogr.OFTString), ("CTIME2", ogr.OFTString),
+                 ("VEHICLE", ogr.OFTInteger)]
+
+
+class GraipTestCase(unittest.TestCase):
+    """
+    Test case with a sample SQLite GRAIP database (self.db_file) in a temporary directory (self.temp_dir)
+    """
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.temp_dir, "GRAIP.sqlite")
+        create_sample_database(self.db_file)
+        self.db_sessions = []
+
+    def tearDown(self):
+        for db_session in self.db_sessions:
+            db_session.close()
+        shutil.rmtree(self.temp_dir)
+
+    def open_session(self):
+        db_session = graip_db.DatabaseSession(self.db_file)
+        self.db_sessions.append(db_session)
+        return db_session
+
+    def get_shp_file(self, name):
+        return os.path.join(self.temp_dir, name + ".shp")
+
+    def create_import_engine(self, db_session):
+        dp_log_file = os.path.join(self.temp_dir, "DrainPointsImport.log")
+        rd_log_file = os.path.join(self.temp_dir, "RoadLinesImport.log")
+        core.create_log_file(self.db_file, dp_log_file, 'DP')
+        core.create_log_file(self.db_file, rd_log_file, 'RD')
+        return import_engine.ImportEngine(db_session, dp_log_file, rd_log_file)
+
+    def write_sump_shapefile(self, name, rows, srs=None):
+        shp_file = self.get_shp_file(name)
+        write_point_shapefile(shp_file, SUMP_SHP_FIELDS, rows, srs=srs)
+        return shp_file
+
+
+def create_sump_spec(shp_file, field_matches=None):
+    return import_engine.ShapefileImportSpec('DP', shp_file, field_matches or SUMP_FIELD_MATCHES,
+                                             drain_type_name='Sump')
+
+
+def create_road_spec(shp_file):
+    return import_engine.ShapefileImportSpec('RD', shp_file, RD_FIELD_MATCHES, road_network_name='Main')
+
+
+def create_sample_database(db_file):
+    graip_db.create_database(db_file)
+    conn = graip_db.connect(db_file)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO DrainTypeDefinitions VALUES (?, 'Sump', 'SumpAtt')", SUMP_DRAIN_TYPE_ID)
+        cursor.execute("CREATE TABLE SumpAtt (GRAIPDID INTEGER, CondID INTEGER, Depth DOUBLE)")
+        cursor.execute("CREATE TABLE CondDefinitions (CondID INTEGER, CondName VARCHAR(50), "
+                       "Description VARCHAR(255))")
+        cursor.executemany("INSERT INTO CondDefinitions VALUES (?, ?, ?)", COND_DEFINITIONS)
+        cursor.execute("INSERT INTO MetaData VALUES ('CondID', 'CondDefinitions')")
+        cursor.execute("INSERT INTO RoadNetworkDefinitions (RoadNetwork) VALUES ('Main')")
+        cursor.executemany("INSERT INTO FieldMatches VALUES (?, ?, ?)",
+                           [(SUMP_DRAIN_TYPE_ID, db_field, dbf_field) for db_field, dbf_field in SUMP_FIELD_MATCHES])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def create_sump_row(index, cond='Good', depth=1.5):
+    """
+    Returns the attribute values of a sample drain point shapefile feature
+    """
+    return {"CDATE": "2016/06/01", "CTIME": "10:{:02d}:00am".format(index % 60), "VEHICLE": 3, "COND": cond,
+            "DEPTH": depth}
+
+
+def write_point_shapefile(shp_file, fields, rows, srs=None):
+    """
+    Writes a point shapefile with fields, a list of (field name, OGR field type), and rows, a list of
+    field name -> value dicts. The features get feature IDs 0, 1, 2... in the order of rows. srs is the
+    osr.SpatialReference of the shapefile (none by default).
+    """
+    gdal_driver = ogr.GetDriverByName(core.GDALFileDriver.ShapeFile())
+    if os.path.exists(shp_file):
+        gdal_driver.DeleteDataSource(shp_file)
+    data_source = gdal_driver.CreateDataSource(shp_file)
+    try:
+        layer = data_source.CreateLayer(os.path.splitext(os.path.basename(shp_file))[0], srs, ogr.wkbPoint)
+        for field_name, field_type in fields:
+            layer.CreateField(ogr.FieldDefn(field_name, field_type))
+        for index, row in enumerate(rows):
+            _add_point_feature(layer, row, index)
+    finally:
+        data_source.Destroy()
+
+
+def edit_point_shapefile(shp_file, changed_rows=None, deleted_feature_ids=(), new_rows=()):
+    """
+    Edits a point shapefile in place as a user would in a GIS: changed_rows is feature ID -> field name -> new
+    value. Deleted features are not packed so the feature IDs of the other features stay the same.
+    """
+    gdal_driver = ogr.GetDriverByName(core.GDALFileDriver.ShapeFile())
+    data_source = gdal_driver.Open(shp_file, 1)
+    try:
+        layer = data_source.GetLayer(0)
+        for feature_id, changed_values in (changed_rows or {}).items():
+            feature = layer.GetFeature(feature_id)
+            for field_name, value in changed_values.items():
+                feature.SetField(field_name, value)
+            layer.SetFeature(feature)
+        for feature_id in deleted_feature_ids:
+            layer.DeleteFeature(feature_id)
+        for index, row in enumerate(new_rows):
+            _add_point_feature(layer, row, index)
+    finally:
+        data_source.Destroy()
+
+
+def _add_point_feature(layer, row, index):
+    feature = ogr.Feature(layer.GetLayerDefn())
+    for field_name, value in row.items():
+        feature.SetField(field_name, value)
+    point = ogr.Geometry(ogr.wkbPoint)
+    point.AddPoint(500000.0 + index, 5000000.0 + index)
+    feature.SetGeometry(point)
+    layer.CreateFeature(feature)
+    feature.Destroy()
@@ -0,0 +1,183 @@
+"""
+Tests of restoring the checkpoints of a previous run and of the records kept and deleted for a rerun
+"""
+
+import threading
+import unittest
+
+import checkpoints
+from sample_data import (RD_SHP_FIELDS, GraipTestCase, create_road_spec, create_sump_row, create_sump_spec,
+                         edit_point_shapefile, write_point_shapefile)
+
+
+class CheckpointsTests(GraipTestCase):
+    def setUp(self):
+        GraipTestCase.setUp(self)
+        self.dp_specs = [create_sump_spec(self.write_sump_shapefile("Sump{}".format(file_index),
+                                                                    [create_sump_row(index) for index in range(3)]))
+                         for file_index in range(3)]
+        rd_shp_file = self.get_shp_file("Roads")
+        write_point_shapefile(rd_shp_file, RD_SHP_FIELDS, [{"CDATE": "2016/06/01", "CTIME1": "10:00:00am",
+                                                            "CTIME2": "10:01:00am", "VEHICLE": 3}])
+        self.rd_spec = create_road_spec(rd_shp_file)
+
+    def run_import(self, dp_specs, rd_specs=(), failing_spec=None):
+        """
+        Runs an import of the shapefiles as the wizard does and returns the name of the ImportEngine method
+        called for each shapefile (None for a skipped shapefile). The import of failing_spec fails.
+        """
+        db_session = self.open_session()
+        engine = self.create_import_engine(db_session)
+        specs = list(dp_specs) + list(rd_specs)
+        run_checkpoints = checkpoints.restore_checkpoints(db_session, [(spec.shp_type, spec.shp_file)
+                                                                       for spec in specs])
+        import_calls = []
+        is_dp_changed = False
+        for spec in specs:
+            checkpoint = run_checkpoints[(spec.shp_type, spec.shp_file)]
+            import_call = checkpoints.get_import_call(engine, checkpoint, spec, is_dp_changed=is_dp_changed)
+            if import_call is None:
+                import_calls.append(None)
+                continue
+            import_function, args = import_call
+            import_calls.append(import_function.__name__)
+            checkpoints.start_import(db_session, checkpoint)
+            if spec is failing_spec:
+                engine.cancel()
+                self.assertRaises(Exception, import_function, *args)
+                db_session.rollback()
+                break
+            import_function(*args)
+            first_id, last_id = engine.get_imported_id_range(spec)
+            checkpoints.commit_import(db_session, checkpoint, spec, first_id, last_id)
+            is_dp_changed = is_dp_changed or spec.shp_type == 'DP'
+        db_session.close()
+        return import_calls
+
+    def get_checkpoints(self):
+        with self.open_session().read_cursor() as cursor:
+            return [(row.ShpFile, row.Status, row.FirstID, row.LastID) for row in cursor.execute(
+                "SELECT * FROM {} ORDER BY FileOrder".format(checkpoints.CHECKPOINTS_TABLE_NAME)).fetchall()]
+
+    def get_records(self, sql_select):
+        with self.open_session().read_cursor() as cursor:
+            return [tuple(row) for row in cursor.execute(sql_select).fetchall()]
+
+    def test_first_run(self):
+        self.assertEqual(self.run_import(self.dp_specs, [self.rd_spec]), ["import_drain_points"] * 3 +
+                         ["import_road_lines"])
+        self.assertEqual(self.get_checkpoints(), [(self.dp_specs[0].shp_file, checkpoints.STATUS_COMMITTED, 0, 2),
+                                                  (self.dp_specs[1].shp_file, checkpoints.STATUS_COMMITTED, 3, 5),
+                                                  (self.dp_specs[2].shp_file, checkpoints.STATUS_COMMITTED, 6, 8),
+                                                  (self.rd_spec.shp_file, checkpoints.STATUS_COMMITTED, 0, 0)])
+
+    def test_rerun_skips_committed(self):
+        self.run_import(self.dp_specs, [self.rd_spec])
+        self.assertEqual(self.run_import(self.dp_specs, [self.rd_spec]), [None] * 4)
+        self.assertEqual(len(self.get_records("SELECT * FROM DrainPoints")), 9)
+
+    def test_resume_after_failure(self):
+        self.assertEqual(self.run_import(self.dp_specs, failing_spec=self.dp_specs[1]),
+                         ["import_drain_points"] * 2)
+        self.assertEqual([checkpoint[1] for checkpoint in self.get_checkpoints()],
+                         [checkpoints.STATUS_COMMITTED, checkpoints.STATUS_IMPORTING, checkpoints.STATUS_PENDING])
+
+        self.assertEqual(self.run_import(self.dp_specs), [None, "import_drain_points", "import_drain_points"])
+        self.assertEqual([checkpoint[2:] for checkpoint in self.get_checkpoints()], [(0, 2), (3, 5), (6, 8)])
+
+    def test_changed_shapefile(self):
+        self.run_import(self.dp_specs, [self.rd_spec])
+        edit_point_shapefile(self.dp_specs[1].shp_file, changed_rows={0: {"DEPTH": 2.5}})
+        run_checkpoints = checkpoints.restore_checkpoints(self.open_session(), [
+            (spec.shp_type, spec.shp_file) for spec in self.dp_specs + [self.rd_spec]])
+        self.assertEqual([run_checkpoints[(spec.shp_type, spec.shp_file)].status for spec in self.dp_specs],
+                         [checkpoints.STATUS_COMMITTED, checkpoints.STATUS_CHANGED, checkpoints.STATUS_COMMITTED])
+        # the road lines are linked to the changed drain points again
+        self.assertEqual(self.run_import(self.dp_specs, [self.rd_spec]),
+                         [None, "update_drain_points", None, "update_road_lines"])
+        self.assertEqual(self.get_records("SELECT Depth FROM SumpAtt WHERE GRAIPDID=3"), [(2.5,)])
+
+    def test_changed_field_matches(self):
+        self.run_import(self.dp_specs)
+        db_session = self.open_session()
+        engine = self.create_import_engine(db_session)
+        run_checkpoints = checkpoints.restore_checkpoints(db_session, [(spec.shp_type, spec.shp_file)
+                                                                       for spec in self.dp_specs])
+        spec = self.dp_specs[0]
+        checkpoint = run_checkpoints[(spec.shp_type, spec.shp_file)]
+        self.assertIsNone(checkpoints.get_import_call(engine, checkpoint, spec))
+        changed_spec = create_sump_spec(spec.shp_file, [field_match for field_match in spec.field_matches
+                                                        if field_match[0] != "Depth"])
+        self.assertEqual(checkpoints.get_import_call(engine, checkpoint, changed_spec),
+                         (engine.update_drain_points, (changed_spec, True)))
+
+    def test_dropped_shapefile(self):
+        self.run_import(self.dp_specs, [self.rd_spec])
+        kept_specs = [self.dp_specs[0], self.dp_specs[2]]
+        run_checkpoints = checkpoints.restore_checkpoints(self.open_session(), [
+            (spec.shp_type, spec.shp_file) for spec in kept_specs + [self.rd_spec]])
+        # the records of the dropped shapefile are deleted and the others are kept
+        self.assertEqual(self.get_records("SELECT GRAIPDID FROM DrainPoints ORDER BY GRAIPDID"),
+                         [(0,), (1,), (2,), (6,), (7,), (8,)])
+        self.assertEqual(self.get_records("SELECT GRAIPDID FROM SumpAtt ORDER BY GRAIPDID"),
+                         [(0,), (1,), (2,), (6,), (7,), (8,)])
+        self.assertEqual(self.get_records("SELECT DISTINCT ShpFile FROM ImportedFeatures WHERE ShpType='DP' "
+                                          "ORDER BY ShpFile"), [(spec.shp_file,) for spec in kept_specs])
+        # road lines are linked to the drain points again
+        self.assertIsNone(run_checkpoints[(self.rd_spec.shp_type, self.rd_spec.shp_file)].mapping_hash)
+        self.assertEqual(self.run_import(kept_specs, [self.rd_spec]), [None, None, "update_road_lines"])
+
+    def test_new_run(self):
+        self.run_import(self.dp_specs, [self.rd_spec])
+        other_spec = create_sump_spec(self.write_sump_shapefile("Other", [create_sump_row(0)]))
+        run_checkpoints = checkpoints.restore_checkpoints(self.open_session(), [('DP', other_spec.shp_file)])
+        self.assertFalse(run_checkpoints[('DP', other_spec.shp_file)].is_imported)
+        for table_name in ("DrainPoints", "SumpAtt", "RoadLines", "ImportedFeatures"):
+            self.assertEqual(self.get_records("SELECT * FROM {}".format(table_name)), [])
+        self.assertEqual(self.run_import([other_spec]), ["import_drain_points"])
+
+    def test_no_commit_during_import(self):
+        # the wizard imports on a worker thread while the page stays responsive: nothing else may commit the
+        # part of the shapefile written so far
+        db_session = self.open_session()
+        engine = self.create_import_engine(db_session)
+        engine.batch_size = 1
+        engine.max_progress_rate = 0
+        spec = self.dp_specs[0]
+        checkpoint = checkpoints.restore_checkpoints(db_session, [(spec.shp_type, spec.shp_file)])[
+            (spec.shp_type, spec.shp_file)]
+        checkpoints.start_import(db_session, checkpoint)
+        is_importing = threading.Event()
+        is_commit_tried = threading.Event()
+
+        def wait_for_commit(shp_file, count_done, count_total):
+            if count_done == 2:
+                is_importing.set()
+                is_commit_tried.wait(10)
+
+        def import_drain_points():
+            with db_session.writer_thread():
+                engine.import_drain_points(spec)
+
+        engine.progress_callback = wait_for_commit
+        import_thread = threading.Thread(target=import_drain_points)
+        import_thread.start()
+        try:
+            self.assertTrue(is_importing.wait(10))
+            # the rows written so far are not committed and can't be committed from this thread
+            self.assertEqual(self.get_records("SELECT * FROM DrainPoints"), [])
+            self.assertRaises(Exception, db_session.commit)
+            self.assertRaises(Exception, db_session.rollback)
+            self.assertRaises(Exception, checkpoints.commit_import, db_session, checkpoint, spec, 0, 2)
+        finally:
+            is_commit_tried.set()
+            import_thread.join()
+
+        self.assertEqual(len(self.get_records("SELECT * FROM DrainPoints")), 3)
+        first_id, last_id = engine.get_imported_id_range(spec)
+        checkpoints.commit_import(db_session, checkpoint, spec, first_id, last_id)
+        self.assertEqual(self.get_checkpoints(), [(spec.shp_file, checkpoints.STATUS_COMMITTED, 0, 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+"""
+Tests of the GRAIPDIDs written to the consolidated drain points layer, of reprojecting features to the spatial
+reference of the first shapefile and of the database attributes written to shapefiles and GeoPackages
+"""
+
+import os
+import unittest
+
+from osgeo import ogr, osr
+
+import consolidate
+import core
+import import_engine
+from sample_data import (RD_SHP_FIELDS, GraipTestCase, create_road_spec, create_sump_row, create_sump_spec,
+                         edit_point_shapefile, write_point_shapefile)
+
+
+def create_srs(epsg_code):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg_code)
+    return srs
+
+
+def read_features(consolidated_file, field_names):
+    """
+    Returns (x, y, field values) of the first point of each feature of a consolidated file
+    """
+    if consolidated_file.endswith(consolidate.GEOPACKAGE_FORMAT):
+        gdal_driver = ogr.GetDriverByName(core.GDALFileDriver.GeoPackage())
+    else:
+        gdal_driver = ogr.GetDriverByName(core.GDALFileDriver.ShapeFile())
+    data_source = gdal_driver.Open(consolidated_file, 0)
+    try:
+        return [(feature.GetGeometryRef().GetX(), feature.GetGeometryRef().GetY(),
+                 tuple(feature.GetField(field_name) for field_name in field_names))
+                for feature in data_source.GetLayer(0)]
+    finally:
+        data_source.Destroy()
+
+
+class _TruncatingLayer(object):
+    # a layer that truncates field names to 10 characters without renaming fields whose truncated name is taken
+    def __init__(self):
+        self.field_names = []
+
+    def CreateField(self, field_defn):
+        self.field_names.append(field_defn.GetName()[:10])
+        return 0
+
+    def GetLayerDefn(self):
+        return self
+
+    def GetFieldCount(self):
+        return len(self.field_names)
+
+    def GetFieldDefn(self, field_index):
+        return ogr.FieldDefn(self.field_names[field_index], ogr.OFTString)
+
+
+class ConsolidateDrainPointsTests(GraipTestCase):
+    def setUp(self):
+        GraipTestCase.setUp(self)
+        self.shp_files = [self.write_sump_shapefile("Sump1", [create_sump_row(index) for index in range(3)]),
+                          self.write_sump_shapefile("Sump2", [create_sump_row(index) for index in range(2)])]
+        self.db_session = self.open_session()
+        engine = self.create_import_engine(self.db_session)
+        for shp_file in self.shp_files:
+            engine.import_drain_points(create_sump_spec(shp_file))
+        self.engine = engine
+
+    def get_consolidated_graipids(self, db_session):
+        consolidation_engine = consolidate.ConsolidationEngine(self.temp_dir, db_session=db_session)
+        consolidation_engine.consolidate_drain_points(self.shp_files)
+        gdal_driver = ogr.GetDriverByName(core.GDALFileDriver.ShapeFile())
+        data_source = gdal_driver.Open(consolidation_engine.get_consolidated_file("DrainPoints"), 0)
+        try:
+            return [feature.GetField("GRAIPDID") for feature in data_source.GetLayer(0)]
+        finally:
+            data_source.Destroy()
+
+    def test_imported_in_one_go(self):
+        self.assertEqual(self.get_consolidated_graipids(self.db_session), [0, 1, 2, 3, 4])
+        self.assertEqual(self.get_consolidated_graipids(None), [0, 1, 2, 3, 4])
+
+    def test_imported_incrementally(self):
+        edit_point_shapefile(self.shp_files[0], deleted_feature_ids=[1], new_rows=[create_sump_row(9)])
+        self.engine.update_drain_points(create_sump_spec(self.shp_files[0]))
+        # the new feature of the 1st shapefile gets the next GRAIPDID
+        self.assertEqual(self.get_consolidated_graipids(self.db_session), [0, 2, 5, 3, 4])
+
+    def test_feature_not_imported(self):
+        cursor = self.db_session.cursor()
+        cursor.execute("DELETE FROM {} WHERE ShpFile=? AND FeatureID=1".format(
+            import_engine.IMPORTED_FEATURES_TABLE_NAME), self.shp_files[1])
+        self.db_session.commit()
+        # numbering the feature in order would give it the GRAIPDID of another drain point
+        self.assertRaises(Exception, self.get_consolidated_graipids, self.db_session)
+
+
+class ConsolidatedLayersTests(GraipTestCase):
+    def setUp(self):
+        GraipTestCase.setUp(self)
+        self.db_session = self.open_session()
+        self.engine = self.create_import_engine(self.db_session)
+
+    def import_drain_points(self, srs_list):
+        # imports a shapefile with 2 drain points in each spatial reference
+        shp_files = [self.write_sump_shapefile("Sump{}".format(file_index),
+                                               [create_sump_row(file_index * 2 + index) for index in range(2)], srs)
+                     for file_index, srs in enumerate(srs_list)]
+        for shp_file in shp_files:
+            self.engine.import_drain_points(create_sump_spec(shp_file))
+        return shp_files
+
+    def test_reprojected(self):
+        srs1, srs2 = create_srs(26911), create_srs(26912)
+        shp_files = self.import_drain_points([srs1, srs2])
+        consolidation_engine = consolidate.ConsolidationEngine(self.temp_dir, db_session=self.db_session)
+        consolidation_engine.consolidate_drain_points(shp_files)
+        consolidated_file = consolidation_engine.get_consolidated_file("DrainPoints")
+        data_source = ogr.GetDriverByName(core.GDALFileDriver.ShapeFile()).Open(consolidated_file, 0)
+        try:
+            self.assertTrue(data_source.GetLayer(0).GetSpatialRef().IsSame(srs1))
+        finally:
+            data_source.Destroy()
+
+        # the features of the 2nd shapefile are transformed to the spatial reference of the 1st shapefile
+        coord_transform = osr.CoordinateTransformation(srs2, srs1)
+        expected_points = [(500000.0, 5000000.0), (500001.0, 5000001.0)] + \
+            [coord_transform.TransformPoint(500000.0 + index, 5000000.0 + index)[:2] for index in range(2)]
+        features = read_features(consolidated_file, ["GRAIPDID"])
+        self.assertEqual([(x, y) for x, y, _ in features], expected_points)
+        self.assertEqual([field_values for _, _, field_values in features], [(0,), (1,), (2,), (3,)])
+
+    def test_geopackage_attributes(self):
+        shp_files = self.import_drain_points([None])
+        cursor = self.db_session.cursor()
+        cursor.execute("UPDATE DrainPoints SET StreamConnectID=2, Comments='checked' WHERE GRAIPDID=1")
+        self.db_session.commit()
+        consolidation_engine = consolidate.ConsolidationEngine(self.temp_dir, db_session=self.db_session,
+                                                               output_format=consolidate.GEOPACKAGE_FORMAT,
+                                                               include_attributes=True)
+        self.assertEqual(consolidation_engine.consolidate_drain_points(shp_files), 2)
+        consolidated_file = consolidation_engine.get_consolidated_file("DrainPoints")
+        self.assertEqual(consolidated_file, os.path.join(self.temp_dir, "DrainPoints.gpkg"))
+        self.assertTrue(os.path.exists(consolidated_file))
+
+        # GeoPackage fields have the names of the database columns
+        field_names = consolidation_engine.get_field_names("DrainPoints")
+        self.assertEqual(sorted(field_names.keys()), sorted(self.db_session.schema.get_column_names("DrainPoints")))
+        self.assertTrue(all(col_name == field_name for col_name, field_name in field_names.items()))
+        features = read_features(consolidated_file, ["GRAIPDID", "DrainTypeID", "StreamConnectID", "Comments",
+                                                     "In_Xing_FillID"])
+        self.assertEqual([field_values for _, _, field_values in features],
+                         [(0, 1, 1, "", None), (1, 1, 2, "checked", None)])
+
+    def test_shapefile_attributes(self):
+        self.import_drain_points([None])
+        rd_shp_file = self.get_shp_file("Roads")
+        write_point_shapefile(rd_shp_file, RD_SHP_FIELDS, [{"CDATE": "2016/06/01", "CTIME1": "10:00:00am",
+                                                            "CTIME2": "10:01:00am", "VEHICLE": 3}])
+        self.engine.import_road_lines(create_road_spec(rd_shp_file))
+        consolidation_engine = consolidate.ConsolidationEngine(self.temp_dir, db_session=self.db_session,
+                                                               include_attributes=True)
+        self.assertEqual(consolidation_engine.consolidate_road_lines([rd_shp_file]), 1)
+
+        # shapefile field names are truncated to 10 characters and renamed if the truncated name is taken
+        field_names = consolidation_engine.get_field_names("RoadLines")
+        self.assertTrue(all(len(field_name) <= 10 for field_name in field_names.values()))
+        self.assertEqual(len(set(field_name.lower() for field_name in field_names.values())), len(field_names))
+        self.assertEqual(field_names["GRAIPRID"], "GRAIPRID")
+        col_names = ["OrigDrainID1", "OrigDrainID2", "StreamConnect1ID", "StreamConnect2ID", "CTime2"]
+        features = read_features(consolidation_engine.get_consolidated_file("RoadLines"),
+                                 [field_names[col_name] for col_name in col_names])
+        row = self.db_session.cursor().execute("SELECT {} FROM RoadLines".format(", ".join(col_names))).fetchone()
+        self.assertEqual([field_values for _, _, field_values in features], [tuple(row)])
+        self.assertEqual(tuple(row), (16060110003.0, 16060110013.0, 1, 1, "10:01:00am"))
+
+    def test_duplicate_field_names(self):
+        consolidation_engine = consolidate.ConsolidationEngine(self.temp_dir, db_session=self.db_session,
+                                                               include_attributes=True)
+        # StreamConnect1ID and StreamConnect2ID would both be written to the StreamConn field
+        self.assertRaises(Exception, consolidation_engine._create_attribute_fields, _TruncatingLayer(),
+                          "RoadLines", "GRAIPRID")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+Tests that the DrainIDs computed for a column (core.compute_drain_ids) are the ones computed for each drain
+point (core.compute_drain_id). Run from the repository root: python -m unittest discover -s tests
+"""
+
+import unittest
+from datetime import datetime
+
+import core
+
+CDATE = '6/1/2016'
+VEHICLE_ID = 3
+
+
+class DrainIdTests(unittest.TestCase):
+    def assert_same_drain_ids(self, times):
+        drain_ids = core.compute_drain_ids(times, [CDATE] * len(times), [VEHICLE_ID] * len(times))
+        for time_in, drain_id in zip(times, drain_ids):
+            expected_drain_id = core.compute_drain_id(time_in, CDATE, VEHICLE_ID)
+            if expected_drain_id is None:
+                self.assertTrue(_is_no_drain_id(drain_id), "no DrainID expected for {!r}".format(time_in))
+            else:
+                self.assertEqual(drain_id, expected_drain_id, "DrainIDs of {!r} differ".format(time_in))
+
+    def test_get_drain_id(self):
+        self.assertEqual(core.get_drain_id('10:30:15am', datetime(2016, 6, 1), VEHICLE_ID), 16060110303)
+        self.assertEqual(core.get_drain_id('10:30:45pm', datetime(2016, 6, 1), VEHICLE_ID), 16060122313)
+        self.assertEqual(core.get_drain_id(2230, datetime(2016, 6, 1), VEHICLE_ID), 16060122303)
+
+    def test_am_pm_ignores_case(self):
+        self.assertEqual(core.get_time_24_format('10:30:45PM'), 2231)
+        self.assertEqual(core.get_time_24_format('10:30:45 Pm'), 2231)
+        self.assertEqual(core.get_time_24_format(' 09:05:00AM '), 905)
+        self.assert_same_drain_ids(['10:30:45PM', '10:30:45pm', '10:30:45AM', '10:30:45am', '1:00:00 PM'])
+
+    def test_12_am_pm(self):
+        self.assertEqual(core.get_time_24_format('12:10:10AM'), 10)
+        self.assertEqual(core.get_time_24_format('12:10:10am'), 10)
+        self.assertEqual(core.get_time_24_format('12:10:10PM'), 1210)
+        self.assertEqual(core.get_time_24_format('12:10:40pm'), 1211)
+        self.assert_same_drain_ids(['12:10:10AM', '12:10:10am', '12:10:10PM', '12:10:10pm', '12:00:00am'])
+
+    def test_24_hour_times(self):
+        self.assertEqual(core.get_time_24_format('1030'), 1030)
+        self.assertEqual(core.get_time_24_format('22:30:15'), 2230)
+        self.assert_same_drain_ids(['1030', 1030, 2230.0, '22:30:15'])
+
+    def test_no_collection_time(self):
+        self.assertIsNone(core.compute_drain_id(core.NO_COLLECTION_TIME, CDATE, VEHICLE_ID))
+        self.assertIsNone(core.compute_drain_id(' 999 ', CDATE, VEHICLE_ID))
+        self.assert_same_drain_ids([core.NO_COLLECTION_TIME, '999', '10:30:15am', 999])
+
+    def test_malformed_times(self):
+        for time_in in ('10:30pm', 'abc', '10:3x:15am', ''):
+            self.assertRaises(Exception, core.get_time_24_format, time_in)
+            self.assertRaises(Exception, core.compute_drain_id, time_in, CDATE, VEHICLE_ID)
+            self.assertRaises(Exception, core.compute_drain_ids, ['10:30:15am', time_in], [CDATE] * 2,
+                              [VEHICLE_ID] * 2)
+
+    def test_mixed_column(self):
+        times = ['10:30:15am', '999', '10:30:15am', '12:10:10AM', '1030', '11:59:59PM', '10:30:15am']
+        dates = ['6/1/2016', '6/1/2016', '2016-06-02', '6/1/2016', '6/1/2016', '6/1/2016', '6/1/2016']
+        vehicle_ids = [1, 2, 3, 4, 5, 6, '7']
+        drain_ids = core.compute_drain_ids(times, dates, vehicle_ids)
+        for time_in, date_in, vehicle_id, drain_id in zip(times, dates, vehicle_ids, drain_ids):
+            expected_drain_id = core.compute_drain_id(time_in, date_in, vehicle_id)
+            if expected_drain_id is None:
+                self.assertTrue(_is_no_drain_id(drain_id))
+            else:
+                self.assertEqual(drain_id, expected_drain_id)
+
+    def test_empty_column(self):
+        self.assertEqual(len(core.compute_drain_ids([], [], [])), 0)
+
+
+def _is_no_drain_id(drain_id):
+    # NaN (or None without numpy)
+    return drain_id is None or drain_id != drain_id
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+"""
+Tests of the SQLite backend of the GRAIP database (graip_db): the pyodbc interface it emulates (rows with
+attribute access, cursor.tables(), cursor.columns()), the DATETIME converter and creating missing tables, of
+writing rows in batches (graip_db.BatchWriter) and of resetting and compacting a SQLite database
+"""
+
+import os
+import unittest
+from datetime import datetime
+
+import checkpoints
+import core
+import graip_db
+import mapping_profiles
+from sample_data import GraipTestCase, create_sump_row, create_sump_spec
+
+
+class SQLiteCursorTests(GraipTestCase):
+    def setUp(self):
+        GraipTestCase.setUp(self)
+        self.conn = graip_db.connect(self.db_file)
+        self.cursor = self.conn.cursor()
+
+    def tearDown(self):
+        self.conn.close()
+        GraipTestCase.tearDown(self)
+
+    def test_row_attributes(self):
+        row = self.cursor.execute("SELECT CondID, CondName AS Name FROM CondDefinitions WHERE CondID=?", 2).fetchone()
+        self.assertEqual((row.CondID, row.condid, row.NAME, row.Name), (2, 2, "Poor", "Poor"))
+        self.assertEqual((row[0], row[1], len(row)), (2, "Poor", 2))
+        self.assertEqual(tuple(row), (2, "Poor"))
+        self.assertEqual(row, (2, "Poor"))
+        self.assertEqual(row.cursor_description[1][0], "Name")
+        self.assertRaises(AttributeError, getattr, row, "CondName")
+        self.assertIs(type(row.Name), str)
+
+    def test_parameters(self):
+        # the parameters can be passed as separate arguments or as one sequence
+        sql_select = "SELECT CondName FROM CondDefinitions WHERE CondID>=? AND CondID<=? ORDER BY CondID"
+        self.assertEqual([row.CondName for row in self.cursor.execute(sql_select, 2, 3).fetchall()],
+                         ["Poor", "Buried"])
+        self.assertEqual([row.CondName for row in self.cursor.execute(sql_select, (1, 2)).fetchall()],
+                         ["Good", "Poor"])
+        self.assertEqual([row.CondName for row in self.cursor.execute(sql_select, [3, 3])], ["Buried"])
+        self.assertIsNone(self.cursor.execute(sql_select, 4, 5).fetchone())
+
+    def test_tables(self):
+        table_names = [row.table_name for row in self.cursor.tables()]
+        for table_name in ("DrainPoints", "RoadLines", "SumpAtt", "CondDefinitions", "ImportedFeatures"):
+            self.assertIn(table_name, table_names)
+        self.assertEqual(set(row.table_type for row in self.cursor.tables()), set(["TABLE"]))
+        # the table name is matched ignoring case
+        self.assertEqual([tuple(row) for row in self.cursor.tables(table="sumpatt").fetchall()],
+                         [("SumpAtt", "TABLE")])
+        self.assertIsNone(self.cursor.tables(table="NoSuchTable").fetchone())
+
+    def test_columns(self):
+        column_rows = self.cursor.columns(table="DrainPoints").fetchall()
+        self.assertEqual([row.column_name for row in column_rows][:4], ["GRAIPDID", "DrainTypeID", "CDate", "CTime"])
+        self.assertEqual([row.ordinal_position for row in column_rows][:4], [1, 2, 3, 4])
+        data_types = dict((row.column_name, row.data_type) for row in column_rows)
+        self.assertEqual(data_types["GRAIPDID"], graip_db.SQL_INTEGER)
+        self.assertEqual(data_types["CDate"], graip_db.SQL_TYPE_TIMESTAMP)
+        self.assertEqual(data_types["CTime"], graip_db.SQL_VARCHAR)
+        self.assertEqual(data_types["DrainID"], graip_db.SQL_DOUBLE)
+        self.assertEqual(self.cursor.columns(table="NoSuchTable").fetchall(), [])
+
+    def test_datetime_converter(self):
+        cdates = ["2016-06-01 10:30:00", "2016-06-01", "06/01/2016", "2016/06/01", "June 1st"]
+        self.cursor.executemany("INSERT INTO DrainPoints (GRAIPDID, CDate) VALUES (?, ?)", enumerate(cdates))
+        self.cursor.execute("INSERT INTO DrainPoints (GRAIPDID, CDate) VALUES (?, ?)", 5, datetime(2016, 6, 1, 8))
+        rows = self.cursor.execute("SELECT CDate FROM DrainPoints ORDER BY GRAIPDID").fetchall()
+        self.assertEqual([row.CDate for row in rows],
+                         [datetime(2016, 6, 1, 10, 30), datetime(2016, 6, 1), datetime(2016, 6, 1),
+                          datetime(2016, 6, 1), "June 1st", datetime(2016, 6, 1, 8)])
+
+    def test_create_missing_tables(self):
+        self.cursor.execute("INSERT INTO FileSetupCheckpoints (FileOrder) VALUES (0)")
+        self.cursor.execute("DROP TABLE ImportedFeatures")
+        graip_db.create_missing_tables(self.cursor, ("ImportedFeatures", "FileSetupCheckpoints"))
+        column_names = [row.column_name for row in self.cursor.columns(table="ImportedFeatures")]
+        self.assertEqual(column_names, ["ShpType", "ShpFile", "FeatureID", "RecordID", "AttributeHash"])
+        # existing tables are left as they are
+        self.assertEqual(self.cursor.execute("SELECT COUNT(*) FROM FileSetupCheckpoints").fetchone()[0], 1)
+
+    def test_rollback(self):
+        self.cursor.execute("DELETE FROM CondDefinitions")
+        self.conn.rollback()
+        self.assertEqual(self.cursor.execute("SELECT COUNT(*) AS CondCount FROM CondDefinitions").fetchone().CondCount,
+                         3)
+
+
+class _RecordingCursor(object):
+    # records the statements executed through a cursor
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.executed = []
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        self.executed.append((sql, len(seq_of_params)))
+        return self.cursor.executemany(sql, seq_of_params)
+
+
+class BatchWriterTests(GraipTestCase):
+    def setUp(self):
+        GraipTestCase.setUp(self)
+        self.db_session = self.open_session()
+        self.cursor = _RecordingCursor(self.db_session.cursor())
+
+    def get_records(self, sql_select):
+        return [tuple(row) for row in self.db_session.cursor().execute(sql_select).fetchall()]
+
+    def test_grouped_by_statement(self):
+        writer = graip_db.BatchWriter(self.cursor, "SumpAtt", batch_size=10)
+        writer.insert({'GRAIPDID': 0, 'CondID': 1, 'Depth': 1.5})
+        writer.insert({'GRAIPDID': 1, 'Depth': 2.5})
+        writer.insert({'Depth': 3.5, 'CondID': 2, 'GRAIPDID': 2})
+        self.assertEqual(self.cursor.executed, [])
+        writer.flush()
+        # rows with the same columns are written with one statement, whatever the order of their keys
+        self.assertEqual(sorted(self.cursor.executed),
+                         [("INSERT INTO SumpAtt(CondID,Depth,GRAIPDID) VALUES (?,?,?)", 2),
+                          ("INSERT INTO SumpAtt(Depth,GRAIPDID) VALUES (?,?)", 1)])
+        self.assertEqual(self.get_records("SELECT * FROM SumpAtt ORDER BY GRAIPDID"),
+                         [(0, 1, 1.5), (1, None, 2.5), (2, 2, 3.5)])
+        writer.flush()
+        self.assertEqual(len(self.cursor.executed), 2)
+
+    def test_flush_at_batch_size(self):
+        writer = graip_db.BatchWriter(self.cursor, "SumpAtt", batch_size=3)
+        for graipid in range(7):
+            writer.insert({'GRAIPDID': graipid, 'CondID': 1} if graipid % 2 else {'GRAIPDID': graipid})
+        # the pending rows of all statements count towards the batch size
+        self.assertEqual(sorted(row_count for _, row_count in self.cursor.executed), [1, 1, 2, 2])
+        self.assertEqual(len(self.get_records("SELECT * FROM SumpAtt")), 6)
+        writer.flush()
+        self.assertEqual(len(self.get_records("SELECT * FROM SumpAtt")), 7)
+
+    def test_update(self):
+        writer = graip_db.BatchWriter(self.cursor, "SumpAtt", key_field_name="GRAIPDID")
+        for graipid in range(3):
+            writer.insert({'GRAIPDID': graipid, 'CondID': 1})
+        writer.update({'GRAIPDID': 1, 'CondID': 3, 'Depth': 0.5}, 1)
+        # nothing to update
+        writer.update({'GRAIPDID': 2}, 2)
+        writer.flush()
+        self.assertEqual(self.get_records("SELECT * FROM SumpAtt ORDER BY GRAIPDID"),
+                         [(0, 1, None), (1, 3, 0.5), (2, 1, None)])
+        writer = graip_db.BatchWriter(self.cursor, "SumpAtt")
+        self.assertRaises(Exception, writer.update, {'CondID': 2}, 0)
+
+    def test_rollback_discards_rows(self):
+        writer = graip_db.BatchWriter(self.cursor, "SumpAtt", batch_size=2)
+        for graipid in range(3):
+            writer.insert({'GRAIPDID': graipid})
+        # the rows written by the writer are not committed and the pending row is never written
+        self.db_session.rollback()
+        self.assertEqual(self.get_records("SELECT * FROM SumpAtt"), [])
+
+    def test_failed_shapefile_is_rolled_back(self):
+        engine = self.create_import_engine(self.db_session)
+        engine.batch_size = 2
+        shp_file = self.write_sump_shapefile("Sump", [create_sump_row(index) for index in range(5)])
+
+        def cancel_import(shp_file, count_done, count_total):
+            if count_done == 4:
+                # some of the rows have been written already
+                self.assertEqual(len(self.get_records("SELECT * FROM DrainPoints")), 2)
+                engine.cancel()
+
+        engine.progress_callback = cancel_import
+        engine.max_progress_rate = 0
+        self.assertRaises(Exception, engine.import_drain_points, create_sump_spec(shp_file))
+        self.db_session.rollback()
+        for table_name in ("DrainPoints", "SumpAtt", "ImportedFeatures"):
+            self.assertEqual(self.get_records("SELECT * FROM {}".format(table_name)), [])
+
+        engine = self.create_import_engine(self.db_session)
+        self.assertEqual(engine.import_drain_points(create_sump_spec(shp_file)), 0)
+        self.assertEqual(self.get_records("SELECT GRAIPDID FROM SumpAtt ORDER BY GRAIPDID"),
+                         [(graipid,) for graipid in range(5)])
+
+
+class DatabaseMaintenanceTests(GraipTestCase):
+    def get_records(self, sql_select):
+        conn = graip_db.connect(self.db_file)
+        try:
+            return [tuple(row) for row in conn.cursor().execute(sql_select).fetchall()]
+        finally:
+            conn.close()
+
+    def test_reset(self):
+        db_session = self.open_session()
+        engine = self.create_import_engine(db_session)
+        spec = create_sump_spec(self.write_sump_shapefile("Sump", [create_sump_row(index, cond='Fine')
+                                                                   for index in range(3)]))
+        checkpoints.restore_checkpoints(db_session, [(spec.shp_type, spec.shp_file)])
+        engine.import_drain_points(spec)
+        mapping_profiles.save_profile(db_session, 'DP', 'Sump', ["COND"], [("CondID", "COND")])
+        core.check_for_orphans_and_duplicates(db_session, engine.dp_log_file, engine.rd_log_file)
+        db_session.close()
+        kept_table_names = ["CondDefinitions", "DrainTypeDefinitions", "RoadNetworkDefinitions", "FieldMatches",
+                            "MetaData", "ValueReassigns", "MappingProfiles"]
+        kept_tables = [self.get_records("SELECT * FROM {}".format(table_name)) for table_name in kept_table_names]
+        for table_name in ("DrainPoints", "SumpAtt", "DPErrorLog", "FileSetupCheckpoints", "ImportedFeatures"):
+            self.assertNotEqual(self.get_records("SELECT * FROM {}".format(table_name)), [])
+
+        graip_db.reset_database(self.db_file)
+        self.assertEqual([self.get_records("SELECT * FROM {}".format(table_name))
+                          for table_name in kept_table_names], kept_tables)
+        for table_name in graip_db.GRAIP_DATA_TABLE_NAMES + ("SumpAtt",):
+            self.assertEqual(self.get_records("SELECT * FROM {}".format(table_name)), [])
+        # the tables are made again as they were, starting over with the IDs of the error log
+        conn = graip_db.connect(self.db_file)
+        try:
+            column_names = [row.column_name for row in conn.cursor().columns(table="DPErrorLog")]
+            conn.cursor().execute("INSERT INTO DPErrorLog (GRAIPDID) VALUES (0)")
+            conn.commit()
+        finally:
+            conn.close()
+        self.assertEqual(column_names, ["ID", "GRAIPDID", "DrainType", "ErrorMessage", "ActionTaken"])
+        self.assertEqual(self.get_records("SELECT ID FROM DPErrorLog"), [(1,)])
+
+        db_session = self.open_session()
+        self.assertEqual(self.create_import_engine(db_session).import_drain_points(spec), 0)
+
+    def test_compact(self):
+        conn = graip_db.connect(self.db_file)
+        try:
+            cursor = conn.cursor()
+            cursor.executemany("INSERT INTO DPErrorLog (GRAIPDID, ErrorMessage) VALUES (?, ?)",
+                               [(graipid, "x" * 1000) for graipid in range(1000)])
+            conn.commit()
+            cursor.execute("DELETE FROM DPErrorLog WHERE GRAIPDID>0")
+            conn.commit()
+        finally:
+            conn.close()
+        db_file_size = os.path.getsize(self.db_file)
+
+        graip_db.compact_database(self.db_file)
+        # the space of the deleted rows is given back and the other rows are kept
+        self.assertLess(os.path.getsize(self.db_file), db_file_size / 2)
+        self.assertEqual(self.get_records("SELECT GRAIPDID FROM DPErrorLog"), [(0,)])
+        self.assertEqual(self.get_records("PRAGMA integrity_check"), [("ok",)])
+        self.assertEqual(len(self.get_records("SELECT * FROM CondDefinitions")), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
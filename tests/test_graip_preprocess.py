@@ -0,0 +1,215 @@
+"""
+Tests of running the preprocessor from the command line (graip_preprocess.main()): the events written to stdout
+and the exit codes of a run, and importing drain point shapefiles in worker processes
+"""
+
+import json
+import os
+import sys
+import unittest
+from StringIO import StringIO
+
+import checkpoints
+import core
+import graip_preprocess
+from sample_data import (RD_FIELD_MATCHES, RD_SHP_FIELDS, GraipTestCase, create_sample_database, create_sump_row,
+                         edit_point_shapefile, write_point_shapefile)
+
+
+class GraipPreprocessTestCase(GraipTestCase):
+    """
+    Test case with sample drain point and road line shapefiles (self.dp_shp_files, self.rd_shp_file) to
+    preprocess with the sample database and a mapping file with the field matches of the road lines
+    (self.mapping_file)
+    """
+    def setUp(self):
+        GraipTestCase.setUp(self)
+        self.dp_shp_files = [self.write_sump_shapefile("Sump{}".format(file_index),
+                                                       [create_sump_row(file_index * 10 + index)
+                                                        for index in range(row_count)])
+                             for file_index, row_count in enumerate([4, 1, 3])]
+        self.rd_shp_file = self.get_shp_file("Roads")
+        write_point_shapefile(self.rd_shp_file, RD_SHP_FIELDS, [{"CDATE": "2016/06/01", "CTIME1": "10:00:00am",
+                                                                 "CTIME2": "10:01:00am", "VEHICLE": 3}])
+        self.mapping_file = os.path.join(self.temp_dir, "mapping.json")
+        self.write_mapping_file()
+
+    def write_mapping_file(self, **mapping):
+        mapping['shapefiles'] = dict(mapping.get('shapefiles', {}), **{
+            "Roads.shp": {"road_network": "Main", "field_matches": RD_FIELD_MATCHES}})
+        with open(self.mapping_file, 'w') as file_obj:
+            json.dump(mapping, file_obj)
+
+    def run_main(self, *args):
+        """
+        Runs graip_preprocess.main() with args after the database and shapefile arguments and returns the
+        exit code and the events written to stdout
+        """
+        argv = ['--db', self.db_file, '--dp'] + self.dp_shp_files + ['--rd', self.rd_shp_file,
+                                                                       '--mapping', self.mapping_file,
+                                                                       '--working-directory', self.temp_dir]
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            exit_code = graip_preprocess.main(argv + list(args))
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        return exit_code, [json.loads(line) for line in output.splitlines()]
+
+    def get_records(self, sql_select):
+        with self.open_session().read_cursor() as cursor:
+            return [tuple(row) for row in cursor.execute(sql_select).fetchall()]
+
+
+class MainTests(GraipPreprocessTestCase):
+    def get_events(self, events):
+        # the events other than progress, without the event name if it is the only field
+        return [event if len(event) > 1 else event['event'] for event in events if event['event'] != 'progress']
+
+    def test_run(self):
+        exit_code, events = self.run_main('--uninterrupted')
+        self.assertEqual(exit_code, graip_preprocess.EXIT_OK)
+        self.assertEqual(self.get_events(events),
+                         [{'event': 'import_shapefile', 'shp_type': shp_type, 'shp_file': shp_file, 'is_update': False}
+                          for shp_type, shp_file in [('DP', shp_file) for shp_file in self.dp_shp_files] +
+                          [('RD', self.rd_shp_file)]] +
+                         ['check_orphans',
+                          {'event': 'consolidated_layer', 'layer_name': 'DrainPoints',
+                           'file': os.path.join(self.temp_dir, "DrainPoints.shp"),
+                           'field_names': {'GRAIPDID': 'GRAIPDID'}},
+                          {'event': 'consolidated_layer', 'layer_name': 'RoadLines',
+                           'file': os.path.join(self.temp_dir, "RoadLines.shp"),
+                           'field_names': {'GRAIPRID': 'GRAIPRID'}},
+                          {'event': 'finished', 'exit_code': graip_preprocess.EXIT_OK}])
+        # the progress of each shapefile and consolidated layer ends with all its features done
+        last_progress = {}
+        for event in events:
+            if event['event'] == 'progress':
+                self.assertLessEqual(event['count_done'], event['count_total'])
+                last_progress[event.get('shp_file', event.get('layer_name'))] = event
+        self.assertEqual(sorted((key, event['count_done'], event['count_total'])
+                                for key, event in last_progress.items()),
+                         sorted(zip(self.dp_shp_files, [4, 1, 3], [4, 1, 3]) +
+                                [(self.rd_shp_file, 1, 1), ("DrainPoints", 8, 8), ("RoadLines", 1, 1)]))
+        self.assertEqual(len(self.get_records("SELECT * FROM DrainPoints")), 8)
+
+        # nothing has changed for the next run
+        exit_code, events = self.run_main('--uninterrupted')
+        self.assertEqual(exit_code, graip_preprocess.EXIT_OK)
+        self.assertEqual([(event['event'], event.get('shp_file')) for event in events
+                          if event['event'].endswith('_shapefile')],
+                         [('skip_shapefile', shp_file) for shp_file in self.dp_shp_files + [self.rd_shp_file]])
+
+    def test_unknown_values(self):
+        self.write_sump_shapefile("Sump1", [create_sump_row(10, cond='Fine'), create_sump_row(11, cond='fine')])
+        exit_code, events = self.run_main()
+        self.assertEqual(exit_code, graip_preprocess.EXIT_UNKNOWN_VALUES)
+        self.assertEqual(self.get_events(events),
+                         [{'event': 'unknown_value', 'value': 'Fine', 'field_name': 'CondID',
+                           'definition_table': 'CondDefinitions', 'count': 2, 'shp_files': [self.dp_shp_files[1]]},
+                          {'event': 'finished', 'exit_code': graip_preprocess.EXIT_UNKNOWN_VALUES}])
+        self.assertEqual(self.get_records("SELECT * FROM DrainPoints"), [])
+
+        # a value override resolves the value
+        self.write_mapping_file(value_overrides={"CondDefinitions": {"Fine": "Poor"}})
+        exit_code, events = self.run_main()
+        self.assertEqual(exit_code, graip_preprocess.EXIT_OK)
+        self.assertEqual(self.get_records("SELECT GRAIPDID, CondID FROM SumpAtt WHERE GRAIPDID IN (4, 5)"),
+                         [(4, 2), (5, 2)])
+
+    def test_error(self):
+        self.write_mapping_file(shapefiles={"Sump1.shp": {"drain_type": "Sump", "field_matches": [["CDate", None]]}})
+        exit_code, events = self.run_main('--uninterrupted')
+        self.assertEqual(exit_code, graip_preprocess.EXIT_ERROR)
+        self.assertEqual(self.get_events(events)[-3:],
+                         [{'event': 'import_shapefile', 'shp_type': 'DP', 'shp_file': self.dp_shp_files[1],
+                           'is_update': False},
+                          {'event': 'error', 'message': "CDate can't take default values"},
+                          {'event': 'finished', 'exit_code': graip_preprocess.EXIT_ERROR}])
+        # the shapefiles imported before the error are committed
+        self.assertEqual(self.get_records("SELECT ShpFile, Status FROM {} ORDER BY FileOrder".format(
+            checkpoints.CHECKPOINTS_TABLE_NAME))[:2], [(self.dp_shp_files[0], checkpoints.STATUS_COMMITTED),
+                                                       (self.dp_shp_files[1], checkpoints.STATUS_IMPORTING)])
+        self.assertEqual(len(self.get_records("SELECT * FROM DrainPoints")), 4)
+
+        self.dp_shp_files.append(self.get_shp_file("Missing"))
+        exit_code, events = self.run_main('--uninterrupted')
+        self.assertEqual(exit_code, graip_preprocess.EXIT_ERROR)
+        self.assertEqual(events, [{'event': 'error', 'message': "Shapefile {} does not exist.".format(
+            self.dp_shp_files[-1])}, {'event': 'finished', 'exit_code': graip_preprocess.EXIT_ERROR}])
+
+    def test_usage(self):
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            with self.assertRaises(SystemExit) as context:
+                graip_preprocess.main(['--db', self.db_file, '--dp'] + self.dp_shp_files)
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(context.exception.code, graip_preprocess.EXIT_USAGE)
+
+
+class ProcessesTests(GraipPreprocessTestCase):
+    def setUp(self):
+        GraipPreprocessTestCase.setUp(self)
+        self.batch_size = core.FEATURE_BATCH_SIZE
+        core.FEATURE_BATCH_SIZE = 2
+
+    def tearDown(self):
+        core.FEATURE_BATCH_SIZE = self.batch_size
+        GraipPreprocessTestCase.tearDown(self)
+
+    def get_tables(self):
+        return [self.get_records(sql_select) for sql_select in (
+            "SELECT * FROM DrainPoints ORDER BY GRAIPDID",
+            "SELECT * FROM SumpAtt ORDER BY GRAIPDID",
+            "SELECT * FROM RoadLines ORDER BY GRAIPRID",
+            "SELECT ShpFile, Status, FirstID, LastID FROM {} ORDER BY FileOrder".format(
+                checkpoints.CHECKPOINTS_TABLE_NAME))]
+
+    def test_same_as_one_process(self):
+        exit_code, events = self.run_main('--uninterrupted')
+        self.assertEqual(exit_code, graip_preprocess.EXIT_OK)
+        tables = self.get_tables()
+        self.assertEqual(tables[3], [(shp_file, checkpoints.STATUS_COMMITTED, first_id, last_id) for
+                                     shp_file, first_id, last_id in zip(self.dp_shp_files + [self.rd_shp_file],
+                                                                        [0, 4, 5, 0], [3, 4, 7, 0])])
+
+        self.db_file = os.path.join(self.temp_dir, "Parallel.sqlite")
+        create_sample_database(self.db_file)
+        exit_code, parallel_events = self.run_main('--uninterrupted', '--processes', '2')
+        self.assertEqual(exit_code, graip_preprocess.EXIT_OK)
+        self.assertEqual(self.get_tables(), tables)
+        # each shapefile is still started and committed on its own
+        self.assertEqual([event for event in parallel_events if event['event'] != 'progress'],
+                         [event for event in events if event['event'] != 'progress'])
+
+    def test_changed_shapefile(self):
+        self.run_main('--uninterrupted', '--processes', '2')
+        edit_point_shapefile(self.dp_shp_files[1], new_rows=[create_sump_row(30)])
+        exit_code, events = self.run_main('--uninterrupted', '--processes', '2')
+        self.assertEqual(exit_code, graip_preprocess.EXIT_OK)
+        # the changed shapefile is imported again incrementally and keeps the IDs of its records
+        self.assertEqual([(event['event'], event.get('is_update', None)) for event in events
+                          if event['event'] in ('import_shapefile', 'skip_shapefile')],
+                         [('skip_shapefile', None), ('import_shapefile', True), ('skip_shapefile', None),
+                          ('import_shapefile', True)])
+        self.assertEqual(self.get_records("SELECT GRAIPDID FROM SumpAtt ORDER BY GRAIPDID"),
+                         [(graipid,) for graipid in range(9)])
+
+    def test_import_groups(self):
+        engine = self.create_import_engine(self.open_session())
+        # only consecutive drain point shapefiles imported for the first time are imported together
+        imports = [(None, None, None, None, import_call) for import_call in [
+            (engine.import_drain_points, ()), (engine.import_drain_points, ()), None,
+            (engine.import_drain_points, ()), (engine.update_drain_points, ()), (engine.import_drain_points, ()),
+            (engine.import_drain_points, ()), (engine.import_road_lines, ())]]
+        self.assertEqual([len(import_group) for import_group in
+                          graip_preprocess.get_import_groups(engine, imports, 2)], [2, 1, 1, 1, 2, 1])
+        self.assertEqual([len(import_group) for import_group in
+                          graip_preprocess.get_import_groups(engine, imports, 1)], [1] * 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+"""
+Tests of importing drain point shapefiles in worker processes and of the progress reported by the ImportEngine
+"""
+
+import os
+import unittest
+
+import core
+import graip_db
+import import_engine
+from sample_data import GraipTestCase, create_sample_database, create_sump_row, create_sump_spec, \
+    edit_point_shapefile
+
+
+class _ImmediateResult(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class _RecordingPool(object):
+    # runs the tasks right away and records the number of results not taken yet when a task is submitted
+    def __init__(self):
+        self.submitted_count = 0
+        self.taken_count = 0
+        self.max_pending_count = 0
+
+    def apply_async(self, func, args):
+        self.submitted_count += 1
+        self.max_pending_count = max(self.max_pending_count, self.submitted_count - self.taken_count)
+        return _ImmediateResult(func(*args))
+
+
+class BatchTests(unittest.TestCase):
+    def setUp(self):
+        self.batch_size = core.FEATURE_BATCH_SIZE
+        core.FEATURE_BATCH_SIZE = 3
+
+    def tearDown(self):
+        core.FEATURE_BATCH_SIZE = self.batch_size
+
+    def test_batch_ranges(self):
+        self.assertEqual(import_engine._get_batch_ranges(0), [(0, None)])
+        self.assertEqual(import_engine._get_batch_ranges(3), [(0, None)])
+        self.assertEqual(import_engine._get_batch_ranges(7), [(0, 3), (3, 6), (6, None)])
+
+    def test_imap_bounded(self):
+        pool = _RecordingPool()
+        results = []
+        for result in import_engine._imap_bounded(pool, lambda value: value * 2, range(10), 4):
+            pool.taken_count += 1
+            results.append(result)
+        self.assertEqual(results, [value * 2 for value in range(10)])
+        self.assertEqual(pool.max_pending_count, 4)
+
+
+class ImportDrainPointFilesTests(GraipTestCase):
+    def setUp(self):
+        GraipTestCase.setUp(self)
+        self.batch_size = core.FEATURE_BATCH_SIZE
+        core.FEATURE_BATCH_SIZE = 3
+        conds = ['Good', 'Poor', 'Unknown', 'good']
+        self.specs = []
+        for file_index, row_count in enumerate([7, 1, 6]):
+            shp_file = self.write_sump_shapefile("Sump{}".format(file_index),
+                                                 [create_sump_row(index, conds[index % len(conds)], index * 0.5)
+                                                  for index in range(row_count)])
+            self.specs.append(create_sump_spec(shp_file))
+        # deleted records are skipped without shifting the batches
+        edit_point_shapefile(self.specs[0].shp_file, deleted_feature_ids=[2, 3])
+
+    def tearDown(self):
+        core.FEATURE_BATCH_SIZE = self.batch_size
+        GraipTestCase.tearDown(self)
+
+    def import_drain_point_files(self, db_file, processes):
+        db_session = graip_db.DatabaseSession(db_file)
+        self.db_sessions.append(db_session)
+        engine = self.create_import_engine(db_session)
+        first_graipids = engine.import_drain_point_files(self.specs, processes=processes)
+        cursor = db_session.cursor()
+        tables = [[tuple(row) for row in cursor.execute(sql_select).fetchall()] for sql_select in (
+            "SELECT * FROM DrainPoints ORDER BY GRAIPDID",
+            "SELECT * FROM SumpAtt ORDER BY GRAIPDID",
+            "SELECT * FROM CondDefinitions ORDER BY CondID",
+            "SELECT * FROM ImportedFeatures ORDER BY RecordID")]
+        return first_graipids, tables
+
+    def test_same_as_one_process(self):
+        parallel_db_file = os.path.join(self.temp_dir, "Parallel.sqlite")
+        create_sample_database(parallel_db_file)
+        first_graipids, tables = self.import_drain_point_files(self.db_file, None)
+        self.assertEqual(first_graipids, [0, 5, 6])
+        self.assertEqual(len(tables[0]), 12)
+        self.assertEqual(self.import_drain_point_files(parallel_db_file, 2), (first_graipids, tables))
+
+
+class ProgressTests(GraipTestCase):
+    def setUp(self):
+        GraipTestCase.setUp(self)
+        self.spec = create_sump_spec(self.write_sump_shapefile("Sump", [create_sump_row(index)
+                                                                        for index in range(5)]))
+        self.progress_updates = []
+
+    def report_progress(self, shp_file, count_done, count_total):
+        self.progress_updates.append((os.path.basename(shp_file), count_done, count_total))
+
+    def import_drain_points(self, max_progress_rate):
+        engine = self.create_import_engine(self.open_session())
+        engine.progress_callback = self.report_progress
+        engine.max_progress_rate = max_progress_rate
+        engine.import_drain_points(self.spec)
+
+    def test_throttled(self):
+        # at most one update per 1000 seconds - the first one and the one for the complete shapefile
+        self.import_drain_points(0.001)
+        self.assertEqual(self.progress_updates, [("Sump.shp", 1, 5), ("Sump.shp", 5, 5)])
+
+    def test_not_throttled(self):
+        self.import_drain_points(0)
+        self.assertEqual(self.progress_updates, [("Sump.shp", count_done, 5) for count_done in range(1, 6)])
+
+    def test_throttle(self):
+        progress_updates = []
+        progress = core.ProgressThrottle(lambda count_done, count_total: progress_updates.append(count_done), 10,
+                                         max_rate=0.001)
+        for count_done in range(1, 11):
+            progress.update(count_done)
+        progress.update(10, force=True)
+        progress.update(4, force=True)
+        self.assertEqual(progress_updates, [1, 10, 4])
+        # no callback
+        core.ProgressThrottle(None, 10).update(10)
+
+
+if __name__ == '__main__':
+    unittest.main()
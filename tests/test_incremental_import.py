@@ -0,0 +1,93 @@
+"""
+Tests of importing a changed shapefile again incrementally (ImportEngine.update_drain_points/update_road_lines):
+new features get new IDs, changed features are written again with their IDs, deleted features are deleted and
+the other records are not touched.
+"""
+
+import unittest
+
+from sample_data import (RD_SHP_FIELDS, GraipTestCase, create_road_spec, create_sump_row, create_sump_spec,
+                         edit_point_shapefile, write_point_shapefile)
+
+
+class IncrementalImportTests(GraipTestCase):
+    def setUp(self):
+        GraipTestCase.setUp(self)
+        self.db_session = self.open_session()
+        self.engine = self.create_import_engine(self.db_session)
+        self.spec = create_sump_spec(self.write_sump_shapefile("Sump1", [create_sump_row(index, depth=index + 0.5)
+                                                                         for index in range(5)]))
+        self.other_spec = create_sump_spec(self.write_sump_shapefile("Sump2", [create_sump_row(index + 5)
+                                                                               for index in range(2)]))
+        for spec in (self.spec, self.other_spec):
+            self.engine.import_drain_points(spec)
+        # records that are written again get an empty comment
+        self.db_session.cursor().execute("UPDATE DrainPoints SET Comments='checked'")
+        self.db_session.commit()
+
+    def get_records(self, sql_select):
+        return [tuple(row) for row in self.db_session.cursor().execute(sql_select).fetchall()]
+
+    def get_imported_features(self, spec):
+        return dict((feature_id, record_id) for feature_id, (record_id, _) in
+                    self.engine.get_imported_features(spec).items())
+
+    def test_imported_features(self):
+        self.assertEqual(self.get_imported_features(self.spec), {0: 0, 1: 1, 2: 2, 3: 3, 4: 4})
+        self.assertEqual(self.get_imported_features(self.other_spec), {0: 5, 1: 6})
+        self.assertEqual(self.engine.get_imported_id_range(self.spec), (0, 4))
+
+    def test_unchanged(self):
+        self.assertEqual(self.engine.update_drain_points(self.spec), 0)
+        self.assertEqual(self.get_records("SELECT GRAIPDID, Comments FROM DrainPoints ORDER BY GRAIPDID"),
+                         [(graipid, "checked") for graipid in range(7)])
+
+    def test_changes(self):
+        edit_point_shapefile(self.spec.shp_file, changed_rows={1: {"DEPTH": 9.5}, 3: {"CTIME": "11:00:00am"}},
+                             deleted_feature_ids=[2], new_rows=[create_sump_row(20), create_sump_row(21)])
+        self.engine.update_drain_points(self.spec)
+
+        # new features get IDs after those of the other shapefile
+        self.assertEqual(self.get_imported_features(self.spec), {0: 0, 1: 1, 3: 3, 4: 4, 5: 7, 6: 8})
+        self.assertEqual(self.get_records("SELECT GRAIPDID, Comments FROM DrainPoints ORDER BY GRAIPDID"),
+                         [(0, "checked"), (1, ""), (3, ""), (4, "checked"), (5, "checked"), (6, "checked"),
+                          (7, ""), (8, "")])
+        self.assertEqual(self.get_records("SELECT GRAIPDID, Depth FROM SumpAtt ORDER BY GRAIPDID"),
+                         [(0, 0.5), (1, 9.5), (3, 3.5), (4, 4.5), (5, 1.5), (6, 1.5), (7, 1.5), (8, 1.5)])
+        # the DrainID of a changed feature is computed again
+        self.assertEqual(self.get_records("SELECT DrainID FROM DrainPoints WHERE GRAIPDID=3"), [(16060111003.0,)])
+
+        # the changed features are not written again by the next update
+        self.db_session.cursor().execute("UPDATE DrainPoints SET Comments='checked'")
+        self.engine.update_drain_points(self.spec)
+        self.assertEqual(self.get_records("SELECT DISTINCT Comments FROM DrainPoints"), [("checked",)])
+
+    def test_forced(self):
+        edit_point_shapefile(self.spec.shp_file, deleted_feature_ids=[0])
+        self.assertEqual(self.engine.update_drain_points(self.spec, is_forced=True), 1)
+        # all the features of the shapefile are written again with their IDs
+        self.assertEqual(self.get_records("SELECT GRAIPDID, Comments FROM DrainPoints ORDER BY GRAIPDID"),
+                         [(1, ""), (2, ""), (3, ""), (4, ""), (5, "checked"), (6, "checked")])
+        self.assertEqual(self.get_records("SELECT GRAIPDID FROM SumpAtt ORDER BY GRAIPDID"),
+                         [(graipid,) for graipid in range(1, 7)])
+        self.assertEqual(self.get_imported_features(self.spec), {1: 1, 2: 2, 3: 3, 4: 4})
+
+    def test_road_lines(self):
+        rd_shp_file = self.get_shp_file("Roads")
+        write_point_shapefile(rd_shp_file, RD_SHP_FIELDS, [
+            {"CDATE": "2016/06/01", "CTIME1": "10:00:00am", "CTIME2": "10:01:00am", "VEHICLE": 3},
+            {"CDATE": "2016/06/01", "CTIME1": "10:01:00am", "CTIME2": "10:02:00am", "VEHICLE": 3}])
+        rd_spec = create_road_spec(rd_shp_file)
+        self.engine.import_road_lines(rd_spec)
+        sql_select = "SELECT GRAIPRID, GRAIPDID1, GRAIPDID2 FROM RoadLines ORDER BY GRAIPRID"
+        self.assertEqual(self.get_records(sql_select), [(0, 0, 1), (1, 1, 2)])
+
+        edit_point_shapefile(rd_shp_file, changed_rows={1: {"CTIME2": "10:04:00am"}}, deleted_feature_ids=[0],
+                             new_rows=[{"CDATE": "2016/06/01", "CTIME1": "10:05:00am", "CTIME2": "10:06:00am",
+                                        "VEHICLE": 3}])
+        self.engine.update_road_lines(rd_spec)
+        self.assertEqual(self.get_records(sql_select), [(1, 1, 4), (2, 5, 6)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Tests of writing the log entries of a run in batches (core.LogWriter): to the log files, the DPErrorLog and
+RDErrorLog tables and a JSON Lines file
+"""
+
+import json
+import os
+import unittest
+
+import core
+from sample_data import GraipTestCase
+
+
+class LogWriterTests(GraipTestCase):
+    def setUp(self):
+        GraipTestCase.setUp(self)
+        self.db_session = self.open_session()
+        self.dp_log_file = os.path.join(self.temp_dir, "DrainPointsImport.log")
+        self.rd_log_file = os.path.join(self.temp_dir, "RoadLinesImport.log")
+        core.create_log_file(self.db_file, self.dp_log_file, 'DP')
+        core.create_log_file(self.db_file, self.rd_log_file, 'RD')
+        self.json_log_file = os.path.join(self.temp_dir, "Preprocess.jsonl")
+
+    def get_log_entries(self, log_file):
+        # the lines after the header of a log file (see core.create_log_file())
+        with open(log_file, 'r') as file_obj:
+            return file_obj.readlines()[3:]
+
+    def get_error_rows(self, err_table_name):
+        return [tuple(row)[1:] for row in self.db_session.cursor().execute(
+            "SELECT * FROM {} ORDER BY ID".format(err_table_name)).fetchall()]
+
+    def add_entries(self, log_writer, graipids):
+        for graipid in graipids:
+            log_writer.add_entry(self.dp_log_file, graipid, "Sump", "Message {}".format(graipid), "Nothing",
+                                 err_table_name=core.DP_ERROR_LOG_TABLE_NAME)
+
+    def test_buffered(self):
+        log_writer = core.LogWriter(self.db_session, max_entries=3)
+        self.add_entries(log_writer, range(2))
+        self.assertEqual(self.get_log_entries(self.dp_log_file), [])
+        self.assertEqual(self.get_error_rows(core.DP_ERROR_LOG_TABLE_NAME), [])
+        # the entries are written once max_entries are buffered
+        self.add_entries(log_writer, [2])
+        self.assertEqual(len(self.get_log_entries(self.dp_log_file)), 3)
+        self.assertEqual(len(self.get_error_rows(core.DP_ERROR_LOG_TABLE_NAME)), 3)
+        self.add_entries(log_writer, [3])
+        self.assertEqual(len(self.get_log_entries(self.dp_log_file)), 3)
+        log_writer.flush()
+        self.assertEqual(len(self.get_log_entries(self.dp_log_file)), 4)
+        self.assertEqual(len(self.get_error_rows(core.DP_ERROR_LOG_TABLE_NAME)), 4)
+        # the error table rows are committed with the session
+        self.db_session.rollback()
+        self.assertEqual(self.get_error_rows(core.DP_ERROR_LOG_TABLE_NAME), [])
+
+    def test_order(self):
+        log_writer = core.LogWriter(self.db_session, max_entries=4)
+        self.add_entries(log_writer, [5, 1])
+        log_writer.add_entry(self.rd_log_file, 0, "Main", "Orphan Road Segment", "Nothing",
+                             err_table_name=core.RD_ERROR_LOG_TABLE_NAME)
+        log_writer.add_entry(self.dp_log_file, 9, "Sump", "Not in the error table", "Nothing")
+        self.add_entries(log_writer, [3])
+        log_writer.flush()
+        # each log file and error table has its entries in the order they were added
+        self.assertEqual(self.get_log_entries(self.dp_log_file),
+                         ["5, Sump, Message 5, Nothing \n", "1, Sump, Message 1, Nothing \n",
+                          "9, Sump, Not in the error table, Nothing \n", "3, Sump, Message 3, Nothing \n"])
+        self.assertEqual(self.get_error_rows(core.DP_ERROR_LOG_TABLE_NAME),
+                         [(5, "Sump", "Message 5", "Nothing"), (1, "Sump", "Message 1", "Nothing"),
+                          (3, "Sump", "Message 3", "Nothing")])
+        self.assertEqual(self.get_log_entries(self.rd_log_file), ["0, Main, Orphan Road Segment, Nothing \n"])
+        self.assertEqual(self.get_error_rows(core.RD_ERROR_LOG_TABLE_NAME),
+                         [(0, "Main", "Orphan Road Segment", "Nothing")])
+
+    def test_json_log(self):
+        log_writer = core.LogWriter(self.db_session, json_log_file=self.json_log_file)
+        self.add_entries(log_writer, [2])
+        log_writer.add_entry(None, 4, "Main", "Doesn't drain", "Nothing")
+        log_writer.flush()
+        self.add_entries(log_writer, [3])
+        log_writer.flush()
+        # one JSON object per line, appended on each flush
+        with open(self.json_log_file, 'r') as file_obj:
+            records = [json.loads(line) for line in file_obj]
+        self.assertEqual([(record['id'], record['type'], record['message'], record['action_taken'],
+                           record['error_table']) for record in records],
+                         [(2, "Sump", "Message 2", "Nothing", core.DP_ERROR_LOG_TABLE_NAME),
+                          (4, "Main", "Doesn't drain", "Nothing", None),
+                          (3, "Sump", "Message 3", "Nothing", core.DP_ERROR_LOG_TABLE_NAME)])
+        self.assertEqual(len(records[0]['time']), len("2016-06-01 10:00:00"))
+        # an entry without a log file is only in the JSON Lines file
+        self.assertEqual(len(self.get_log_entries(self.dp_log_file)), 2)
+
+    def test_flush_files(self):
+        log_writer = core.LogWriter(self.db_session, json_log_file=self.json_log_file)
+        self.add_entries(log_writer, [1, 2])
+        # the log files keep the entries of a shapefile whose rows are rolled back
+        log_writer.flush_files()
+        self.assertEqual(len(self.get_log_entries(self.dp_log_file)), 2)
+        self.assertTrue(os.path.exists(self.json_log_file))
+        log_writer.flush()
+        self.assertEqual(self.get_error_rows(core.DP_ERROR_LOG_TABLE_NAME), [])
+        self.assertEqual(len(self.get_log_entries(self.dp_log_file)), 2)
+
+    def test_invalid_error_table(self):
+        log_writer = core.LogWriter(self.db_session)
+        self.assertRaises(Exception, log_writer.add_entry, self.dp_log_file, 1, "Sump", "Message", "Nothing",
+                          err_table_name="DrainPoints")
+
+
+if __name__ == '__main__':
+    unittest.main()
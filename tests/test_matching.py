@@ -0,0 +1,276 @@
+"""
+Tests that the matchers of the matching module match the same as the character by character loops they
+replaced. The _old_* functions are those loops (populate_matching_fields_table of the drain point page, the field
+match table of the road line page, set_index_dp_type_combo_box and get_definition_choices) taking lists in place
+of the wizard widgets.
+"""
+
+import random
+import unittest
+
+import core
+import mapping_profiles
+import matching
+from sample_data import GraipTestCase, SUMP_DRAIN_TYPE_ID
+
+
+def _old_match_dp_fields(dbf_field_names, shp_file_attribute_names):
+    no_match_use_default = core.NO_MATCH_USE_DEFAULT
+    shp_file_attribute_names = [no_match_use_default] + shp_file_attribute_names
+    source_field_col_data = []
+    for dbf_field_name in dbf_field_names:
+        found_match = False
+        for shp_att_name in shp_file_attribute_names:
+            if shp_att_name.lower() == dbf_field_name.lower():
+                if dbf_field_name not in source_field_col_data:
+                    source_field_col_data.append(dbf_field_name)
+                else:
+                    source_field_col_data.append(no_match_use_default)
+                found_match = True
+                break
+
+        if not found_match:
+            matching_field = None
+            for shp_att_name in shp_file_attribute_names:
+                if len(shp_att_name) > 2 and len(dbf_field_name) > 2:
+                    # match first 3 characters
+                    match_count = 0
+                    for i in range(len(shp_att_name)):
+                        if shp_att_name[0:i+1].lower() == dbf_field_name[0:i+1].lower():
+                            match_count += 1
+                    if match_count > 2:
+                        matching_field = shp_att_name
+                        break
+
+            if matching_field is not None and matching_field not in source_field_col_data:
+                source_field_col_data.append(matching_field)
+            else:
+                source_field_col_data.append(no_match_use_default)
+    return source_field_col_data
+
+
+def _old_match_rd_fields(dbf_field_names, shp_file_attribute_names):
+    no_match_use_default = core.NO_MATCH_USE_DEFAULT
+    shp_file_attribute_names = [no_match_use_default] + shp_file_attribute_names
+    source_field_col_data = []
+    for dbf_field_name in dbf_field_names:
+        found_match = False
+        for shp_att_name in shp_file_attribute_names:
+            if shp_att_name.lower() == dbf_field_name.lower():
+                source_field_col_data.append(dbf_field_name)
+                found_match = True
+                break
+
+        if not found_match:
+            match_field = None
+            for shp_att_name in shp_file_attribute_names:
+                if len(shp_att_name) > 2 and len(dbf_field_name) > 2:
+                    # match at least any first 3 characters
+                    match_count = 0
+                    for i in range(len(shp_att_name)):
+                        if i < len(dbf_field_name):
+                            if shp_att_name[0:i+1].lower() == dbf_field_name[0:i+1].lower():
+                                match_count += 1
+
+                    if match_count > 2:
+                        match_field = shp_att_name
+                        break
+
+            if match_field is not None and match_field not in source_field_col_data:
+                source_field_col_data.append(match_field)
+            else:
+                source_field_col_data.append(no_match_use_default)
+    return source_field_col_data
+
+
+def _old_match_drain_type(dp_shp_file_name, drain_type_names):
+    matching_index = 0
+    for index, drain_type_name in enumerate(drain_type_names):
+        no_char_match = 0
+        for i in range(1, len(drain_type_name)):
+            if drain_type_name[0:i].lower() == dp_shp_file_name[0:i].lower():
+                no_char_match += 1
+
+        if no_char_match > 2:
+            return index
+        if no_char_match == 1:
+            matching_index = index
+    return matching_index
+
+
+def _old_match_definition(missing_field_value, definitions):
+    matching_index = 0
+    field_match_found = False
+    missing_field_value = missing_field_value.replace(" ", "")
+    if len(missing_field_value) > 2:
+        for index, definition in enumerate(definitions):
+            definition = definition.replace(" ", "")
+            if len(definition) > 2:
+                # match at least any first 3 characters
+                match_count = 0
+                for i in range(len(missing_field_value)):
+                    if i < len(definition):
+                        if missing_field_value[0:i+1].lower() == definition[0:i+1].lower():
+                            match_count += 1
+
+                if match_count > 2:
+                    matching_index = index
+                    field_match_found = True
+                    break
+                elif match_count == 1:
+                    matching_index = index
+    return matching_index, field_match_found
+
+
+def _random_name(rnd):
+    return ''.join(rnd.choice('aAbB c') for _ in range(rnd.randint(0, 6)))
+
+
+class FieldNameMatcherTests(unittest.TestCase):
+    shp_field_names = ["CDATE", "CTime", "VEHICLE_ID", "Condition", "Cond2", "DP"]
+
+    def test_exact_match(self):
+        matcher = matching.FieldNameMatcher(self.shp_field_names)
+        self.assertEqual(matcher.match("CDATE"), ("CDATE", True))
+        self.assertEqual(matcher.match("ctime"), ("CTime", True))
+        self.assertEqual(matcher.match("Dp"), ("DP", True))
+
+    def test_prefix_match(self):
+        matcher = matching.FieldNameMatcher(self.shp_field_names)
+        self.assertEqual(matcher.match("VEHICLE"), ("VEHICLE_ID", False))
+        # the first shapefile field starting with the same 3 characters
+        self.assertEqual(matcher.match("CONDID"), ("Condition", False))
+
+    def test_no_match(self):
+        matcher = matching.FieldNameMatcher(self.shp_field_names)
+        self.assertEqual(matcher.match("Depth"), (None, False))
+        # names shorter than 3 characters only match exactly
+        self.assertEqual(matcher.match("CD"), (None, False))
+        self.assertEqual(matching.FieldNameMatcher([]).match("CDATE"), (None, False))
+
+
+class MatchFieldsTests(GraipTestCase):
+    def setUp(self):
+        GraipTestCase.setUp(self)
+        self.db_session = self.open_session()
+
+    def match_fields(self, shp_type, dbf_field_names, shp_field_names):
+        # the source fields matched by mapping_profiles.match_fields() for FieldMatches rows with dbf_field_names
+        db_session = self.db_session
+        cursor = db_session.cursor()
+        cursor.execute("DELETE FROM FieldMatches")
+        att_table_id = SUMP_DRAIN_TYPE_ID if shp_type == 'DP' else 0
+        cursor.executemany("INSERT INTO FieldMatches VALUES (?, ?, ?)",
+                           [(att_table_id, "Field{}".format(index), dbf_field_name)
+                            for index, dbf_field_name in enumerate(dbf_field_names)])
+        db_session.commit()
+        field_matches = mapping_profiles.match_fields(db_session, shp_type, 'Sump', shp_field_names)
+        self.assertEqual([db_field for db_field, _ in field_matches],
+                         ["Field{}".format(index) for index in range(len(dbf_field_names))])
+        return [src_field for _, src_field in field_matches]
+
+    def assert_same_as_old_loops(self, dbf_field_names, shp_field_names):
+        self.assertEqual(self.match_fields('DP', dbf_field_names, shp_field_names),
+                         _old_match_dp_fields(dbf_field_names, shp_field_names))
+        self.assertEqual(self.match_fields('RD', dbf_field_names, shp_field_names),
+                         _old_match_rd_fields(dbf_field_names, shp_field_names))
+
+    def test_exact_match(self):
+        self.assert_same_as_old_loops(["CDATE", "CTime"], ["CDATE", "CTIME"])
+        self.assertEqual(self.match_fields('DP', ["CDATE", "CTime"], ["CDATE", "CTIME"]), ["CDATE", "CTime"])
+
+    def test_prefix_match(self):
+        self.assert_same_as_old_loops(["VEHICLE", "CONDID"], ["VEHICLE_ID", "CONDITION", "CONDITION2"])
+        self.assertEqual(self.match_fields('DP', ["VEHICLE", "CONDID"], ["VEHICLE_ID", "CONDITION"]),
+                         ["VEHICLE_ID", "CONDITION"])
+
+    def test_already_used_field(self):
+        self.assert_same_as_old_loops(["CONDID", "CONDITION"], ["CONDITION"])
+        self.assert_same_as_old_loops(["COND_A", "COND_B"], ["CONDITION"])
+        self.assert_same_as_old_loops(["CDATE", "CDATE"], ["CDATE"])
+        self.assert_same_as_old_loops(["cdate", "CDATE"], ["CDate"])
+        self.assertEqual(self.match_fields('DP', ["CDATE", "CDATE"], ["CDATE"]),
+                         ["CDATE", core.NO_MATCH_USE_DEFAULT])
+        # an exact match of a road line field is used even if the field is already used
+        self.assertEqual(self.match_fields('RD', ["CDATE", "CDATE"], ["CDATE"]), ["CDATE", "CDATE"])
+
+    def test_no_match(self):
+        self.assert_same_as_old_loops(["Depth", "DP", "", "C"], ["CDATE", "DP2", "Dep"])
+        self.assertEqual(self.match_fields('DP', ["Width"], ["CDATE", "Dep"]), [core.NO_MATCH_USE_DEFAULT])
+
+    def test_same_as_old_loops_for_random_names(self):
+        rnd = random.Random(17)
+        for _ in range(200):
+            self.assert_same_as_old_loops([_random_name(rnd) for _ in range(rnd.randint(0, 6))],
+                                          [_random_name(rnd) for _ in range(rnd.randint(0, 6))])
+
+
+class DefinitionMatcherTests(unittest.TestCase):
+    definitions = ["Good", "Poor", "Buried", "Partially Buried", "Crushed", "Blocked"]
+
+    def test_exact_match(self):
+        matcher = matching.DefinitionMatcher(self.definitions)
+        self.assertEqual(matcher.match("Poor"), (1, True))
+        self.assertEqual(matcher.match("PartiallyBuried"), (3, True))
+
+    def test_prefix_match(self):
+        matcher = matching.DefinitionMatcher(self.definitions)
+        self.assertEqual(matcher.match("goo"), (0, True))
+        self.assertEqual(matcher.match("Part buried"), (3, True))
+        self.assertEqual(matcher.match("bu ried deep"), (2, True))
+
+    def test_no_match(self):
+        matcher = matching.DefinitionMatcher(self.definitions)
+        # the last definition sharing only the first character
+        self.assertEqual(matcher.match("Bent"), (5, False))
+        self.assertEqual(matcher.match("Xyz"), (0, False))
+        self.assertEqual(matcher.match("Go"), (0, False))
+        self.assertEqual(matching.DefinitionMatcher([]).match("Good"), (0, False))
+
+    def test_same_as_old_loop(self):
+        values = ["Good", "good", "Goo", "Go", "Poor ", "P oor", "Partial", "Bu", "Bent", "Brushed", "Cracked", "",
+                  "Xyz", "Blo cked"]
+        matcher = matching.DefinitionMatcher(self.definitions)
+        for value in values:
+            self.assertEqual(matcher.match(value), _old_match_definition(value, self.definitions))
+
+    def test_same_as_old_loop_for_random_values(self):
+        rnd = random.Random(17)
+        for _ in range(2000):
+            definitions = [_random_name(rnd) for _ in range(rnd.randint(0, 8))]
+            value = _random_name(rnd)
+            self.assertEqual(matching.DefinitionMatcher(definitions).match(value),
+                             _old_match_definition(value, definitions))
+
+
+class MatchDrainTypeTests(unittest.TestCase):
+    drain_type_names = ["Broad Base Dip", "Diffuse Drain", "Ditch Relief", "Lead Off", "Non-Engineered",
+                        "Stream Crossing", "Sump", "Water Bar", "Excavated Stream Crossing"]
+
+    def test_match(self):
+        self.assertEqual(matching.match_drain_type("SumpPoints", self.drain_type_names), 6)
+        self.assertEqual(matching.match_drain_type("ditch_relief_2016", self.drain_type_names), 2)
+        self.assertEqual(matching.match_drain_type("dif", self.drain_type_names), 1)
+
+    def test_no_match(self):
+        # the last drain type sharing only the first character
+        self.assertEqual(matching.match_drain_type("Dams", self.drain_type_names), 2)
+        self.assertEqual(matching.match_drain_type("Culverts", self.drain_type_names), 0)
+
+    def test_same_as_old_loop(self):
+        for shp_file_name in ["SumpPoints", "sump", "Su", "ditch_relief", "Dams", "Culverts", "Stream", "Str", "",
+                              "Water", "Excavated", "Ex"]:
+            self.assertEqual(matching.match_drain_type(shp_file_name, self.drain_type_names),
+                             _old_match_drain_type(shp_file_name, self.drain_type_names))
+
+    def test_same_as_old_loop_for_random_names(self):
+        rnd = random.Random(17)
+        for _ in range(2000):
+            drain_type_names = [_random_name(rnd) for _ in range(rnd.randint(0, 8))]
+            shp_file_name = _random_name(rnd)
+            self.assertEqual(matching.match_drain_type(shp_file_name, drain_type_names),
+                             _old_match_drain_type(shp_file_name, drain_type_names))
+
+
+if __name__ == '__main__':
+    unittest.main()
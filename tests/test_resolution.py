@@ -0,0 +1,149 @@
+"""
+Tests of finding the values that are not in a definitions table (ImportEngine.scan_unknown_values) and resolving
+them with a ResolutionPolicy. The sample CondDefinitions table has Good (1), Poor (2, the default) and Buried (3).
+"""
+
+import unittest
+
+import import_engine
+import resolution
+from sample_data import GraipTestCase, create_sump_row, create_sump_spec
+
+
+class ResolutionPolicyTests(GraipTestCase):
+    def setUp(self):
+        GraipTestCase.setUp(self)
+        self.db_session = self.open_session()
+
+    def get_value_reassigns(self):
+        self.db_session.commit()
+        with self.db_session.read_cursor() as cursor:
+            return [tuple(row) for row in cursor.execute("SELECT FromField, ToField, DefinitionID, DefinitionTable "
+                                                         "FROM ValueReassigns").fetchall()]
+
+    def get_cond_definitions(self):
+        cursor = self.db_session.cursor()
+        return [tuple(row) for row in cursor.execute("SELECT * FROM CondDefinitions ORDER BY CondID").fetchall()]
+
+    def test_default_rules(self):
+        policy = resolution.ResolutionPolicy(self.db_session)
+        # the closest match comes first, then the default
+        self.assertEqual(policy.resolve("goood", "CondDefinitions"), (1, "Reassigned value as Good"))
+        self.assertEqual(policy.resolve("Xyz", "CondDefinitions"), (2, "Used Default - Poor"))
+        policy.flush()
+        self.assertEqual(self.get_value_reassigns(), [("goood", "Good", 1, "CondDefinitions"),
+                                                      ("Xyz", "Poor", 2, "CondDefinitions")])
+        self.assertEqual(self.db_session.definitions.get_definition_id("CondDefinitions", "GOOOD"), 1)
+        self.assertEqual(self.db_session.definitions.get_definition_id("CondDefinitions", "xyz"), 2)
+
+    def test_rule_order(self):
+        policy = resolution.ResolutionPolicy(self.db_session, rules=(resolution.RULE_USE_DEFAULT,
+                                                                     resolution.RULE_CLOSEST_MATCH))
+        self.assertEqual(policy.resolve("goood", "CondDefinitions"), (2, "Used Default - Poor"))
+
+        policy = resolution.ResolutionPolicy(self.db_session, rules=(resolution.RULE_CLOSEST_MATCH,
+                                                                     resolution.RULE_ADD_NEW,
+                                                                     resolution.RULE_USE_DEFAULT))
+        self.assertEqual(policy.resolve("Bur", "CondDefinitions"), (3, "Reassigned value as Buried"))
+        self.assertEqual(policy.resolve("Crushed", "CondDefinitions"), (4, "Added to definition table as ID 4"))
+
+    def test_add_new(self):
+        policy = resolution.ResolutionPolicy(self.db_session, rules=(resolution.RULE_ADD_NEW,))
+        self.assertEqual(policy.resolve("Crushed", "CondDefinitions"), (4, "Added to definition table as ID 4"))
+        self.assertEqual(policy.resolve("Cracked", "CondDefinitions"), (5, "Added to definition table as ID 5"))
+        self.assertEqual(self.get_cond_definitions()[3:], [(4, "Crushed", "Crushed"), (5, "Cracked", "Cracked")])
+        self.assertEqual(self.db_session.definitions.get_definition_id("CondDefinitions", "crushed"), 4)
+        self.assertEqual(self.get_value_reassigns(), [])
+
+    def test_added_definition_is_matched(self):
+        policy = resolution.ResolutionPolicy(self.db_session, rules=(resolution.RULE_CLOSEST_MATCH,
+                                                                     resolution.RULE_ADD_NEW))
+        self.assertEqual(policy.resolve("Crushed", "CondDefinitions"), (4, "Added to definition table as ID 4"))
+        self.assertEqual(policy.resolve("Crush", "CondDefinitions"), (4, "Reassigned value as Crushed"))
+
+    def test_no_default_definition(self):
+        self.db_session.cursor().execute("UPDATE CondDefinitions SET Description='Poor condition' WHERE CondID=2")
+        self.db_session.commit()
+        policy = resolution.ResolutionPolicy(self.db_session, rules=(resolution.RULE_USE_DEFAULT,
+                                                                     resolution.RULE_ADD_NEW))
+        self.assertEqual(policy.resolve("Xyz", "CondDefinitions"), (4, "Added to definition table as ID 4"))
+
+    def test_no_rule_applies(self):
+        policy = resolution.ResolutionPolicy(self.db_session, rules=(resolution.RULE_CLOSEST_MATCH,))
+        self.assertRaises(Exception, policy.resolve, "Xyz", "CondDefinitions")
+
+    def test_invalid_rule(self):
+        self.assertRaises(Exception, resolution.ResolutionPolicy, self.db_session, rules=("ask_user",))
+        self.assertRaises(Exception, resolution.ResolutionPolicy, self.db_session,
+                          table_rules={"CondDefinitions": ("ask_user",)})
+
+    def test_table_rules(self):
+        policy = resolution.ResolutionPolicy(self.db_session,
+                                             table_rules={"conddefinitions": (resolution.RULE_ADD_NEW,)})
+        self.assertEqual(policy.resolve("goood", "CondDefinitions"), (4, "Added to definition table as ID 4"))
+
+    def test_value_overrides(self):
+        policy = resolution.ResolutionPolicy(self.db_session, rules=(resolution.RULE_ADD_NEW,),
+                                             value_overrides={"CondDefinitions": {"WEIRD": "buried"}})
+        self.assertTrue(policy.has_override("weird", "conddefinitions"))
+        self.assertFalse(policy.has_override("goood", "CondDefinitions"))
+        # an override comes before the rules
+        self.assertEqual(policy.resolve("Weird", "CondDefinitions"), (3, "Reassigned value as Buried"))
+
+        policy = resolution.ResolutionPolicy(self.db_session, value_overrides={"CondDefinitions": {"weird": "Bent"}})
+        self.assertRaises(Exception, policy.resolve, "weird", "CondDefinitions")
+
+    def test_batches(self):
+        policy = resolution.ResolutionPolicy(self.db_session, batch_size=2)
+        policy.resolve("Xyz", "CondDefinitions")
+        self.assertEqual(len(self.get_value_reassigns()), 0)
+        policy.resolve("Xyy", "CondDefinitions")
+        self.assertEqual(len(self.get_value_reassigns()), 2)
+        policy.resolve("Xxx", "CondDefinitions")
+        policy.clear()
+        policy.flush()
+        self.assertEqual(len(self.get_value_reassigns()), 2)
+
+
+class ScanUnknownValuesTests(GraipTestCase):
+    def setUp(self):
+        GraipTestCase.setUp(self)
+        self.db_session = self.open_session()
+        conds = ["Good", "goood", "Xyz", None, "good", "xyz", "Xyz", ""]
+        self.specs = [create_sump_spec(self.write_sump_shapefile("Sump1", [create_sump_row(index, cond)
+                                                                           for index, cond in enumerate(conds)])),
+                      create_sump_spec(self.write_sump_shapefile("Sump2", [create_sump_row(0, "XYZ")]))]
+
+    def test_scan(self):
+        engine = self.create_import_engine(self.db_session)
+        unknown_values = engine.scan_unknown_values(self.specs)
+        self.assertEqual([(unknown_value.value, unknown_value.field_name, unknown_value.definition_table_name,
+                           unknown_value.count) for unknown_value in unknown_values],
+                         [("goood", "CondID", "CondDefinitions", 1), ("Xyz", "CondID", "CondDefinitions", 4)])
+        self.assertEqual(unknown_values[1].shp_files, [spec.shp_file for spec in self.specs])
+        # nothing is written
+        self.assertEqual(self.db_session.cursor().execute("SELECT COUNT(*) FROM DrainPoints").fetchone()[0], 0)
+
+    def test_import_after_defining(self):
+        engine = self.create_import_engine(self.db_session)
+        policy = resolution.ResolutionPolicy(self.db_session, rules=(resolution.RULE_ADD_NEW,))
+        for unknown_value in engine.scan_unknown_values(self.specs):
+            policy.resolve(unknown_value.value, unknown_value.definition_table_name, unknown_value.is_multiplier)
+        policy.flush()
+        self.db_session.commit()
+        self.assertEqual(engine.scan_unknown_values(self.specs), [])
+
+        def define_value(value, field_name, def_table_name, is_multiplier):
+            raise Exception("Value '{}' was not defined by the scan.".format(value))
+
+        engine = import_engine.ImportEngine(self.db_session, engine.dp_log_file, engine.rd_log_file,
+                                            is_uninterrupted=False, define_value_callback=define_value)
+        for spec in self.specs:
+            engine.import_drain_points(spec)
+        sql_select = "SELECT CondID FROM SumpAtt ORDER BY GRAIPDID"
+        self.assertEqual([row.CondID for row in self.db_session.cursor().execute(sql_select).fetchall()],
+                         [1, 4, 5, None, 1, 5, 5, None, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+Tests of linking road lines to the drain points at their ends (ImportEngine.import_road_lines) and of the
+check for orphan drain points, orphan road segments and duplicate DrainIDs (core.check_for_orphans_and_duplicates)
+"""
+
+import unittest
+
+import core
+from sample_data import (RD_SHP_FIELDS, GraipTestCase, create_road_spec, create_sump_row, create_sump_spec,
+                         write_point_shapefile)
+
+# collection minutes of the sample drain points - the 2nd and 3rd drain points have the same DrainID
+DP_MINUTES = [0, 1, 1, 5, 7]
+
+
+def create_road_row(minute1, minute2):
+    return {"CDATE": "2016/06/01", "CTIME1": "10:{:02d}:00am".format(minute1),
+            "CTIME2": "10:{:02d}:00am".format(minute2), "VEHICLE": 3}
+
+
+class RoadNetworkTestCase(GraipTestCase):
+    """
+    Test case with the sample drain points (DP_MINUTES) and road lines imported to the sample database
+    """
+    def setUp(self):
+        GraipTestCase.setUp(self)
+        self.db_session = self.open_session()
+        self.engine = self.create_import_engine(self.db_session)
+        self.engine.import_drain_points(create_sump_spec(self.write_sump_shapefile(
+            "Sump", [create_sump_row(minute) for minute in DP_MINUTES])))
+        rd_shp_file = self.get_shp_file("Roads")
+        # linked to the 1st and 2nd drain points, to the 4th drain point only and to no drain point
+        write_point_shapefile(rd_shp_file, RD_SHP_FIELDS, [create_road_row(0, 1), create_road_row(30, 5),
+                                                            create_road_row(30, 31)])
+        self.engine.import_road_lines(create_road_spec(rd_shp_file))
+
+    def get_records(self, sql_select):
+        return [tuple(row) for row in self.db_session.cursor().execute(sql_select).fetchall()]
+
+    def get_log_entries(self, log_file):
+        # the lines after the header of a log file (see core.create_log_file())
+        with open(log_file, 'r') as file_obj:
+            return file_obj.readlines()[3:]
+
+
+class RoadLinkTests(RoadNetworkTestCase):
+    def test_links(self):
+        sql_select = "SELECT GRAIPRID, OrigDrainID1, OrigDrainID2, GRAIPDID1, GRAIPDID2, StreamConnect1ID, " \
+                     "StreamConnect2ID, RoadNetworkID FROM RoadLines ORDER BY GRAIPRID"
+        # a DrainID shared by drain points links to the first of them
+        self.assertEqual(self.get_records(sql_select),
+                         [(0, 16060110003.0, 16060110013.0, 0, 1, 1, 1, 1),
+                          (1, 16060110303.0, 16060110053.0, None, 3, None, 1, 1),
+                          (2, 16060110303.0, 16060110313.0, None, None, None, None, 1)])
+
+    def test_log(self):
+        self.assertEqual(self.get_log_entries(self.engine.dp_log_file), ["2, Main, Doesn't drain, Nothing \n"])
+        self.assertEqual(self.get_log_entries(self.engine.rd_log_file), [])
+        self.assertEqual(self.get_records("SELECT * FROM RDErrorLog"), [])
+        self.assertEqual(self.get_records("SELECT * FROM DPErrorLog"), [])
+
+    def test_relink(self):
+        # the links are made with the drain points in the database when the road lines are imported
+        self.db_session.cursor().execute("DELETE FROM DrainPoints WHERE GRAIPDID=1")
+        self.db_session.commit()
+        engine = self.create_import_engine(self.db_session)
+        engine.update_road_lines(create_road_spec(self.get_shp_file("Roads")), is_forced=True)
+        self.assertEqual(self.get_records("SELECT GRAIPDID1, GRAIPDID2 FROM RoadLines ORDER BY GRAIPRID"),
+                         [(0, 2), (None, 3), (None, None)])
+
+
+class OrphansAndDuplicatesTests(RoadNetworkTestCase):
+    def setUp(self):
+        RoadNetworkTestCase.setUp(self)
+        # drain points without collection time all have the same DrainID
+        no_time_rows = [create_sump_row(index) for index in range(2)]
+        for dp_row in no_time_rows:
+            dp_row["CTIME"] = str(core.NO_COLLECTION_TIME)
+        self.engine.import_drain_points(create_sump_spec(self.write_sump_shapefile("NoTime", no_time_rows)))
+        # only the entries of the check
+        core.create_log_file(self.db_file, self.engine.dp_log_file, 'DP')
+        core.create_log_file(self.db_file, self.engine.rd_log_file, 'RD')
+
+    def test_check(self):
+        self.assertEqual(core.check_for_orphans_and_duplicates(self.db_session, self.engine.dp_log_file,
+                                                               self.engine.rd_log_file),
+                         ([2, 4, 5, 6], [2], [1, 2]))
+        self.assertEqual(self.get_log_entries(self.engine.dp_log_file),
+                         ["1, Sump, Duplicate DrainID:16060110013.0, Nothing \n",
+                          "2, Sump, Orphan Drain Point, Nothing \n",
+                          "2, Sump, Duplicate DrainID:16060110013.0, Nothing \n",
+                          "4, Sump, Orphan Drain Point, Nothing \n",
+                          "5, Sump, Orphan Drain Point, Nothing \n",
+                          "6, Sump, Orphan Drain Point, Nothing \n"])
+        self.assertEqual(self.get_log_entries(self.engine.rd_log_file),
+                         ["2, Road Line, Orphan Road Segment, Nothing \n"])
+        self.assertEqual(self.get_records("SELECT GRAIPDID, DrainType, ErrorMessage, ActionTaken FROM DPErrorLog "
+                                          "ORDER BY ID"),
+                         [(1, "Sump", "Duplicate DrainID:16060110013.0", "Nothing"),
+                          (2, "Sump", "Orphan Drain Point", "Nothing"),
+                          (2, "Sump", "Duplicate DrainID:16060110013.0", "Nothing"),
+                          (4, "Sump", "Orphan Drain Point", "Nothing"),
+                          (5, "Sump", "Orphan Drain Point", "Nothing"),
+                          (6, "Sump", "Orphan Drain Point", "Nothing")])
+        self.assertEqual(self.get_records("SELECT GRAIPRID, RoadType, ErrorMessage, ActionTaken FROM RDErrorLog"),
+                         [(2, "Road Line", "Orphan Road Segment", "Nothing")])
+
+    def test_committed(self):
+        core.check_for_orphans_and_duplicates(self.db_session, self.engine.dp_log_file, self.engine.rd_log_file)
+        with self.db_session.read_cursor() as cursor:
+            self.assertEqual(cursor.execute("SELECT COUNT(*) FROM DPErrorLog").fetchone()[0], 6)
+
+    def test_no_records(self):
+        core.clear_data_tables(self.db_session)
+        self.assertEqual(core.check_for_orphans_and_duplicates(self.db_session, self.engine.dp_log_file,
+                                                               self.engine.rd_log_file), ([], [], []))
+        self.assertEqual(self.get_log_entries(self.engine.dp_log_file), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,29 +1,21 @@
-import sys
 import os
-import time
 
-import pyodbc
-from osgeo import ogr, osr
+from osgeo import ogr
 from gdalconst import *
 
-from datetime import datetime
 from PySide.QtGui import *
 from PySide.QtCore import *
 
-MS_ACCESS_CONNECTION = "Driver={Microsoft Access Driver (*.mdb, *.accdb)};DBQ=%s;"
-DP_ERROR_LOG_TABLE_NAME = 'DPErrorLog'
-RD_ERROR_LOG_TABLE_NAME = 'RDErrorLog'
-GRAIP_ICON_FILE = "GRAIPIcon.ico"
-
-
-class GDALFileDriver(object):
-    @classmethod
-    def ShapeFile(cls):
-        return "ESRI Shapefile"
+import checkpoints
+import consolidate
+import core
+import graip_db
+import graip_preprocess
+import import_engine
+import mapping_profiles
+import matching
 
-    @classmethod
-    def TifFile(cls):
-        return "GTiff"
+GRAIP_ICON_FILE = "GRAIPIcon.ico"
 
 
 class GraipMessageBox(QMessageBox):
@@ -62,14 +54,19 @@ class FileDialog(QFileDialog):
 
 
 class ConsolidateShapeFiles(QDialog):
-    def __init__(self, graip_db_file, dp_shp_files, rd_shp_files, dp_log_file, rd_log_file, working_directory, parent=None):
+    def __init__(self, db_session, dp_shp_files, rd_shp_files, dp_log_file, rd_log_file, working_directory,
+                 output_format=consolidate.SHAPEFILE_FORMAT, include_attributes=False, is_compact_database=False,
+                 parent=None):
         super(ConsolidateShapeFiles, self).__init__(parent)
-        self.graip_db_file = graip_db_file
+        self.db_session = db_session
         self.dp_shp_files = dp_shp_files
         self.rd_shp_files = rd_shp_files
         self.dp_log_file = dp_log_file
         self.rd_log_file = rd_log_file
         self.working_directory = working_directory
+        self.output_format = output_format
+        self.include_attributes = include_attributes
+        self.is_compact_database = is_compact_database
 
         v_layout = QVBoxLayout()
         msg = "Checking for orphan drain points, road segments, and duplicate ids ..."
@@ -97,178 +94,43 @@ class ConsolidateShapeFiles(QDialog):
         self.check_for_orphan_drain_points()
         self.consolidate_dp_shp_files()
         self.consolidate_rd_shp_files()
+        if self.is_compact_database:
+            self.compact_database()
         self.message.setText("Preprocessing successful")
         self.btn_close.setEnabled(True)
 
     def check_for_orphan_drain_points(self):
-        conn = pyodbc.connect(MS_ACCESS_CONNECTION % self.graip_db_file)
-        cursor = conn.cursor()
-        dp_rows = cursor.execute("SELECT * FROM DrainPoints").fetchall()
-        dp_record_count = len(dp_rows)
-        self.progress_bar.setMaximum(dp_record_count)
-        for i, dp_row in enumerate(dp_rows):
-            graipdid = dp_row.GRAIPDID
-            dp_def_row = cursor.execute("SELECT * FROM DrainTypeDefinitions WHERE DrainTypeID=?", dp_row.DrainTypeID).fetchone()
-            sql_select = "SELECT GRAIPDID1, GRAIPDID2 FROM RoadLines WHERE GRAIPDID1=? OR GRAIPDID2=?"
-            rd_rows = cursor.execute(sql_select, (graipdid, graipdid)).fetchall()
-            if rd_rows is None:
-                add_entry_to_log_file(self.dp_log_file, graipdid, dp_def_row.DrainTypeName, "Orphan Drain Point",
-                                      "Nothing")
-                add_entry_to_error_table(self.graip_db_file, DP_ERROR_LOG_TABLE_NAME, graipdid,
-                                         dp_def_row.DrainTypeName, "Orphan Drain Point", "Nothing")
-
-            # check if there are duplicate drainids in DrainPoints table
-            dp_rows_for_drainid = cursor.execute("SELECT * FROM DrainPoints WHERE DrainID=?", dp_row.DrainID).fetchall()
-            for dp_row_di in dp_rows_for_drainid:
-                msg = "Duplicate DrainID:{}".format(dp_row.DrainID)
-                add_entry_to_log_file(self.dp_log_file, dp_row_di.GRAIPDID, dp_def_row.DrainTypeName, msg,
-                                      "Nothing")
-                add_entry_to_error_table(self.graip_db_file, DP_ERROR_LOG_TABLE_NAME, dp_row_di.GRAIPDID,
-                                         dp_def_row.DrainTypeName, msg, "Nothing")
-
-            # update progressbar
-            progress_value = i + 1
-            self.progress_bar.setValue(progress_value)
-            QApplication.processEvents()
-
-        rd_rows = cursor.execute("SELECT * FROM RoadLines").fetchall()
-        rd_record_count = len(rd_rows)
-        self.progress_bar.setValue(0)
-        self.progress_bar.setMaximum(rd_record_count)
-        for i, rd_row in enumerate(rd_rows):
-            graiprid = rd_row.GRAIPRID
-            sql_select = "SELECT * FROM DrainPoints WHERE GRAIPDID=? OR GRAIPDID=?"
-            dp_rows = cursor.execute(sql_select, (rd_row.GRAIPDID1, rd_row.GRAIPDID2)).fetchall()
-            if dp_rows is None:
-                add_entry_to_log_file(self.dp_log_file, graiprid, "Road Line", "Orphan Road Segment",
-                                      "Nothing")
-                add_entry_to_error_table(self.graip_db_file, RD_ERROR_LOG_TABLE_NAME, graiprid,
-                                         "Road Line", "Orphan Road Segment", "Nothing")
-            # update progressbar
-            progress_value = i + 1
-
-            self.progress_bar.setValue(progress_value)
-
-        conn.close()
+        core.check_for_orphans_and_duplicates(self.db_session, self.dp_log_file, self.rd_log_file)
+        QApplication.processEvents()
 
     def consolidate_dp_shp_files(self):
         self.message.setText("Consolidating multiple drain points shapefiles...")
-        conn = pyodbc.connect(MS_ACCESS_CONNECTION % self.graip_db_file)
-        cursor = conn.cursor()
-        dp_rows = cursor.execute("SELECT GRAIPDID FROM DrainPoints ORDER BY GRAIPDID").fetchall()
-        dp_record_count = len(dp_rows)
-        conn.close()
         self.progress_bar.setValue(0)
-        self.progress_bar.setMaximum(dp_record_count)
-        # set up the shapefile driver
-        driver = ogr.GetDriverByName(GDALFileDriver.ShapeFile())
-
-        # create the data source
-        dp_consolidated_shp_file = os.path.join(self.working_directory, "DrainPoints.shp")
-        dp_data_source = driver.CreateDataSource(dp_consolidated_shp_file)
-        # create the layer of the shapefile
-        srs = osr.SpatialReference()
-        dp_layer = dp_data_source.CreateLayer("DrainPoints", srs, ogr.wkbPoint)
-        # Add the field GRAIPDID
-        field_name = ogr.FieldDefn("GRAIPDID", ogr.OFTInteger)
-        dp_layer.CreateField(field_name)
-
-        # for dp_row in dp_rows:
-        #     feature = ogr.Feature(dp_layer.GetLayerDefn())
-        #     # Set the attributes using the values from the delimited text file
-        #     feature.SetField("GRAIPDID", dp_row.GRAIPDID)
-        #     # Create the feature in the layer (shapefile)
-        #     dp_layer.CreateFeature(feature)
-        #     # Destroy the feature to free resources
-        #     feature.Destroy()
-        #
-        #     self.progress_bar.setValue(dp_row.GRAIPDID + 1)
-        #     QApplication.processEvents()
-        #     time.sleep(0.01)
-
-        # NOTE: This how the old graip used to do
-        graipdid = 0
-        gdal_driver = ogr.GetDriverByName(GDALFileDriver.ShapeFile())
-        for shp_file in self.dp_shp_files:
-            data_source = gdal_driver.Open(shp_file, GA_ReadOnly)
-            layer = data_source.GetLayer(0)
-            for feature in layer:
-                dp_feature = ogr.Feature(dp_layer.GetLayerDefn())
-                geom = feature.GetGeometryRef()
-                # Set the feature geometry
-                dp_feature.SetGeometry(geom)
-                # Set the attributes using the values from the delimited text file
-                dp_feature.SetField("GRAIPDID", graipdid)
-                # Create the feature in the layer (shapefile)
-                dp_layer.CreateFeature(dp_feature)
-                # Destroy the feature to free resources
-                dp_feature.Destroy()
-                graipdid += 1
-                self.progress_bar.setValue(graipdid)
-                QApplication.processEvents()
-                time.sleep(0.01)
-            data_source.Destroy()
-
-        dp_data_source.Destroy()
+        consolidation_engine = self.create_consolidation_engine()
+        consolidation_engine.consolidate_drain_points(self.dp_shp_files)
 
     def consolidate_rd_shp_files(self):
         self.message.setText("Consolidating multiple road lines shapefiles...")
-        conn = pyodbc.connect(MS_ACCESS_CONNECTION % self.graip_db_file)
-        cursor = conn.cursor()
-        rd_rows = cursor.execute("SELECT GRAIPRID FROM RoadLines ORDER BY GRAIPRID").fetchall()
-        rd_record_count = len(rd_rows)
-        conn.close()
         self.progress_bar.setValue(0)
-        self.progress_bar.setMaximum(rd_record_count)
-        # set up the shapefile driver
-        driver = ogr.GetDriverByName(GDALFileDriver.ShapeFile())
-
-        # create the data source
-        rd_consolidated_shp_file = os.path.join(self.working_directory, "RoadLines.shp")
-        rd_data_source = driver.CreateDataSource(rd_consolidated_shp_file)
-        # create the layer
-        srs = osr.SpatialReference()
-        rd_layer = rd_data_source.CreateLayer("RoadLines", srs, ogr.wkbLineString)
-        # Add the field GRAIPRID
-        field_name = ogr.FieldDefn("GRAIPRID", ogr.OFTInteger)
-        rd_layer.CreateField(field_name)
-
-        # for rd_row in rd_rows:
-        #     feature = ogr.Feature(layer.GetLayerDefn())
-        #     # Set the attributes using the values from the delimited text file
-        #     feature.SetField("GRAIPRID", rd_row.GRAIPRID)
-        #     # Create the feature in the layer (shapefile)
-        #     layer.CreateFeature(feature)
-        #     # Destroy the feature to free resources
-        #     feature.Destroy()
-        #     self.progress_bar.setValue(rd_row.GRAIPRID + 1)
-        #     QApplication.processEvents()
-        #     time.sleep(0.01)
-        # data_source.Destroy()
-
-        graiprid = 0
-        gdal_driver = ogr.GetDriverByName(GDALFileDriver.ShapeFile())
-        for shp_file in self.rd_shp_files:
-            data_source = gdal_driver.Open(shp_file, GA_ReadOnly)
-            layer = data_source.GetLayer(0)
-            for feature in layer:
-                rd_feature = ogr.Feature(rd_layer.GetLayerDefn())
-                geom = feature.GetGeometryRef()
-                # Set the feature geometry
-                rd_feature.SetGeometry(geom)
-                # Set the attributes using the values from the delimited text file
-                rd_feature.SetField("GRAIPRID", graiprid)
-                # Create the feature in the layer (shapefile)
-                rd_layer.CreateFeature(rd_feature)
-                # Destroy the feature to free resources
-                rd_feature.Destroy()
-                graiprid += 1
-                self.progress_bar.setValue(graiprid)
-                QApplication.processEvents()
-                time.sleep(0.01)
-            data_source.Destroy()
-
-        rd_data_source.Destroy()
+        consolidation_engine = self.create_consolidation_engine()
+        consolidation_engine.consolidate_road_lines(self.rd_shp_files)
+
+    def compact_database(self):
+        self.message.setText("Compacting the GRAIP database...")
+        QApplication.processEvents()
+        # the session connects again if it is used after compacting
+        self.db_session.close()
+        graip_db.compact_database(self.db_session.db_file)
+
+    def create_consolidation_engine(self):
+        return consolidate.ConsolidationEngine(self.working_directory, progress_callback=self.update_progress,
+                                               output_format=self.output_format, db_session=self.db_session,
+                                               include_attributes=self.include_attributes)
+
+    def update_progress(self, layer_name, count_done, count_total):
+        self.progress_bar.setMaximum(count_total)
+        self.progress_bar.setValue(count_done)
+        QApplication.processEvents()
 
 
 class AddRoadNetworkDefinitionsDialog(QDialog):
@@ -276,9 +138,9 @@ class AddRoadNetworkDefinitionsDialog(QDialog):
     rd_base_rate = None
     rd_description = None
 
-    def __init__(self, graip_db_file, parent=None):
+    def __init__(self, db_session, parent=None):
         super(AddRoadNetworkDefinitionsDialog, self).__init__(parent)
-        self.graip_db_file = graip_db_file
+        self.db_session = db_session
         grid_layout = QGridLayout()
         self.label_rd_network_name = QLabel("Road Network Name")
         self.line_edit_rd_network_name = QLineEdit()
@@ -323,12 +185,10 @@ class AddRoadNetworkDefinitionsDialog(QDialog):
             return
         else:
             # check that the network name not already exists
-            conn = pyodbc.connect(MS_ACCESS_CONNECTION % self.graip_db_file)
-            cursor = conn.cursor()
             network_name = self.line_edit_rd_network_name.text().strip()
             sql_select = "SELECT * FROM RoadNetworkDefinitions WHERE RoadNetwork=?"
-            network_def_row = cursor.execute(sql_select, network_name).fetchone()
-            conn.close()
+            with self.db_session.read_cursor() as cursor:
+                network_def_row = cursor.execute(sql_select, network_name).fetchone()
             if network_def_row is not None:
                 msg_box.setText("Network name already exists.")
                 msg_box.exec_()
@@ -407,6 +267,27 @@ class OptionsDialog(QDialog):
 
         self.form_layout.addRow(self.grp_box_log_files)
 
+        self.grp_box_output = QGroupBox("Consolidated Output")
+        self.cmb_output_format = QComboBox()
+        self.cmb_output_format.addItem("Shapefile (*.shp)", consolidate.SHAPEFILE_FORMAT)
+        self.cmb_output_format.addItem("GeoPackage (*.gpkg)", consolidate.GEOPACKAGE_FORMAT)
+        self.chk_box_include_attributes = QCheckBox("Include database attributes")
+        v_layout_output = QVBoxLayout()
+        v_layout_output.addWidget(self.cmb_output_format)
+        v_layout_output.addWidget(self.chk_box_include_attributes)
+        self.grp_box_output.setLayout(v_layout_output)
+        self.form_layout.addRow(self.grp_box_output)
+
+        self.grp_box_database = QGroupBox("GRAIP Database")
+        self.chk_box_reset_database = QCheckBox("Reset the database before importing (keeps definitions and "
+                                                "field matches)")
+        self.chk_box_compact_database = QCheckBox("Compact the database after preprocessing")
+        v_layout_database = QVBoxLayout()
+        v_layout_database.addWidget(self.chk_box_reset_database)
+        v_layout_database.addWidget(self.chk_box_compact_database)
+        self.grp_box_database.setLayout(v_layout_database)
+        self.form_layout.addRow(self.grp_box_database)
+
         # OK and Cancel buttons
         btn_layout = QHBoxLayout()
         self.buttons = QDialogButtonBox(
@@ -421,7 +302,7 @@ class OptionsDialog(QDialog):
 
         self.setWindowTitle("Options")
         self.setWindowIcon(QIcon(GRAIP_ICON_FILE))
-        self.resize(600, 250)
+        self.resize(600, 380)
         self.setLayout(self.form_layout)
         self.setModal(True)
 
@@ -447,11 +328,18 @@ class OptionsDialog(QDialog):
 
     def get_selected_options(self):
         is_uniterrupted = self.radio_btn_uninterrupted.isChecked()
+        output_format = self.cmb_output_format.itemData(self.cmb_output_format.currentIndex())
+        include_attributes = self.chk_box_include_attributes.isChecked()
+        is_reset_database = self.chk_box_reset_database.isChecked()
+        is_compact_database = self.chk_box_compact_database.isChecked()
 
-        return self.line_edit_dp_log_file.text(), self.line_edit_rd_log_file.text(), is_uniterrupted
+        return self.line_edit_dp_log_file.text(), self.line_edit_rd_log_file.text(), is_uniterrupted, \
+            output_format, include_attributes, is_reset_database, is_compact_database
 
     @staticmethod
-    def get_data_from_dialog(dp_log_file, rd_log_file, is_uninterrupted=False):
+    def get_data_from_dialog(dp_log_file, rd_log_file, is_uninterrupted=False,
+                             output_format=consolidate.SHAPEFILE_FORMAT, include_attributes=False,
+                             is_reset_database=False, is_compact_database=False):
         dialog = OptionsDialog()
         if is_uninterrupted:
             dialog.radio_btn_uninterrupted.toggle()
@@ -460,6 +348,10 @@ class OptionsDialog(QDialog):
 
         dialog.line_edit_dp_log_file.setText(dp_log_file)
         dialog.line_edit_rd_log_file.setText(rd_log_file)
+        dialog.cmb_output_format.setCurrentIndex(dialog.cmb_output_format.findData(output_format))
+        dialog.chk_box_include_attributes.setChecked(include_attributes)
+        dialog.chk_box_reset_database.setChecked(is_reset_database)
+        dialog.chk_box_compact_database.setChecked(is_compact_database)
         dialog.exec_()
         return dialog.get_selected_options()
 
@@ -472,12 +364,12 @@ class DefineValueDialog(QDialog):
     definition_id = 0
     action_taken_msg = ""
 
-    def __init__(self, missing_field_value, missing_field_name, graip_db_file, def_table_name,
+    def __init__(self, missing_field_value, missing_field_name, db_session, def_table_name,
                  is_multiplier=False, parent=None):
         super(DefineValueDialog, self).__init__(parent)
         self.missing_field_value = missing_field_value
         self.missing_field_name = missing_field_name
-        self.graip_db_file = graip_db_file
+        self.db_session = db_session
         self.def_table_name = def_table_name
         self.is_multiplier = is_multiplier
         self.def_default_id = None
@@ -573,137 +465,205 @@ class DefineValueDialog(QDialog):
             self.radio_btn_reassign.toggle()
 
     def _initial_setup(self):
-        try:
-            conn = pyodbc.connect(MS_ACCESS_CONNECTION % self.graip_db_file)
-            cursor = conn.cursor()
-            sql_select = "SELECT * FROM {}".format(self.def_table_name)
-            def_rows = cursor.execute(sql_select).fetchall()
-            # definitions are in the 2nd column of the definitions table
-            definitions = [row[1] for row in def_rows]
-            self.cmb_definitions.addItems(definitions)
-            # definitions ID values are in the 1st column of the definitions table
-            self.definition_ids = [row[0] for row in def_rows]
-            # set the current index of the combobox
-            initial_combobox_index = 0
-            field_match_found = False
-            # if isinstance(self.missing_field_value, int):
-            #     print str(self.missing_field_value)
-            missing_field_value = self.missing_field_value.replace(" ", "")
-            if len(missing_field_value) > 2:
-                for index in range(self.cmb_definitions.count()):
-                    definition = self.cmb_definitions.itemText(index)
-                    definition = definition.replace(" ", "")
-                    if len(definition) > 2:
-                        # match at least any first 3 characters
-                        match_count = 0
-                        for i in range(len(missing_field_value)):
-                            if i < len(definition):
-                                if missing_field_value[0:i+1].lower() == definition[0:i+1].lower():
-                                    match_count += 1
-
-                        if match_count > 2:
-                            initial_combobox_index = index
-                            field_match_found = True
-                            break
-                        elif match_count == 1:
-                            initial_combobox_index = index
-
-            self.cmb_definitions.setCurrentIndex(initial_combobox_index)
-            # matching found
-            if field_match_found:
-                # set the reassign radio button as checked
-                self.radio_btn_reassign.toggle()
-
-            # see default value exists in definitions table
-            sql_select = "SELECT * FROM {} WHERE Description LIKE '%Default%'".format(self.def_table_name)
-            def_row = cursor.execute(sql_select).fetchone()
-            if def_row:
-                self.line_edit_default.setText(def_row[1])
-                self.def_default_id = def_row[0]
-                if not field_match_found:
-                    self.radio_btn_use_default.toggle()
-            else:
-                self.line_edit_default.setText("No Default Specified")
-                self.def_default_id = 0
-                # disable the radio button for default
-                self.radio_btn_use_default.setEnabled(False)
-                if not field_match_found:
-                    self.radio_btn_add_new.toggle()
-
-            # TODO: Continue here (ref getIDFromDefinitionTable function in mod modGeneralFunctions)
-            # frmAddMultiplier.txtID = defID
-            # in case of adding a new entry to the definition table, find the next id that will be used for this
-            # new definition record
-            # first determine the field name of the ID field in the definition table (this is the first column of the
-            # table)
-            def_column = cursor.columns(table=self.def_table_name).fetchone()
-            # now use the def_column.column_name to find the maximum value for this field
-            sql_select = "SELECT MAX({}) AS max_id FROM {}".format(def_column.column_name, self.def_table_name)
-            row = cursor.execute(sql_select).fetchone()
-            def_id = 0
-            if row:
-                def_id = row.max_id + 1
-
-            self.line_edit_id.setText(str(def_id))
-            self.line_edit_def.setText(self.missing_field_value)
-            self.line_edit_description.setText(self.missing_field_value)
-            if self.is_multiplier:
-                self.line_edit_multiplier.setText("1")
-        except Exception:
-            raise
-        finally:
-            if conn:
-                conn.close()
+        # use the session cursor to see definitions added earlier in the import that are not committed yet
+        cursor = self.db_session.cursor()
+        choices = core.get_definition_choices(cursor, self.def_table_name, self.missing_field_value)
+        self.cmb_definitions.addItems(choices.definitions)
+        self.definition_ids = choices.definition_ids
+        # set the current index of the combobox
+        self.cmb_definitions.setCurrentIndex(choices.matching_index)
+        # matching found
+        if choices.is_match_found:
+            # set the reassign radio button as checked
+            self.radio_btn_reassign.toggle()
+
+        if choices.default_definition is not None:
+            self.line_edit_default.setText(choices.default_definition)
+            self.def_default_id = choices.default_id
+            if not choices.is_match_found:
+                self.radio_btn_use_default.toggle()
+        else:
+            self.line_edit_default.setText("No Default Specified")
+            self.def_default_id = 0
+            # disable the radio button for default
+            self.radio_btn_use_default.setEnabled(False)
+            if not choices.is_match_found:
+                self.radio_btn_add_new.toggle()
+
+        # TODO: Continue here (ref getIDFromDefinitionTable function in mod modGeneralFunctions)
+        # frmAddMultiplier.txtID = defID
+        self.line_edit_id.setText(str(choices.next_id))
+        self.line_edit_def.setText(self.missing_field_value)
+        self.line_edit_description.setText(self.missing_field_value)
+        if self.is_multiplier:
+            self.line_edit_multiplier.setText("1")
 
     def accept(self, *args, **kwargs):
         # This function is called when the OK button of this dialog is clicked
         # ref to the code for the OK button of the frmAddNew
-        try:
-            conn = pyodbc.connect(MS_ACCESS_CONNECTION % self.graip_db_file)
-            cursor = conn.cursor()
-            if self.radio_btn_reassign.isChecked():
-                self.reassign_value = True
-                sql_insert = "INSERT INTO ValueReassigns (FromField, ToField, DefinitionID, DefinitionTable) " \
-                             "VALUES (?, ?, ?, ?)"
-                self.definition_id = self.definition_ids[self.cmb_definitions.currentIndex()]
-                data = (self.line_edit_def.text(), self.cmb_definitions.currentText(), self.definition_id,
-                        self.def_table_name)
-                self.action_taken_msg = "Reassigned value as {}".format(self.cmb_definitions.currentText())
-            elif self.radio_btn_use_default.isChecked():
-                self.use_default = True
-                self.definition_id = int(self.line_edit_id.text())
-                sql_insert = "INSERT INTO ValueReassigns (FromField, ToField, DefinitionID, DefinitionTable) " \
-                             "VALUES (?, ?, ?, ?)"
-                data = (self.line_edit_def.text(), self.line_edit_default.text(), self.definition_id,
-                        self.def_table_name)
-                self.action_taken_msg = "Used Default - {}".format(self.line_edit_default.text())
-            elif self.radio_btn_add_new.isChecked():
-                self.add_new = True
-                self.definition_id = int(self.line_edit_id.text())
-                if not self.is_multiplier:
-                    sql_insert = "INSERT INTO {} VALUES (?, ?, ?)".format(self.def_table_name)
-                    data = (self.definition_id, self.line_edit_def.text(), self.line_edit_description.text())
-                else:
-                    sql_insert = "INSERT INTO {} VALUES (?, ?, ?, ?)".format(self.def_table_name)
-                    data = (self.definition_id, self.line_edit_def.text(), self.line_edit_description.text(),
-                            self.line_edit_multiplier.text())
-                self.action_taken_msg = "Added to definition table as ID {}".format(self.definition_id)
-            cursor.execute(sql_insert, data)
-            conn.commit()
-
-            # print ("You clicked OK")
-            super(DefineValueDialog, self).accept()
-        except Exception:
-            raise
-        finally:
-            if conn:
-                conn.close()
+        # the changes are committed together with the shapefile being imported
+        cursor = self.db_session.cursor()
+        definitions_index = self.db_session.definitions
+        if self.radio_btn_reassign.isChecked():
+            self.reassign_value = True
+            self.definition_id = self.definition_ids[self.cmb_definitions.currentIndex()]
+            self.action_taken_msg = core.save_definition_action(cursor, core.ACTION_REASSIGN_VALUE,
+                                                                self.def_table_name, self.line_edit_def.text(),
+                                                                self.cmb_definitions.currentText(),
+                                                                self.definition_id,
+                                                                definitions_index=definitions_index)
+        elif self.radio_btn_use_default.isChecked():
+            self.use_default = True
+            self.definition_id = self.def_default_id
+            self.action_taken_msg = core.save_definition_action(cursor, core.ACTION_USE_DEFAULT,
+                                                                self.def_table_name, self.line_edit_def.text(),
+                                                                self.line_edit_default.text(),
+                                                                self.definition_id,
+                                                                definitions_index=definitions_index)
+        elif self.radio_btn_add_new.isChecked():
+            self.add_new = True
+            self.definition_id = int(self.line_edit_id.text())
+            multiplier = self.line_edit_multiplier.text() if self.is_multiplier else None
+            self.action_taken_msg = core.save_definition_action(cursor, core.ACTION_ADD_NEW,
+                                                                self.def_table_name, self.line_edit_def.text(),
+                                                                self.line_edit_def.text(),
+                                                                self.definition_id,
+                                                                description=self.line_edit_description.text(),
+                                                                multiplier=multiplier,
+                                                                definitions_index=definitions_index)
+
+        # print ("You clicked OK")
+        super(DefineValueDialog, self).accept()
 
     def reject(self, *args, **kwargs):
         self.is_cancel = True
         super(DefineValueDialog, self).reject()
 
 
+class ResolveValuesDialog(QDialog):
+    """
+    Shows the values of the shapefiles that are not in the definitions tables (import_engine.UnknownValue) in one
+    table so that all of them are defined before the shapefiles are imported. The chosen actions are kept in
+    decisions: (definitions table name, value) -> (action, definition, definition id, multiplier), where the
+    key is in lower case. Nothing is written to the database by this dialog.
+    """
+    is_cancel = False
+    ACTION_NAMES = {core.ACTION_REASSIGN_VALUE: "Reassign to existing value",
+                    core.ACTION_USE_DEFAULT: "Use default value",
+                    core.ACTION_ADD_NEW: "Add new entry"}
+
+    def __init__(self, unknown_values, db_session, parent=None):
+        super(ResolveValuesDialog, self).__init__(parent)
+        self.unknown_values = unknown_values
+        self.db_session = db_session
+        self.decisions = {}
+        # actions of the action combobox and definition choices (core.DefinitionChoices) of each row
+        self.row_actions = []
+        self.row_choices = []
+        v_main_layout = QVBoxLayout()
+        self.lbl_unknown_values = QLabel("The following values are not in the definitions tables. Select what "
+                                         "to do with each value before the shapefiles are imported.")
+        self.lbl_unknown_values.setWordWrap(True)
+        v_main_layout.addWidget(self.lbl_unknown_values)
+
+        table_headers = ['Value', 'Field', 'Definitions Table', 'Count', 'Action', 'Existing Value']
+        self.table_values = QTableWidget(len(unknown_values), len(table_headers))
+        self.table_values.setHorizontalHeaderLabels(table_headers)
+        self._initial_setup()
+        self.table_values.resizeColumnsToContents()
+        v_main_layout.addWidget(self.table_values)
+
+        # OK and Cancel buttons
+        self.buttons = QDialogButtonBox(
+            QDialogButtonBox.Ok | QDialogButtonBox.Cancel,
+            Qt.Horizontal, self)
+
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        v_main_layout.addWidget(self.buttons)
+
+        self.setWindowTitle("Define Values")
+        self.setWindowIcon(QIcon(GRAIP_ICON_FILE))
+        self.resize(800, 400)
+        self.setLayout(v_main_layout)
+        self.setModal(True)
+
+    def _initial_setup(self):
+        # use the session cursor to see definitions added earlier in the import that are not committed yet
+        cursor = self.db_session.cursor()
+        for row, unknown_value in enumerate(self.unknown_values):
+            choices = core.get_definition_choices(cursor, unknown_value.definition_table_name, unknown_value.value)
+            for col, text in enumerate((unknown_value.value, unknown_value.field_name,
+                                        unknown_value.definition_table_name, unknown_value.count)):
+                item = QTableWidgetItem(text if isinstance(text, basestring) else str(text))
+                item.setFlags(Qt.ItemIsEnabled)
+                self.table_values.setItem(row, col, item)
+
+            # same choice as the one preselected in the Define Value dialog
+            actions = [core.ACTION_REASSIGN_VALUE]
+            if choices.default_definition is not None:
+                actions.append(core.ACTION_USE_DEFAULT)
+            actions.append(core.ACTION_ADD_NEW)
+            if choices.is_match_found:
+                action = core.ACTION_REASSIGN_VALUE
+            elif choices.default_definition is not None:
+                action = core.ACTION_USE_DEFAULT
+            else:
+                action = core.ACTION_ADD_NEW
+            cmb_action = QComboBox()
+            cmb_action.addItems([self.ACTION_NAMES[row_action] for row_action in actions])
+            cmb_action.setCurrentIndex(actions.index(action))
+            self.table_values.setCellWidget(row, 4, cmb_action)
+
+            cmb_definitions = QComboBox()
+            cmb_definitions.addItems([definition if isinstance(definition, basestring) else str(definition)
+                                      for definition in choices.definitions])
+            cmb_definitions.setCurrentIndex(choices.matching_index)
+            # selecting an existing value reassigns the value to it
+            cmb_definitions.currentIndexChanged.connect(lambda index, cmb=cmb_action: cmb.setCurrentIndex(0))
+            self.table_values.setCellWidget(row, 5, cmb_definitions)
+
+            self.row_actions.append(actions)
+            self.row_choices.append(choices)
+
+    def accept(self, *args, **kwargs):
+        # definitions table name -> ID of the next new entry of the table
+        next_ids = {}
+        for row, unknown_value in enumerate(self.unknown_values):
+            choices = self.row_choices[row]
+            action = self.row_actions[row][self.table_values.cellWidget(row, 4).currentIndex()]
+            multiplier = None
+            if action == core.ACTION_REASSIGN_VALUE:
+                definition_index = self.table_values.cellWidget(row, 5).currentIndex()
+                if definition_index < 0:
+                    msg_box = GraipMessageBox()
+                    msg_box.setWindowTitle("Invalid Data")
+                    msg_box.setText("There is no existing value in the {} definitions table to reassign value "
+                                    "'{}' to.".format(unknown_value.definition_table_name, unknown_value.value))
+                    msg_box.exec_()
+                    return
+                definition = choices.definitions[definition_index]
+                definition_id = choices.definition_ids[definition_index]
+            elif action == core.ACTION_USE_DEFAULT:
+                definition = choices.default_definition
+                definition_id = choices.default_id
+            else:
+                table_key = unknown_value.definition_table_name.lower()
+                definition = unknown_value.value
+                definition_id = next_ids.get(table_key, choices.next_id)
+                next_ids[table_key] = definition_id + 1
+                if unknown_value.is_multiplier:
+                    multiplier = "1"
+            self.decisions[get_value_decision_key(unknown_value.definition_table_name, unknown_value.value)] = \
+                (action, definition, definition_id, multiplier)
+
+        super(ResolveValuesDialog, self).accept()
+
+    def reject(self, *args, **kwargs):
+        self.is_cancel = True
+        super(ResolveValuesDialog, self).reject()
+
+
 class FileDeleteMessageBox(GraipMessageBox):
     def __init__(self, file_to_delete, parent=None):
         super(FileDeleteMessageBox, self).__init__(parent)
@@ -841,14 +801,67 @@ class TableWidget(QWidget):
                     print("row:" + str(row) + " col:" + str(col) + " value:" + value)
 
 
+class ImportWorker(QThread):
+    """
+    Runs a function of the import engine (e.g. ImportEngine.import_drain_points) on a thread of its own so that
+    the wizard stays responsive. Progress, messages and Define Value prompts of the engine are passed to the
+    wizard with signals; for messages and prompts the worker waits until they have been answered. After the
+    thread has finished, result is the return value of the function or error the exception it raised.
+    While the function runs, only the worker can commit or roll back db_session.
+    """
+    progress_changed = Signal(object, int, int)
+    message_requested = Signal(object, object)
+    define_value_requested = Signal(object, object, object, bool)
+
+    def __init__(self, db_session, parent=None):
+        super(ImportWorker, self).__init__(parent)
+        self.db_session = db_session
+        self.function = None
+        self.args = ()
+        self.result = None
+        self.error = None
+        # (definition_id, action_taken_msg) or the exception raised by the Define Value prompt
+        self.define_value_answer = None
+
+    def run(self):
+        self.result = None
+        self.error = None
+        try:
+            with self.db_session.writer_thread():
+                self.result = self.function(*self.args)
+        except Exception as ex:
+            self.error = ex
+
+    # the following are the callbacks of the import engine, called on the worker thread
+
+    def report_progress(self, shp_file, count_done, count_total):
+        self.progress_changed.emit(shp_file, count_done, count_total)
+
+    def show_message(self, title, message):
+        self.message_requested.emit(title, message)
+
+    def define_value(self, missing_field_value, missing_field_name, def_table_name, is_multiplier):
+        self.define_value_answer = None
+        self.define_value_requested.emit(missing_field_value, missing_field_name, def_table_name, is_multiplier)
+        if isinstance(self.define_value_answer, Exception):
+            raise self.define_value_answer
+        return self.define_value_answer
+
+
 class ImportWizardPage(QWizardPage):
     def __init__(self, shp_type='DP', shp_file_index=0, shp_file="", shp_file_count=0, parent=None):
         super(ImportWizardPage, self).__init__(parent=parent)
         self.wizard = parent
+        self.shp_type = shp_type
         self.file_index = shp_file_index
         self.working_directory = None
         self.lst_widget_dp_shp_files = None
         self.no_match_use_default = None
+        # attribute field names of the shapefile being imported
+        self.shp_file_attribute_names = []
+        # engine and worker thread of the import of the shapefile
+        self.import_engine = None
+        self.import_worker = None
         self.form_layout = QFormLayout()
         self.msg_label = QLabel()
         self.msg_label.setText("Match a source field from the input file to the appropriate target field "
@@ -933,6 +946,10 @@ class ImportWizardPage(QWizardPage):
         self.progress_bar.setMinimum(0)
         self.progress_bar.setValue(0)
         v_layout.addWidget(self.progress_bar)
+        self.btn_cancel_import = QPushButton("Cancel Import")
+        self.btn_cancel_import.setEnabled(False)
+        self.btn_cancel_import.clicked.connect(self.cancel_import)
+        v_layout.addWidget(self.btn_cancel_import, alignment=Qt.AlignRight)
         self.group_box_import_progress.setLayout(v_layout)
 
         self.form_layout.addRow(self.group_box_import_progress)
@@ -944,57 +961,17 @@ class ImportWizardPage(QWizardPage):
 
     def populate_matching_fields_table(self):
         table_headers = ['Target Field', 'Matching Source Field']
-        self.no_match_use_default = '<No Match Use Default>'
-        graip_db_file = self.wizard.line_edit_mdb_file.text()
-        conn = pyodbc.connect(MS_ACCESS_CONNECTION % graip_db_file)
-        cursor = conn.cursor()
+        self.no_match_use_default = core.NO_MATCH_USE_DEFAULT
         dp_shapefile = self.line_edit_imported_file.text()
-        shp_file_attribute_names = get_shapefile_attribute_column_names(dp_shapefile)
-        shp_file_attribute_names = [self.no_match_use_default] + shp_file_attribute_names
+        self.shp_file_attribute_names = core.get_shapefile_attribute_column_names(dp_shapefile)
+        shp_file_attribute_names = [self.no_match_use_default] + self.shp_file_attribute_names
         drain_type_name = self.dp_type_combo_box.currentText()
         drain_type_name = self.dp_type_combo_box.itemText(self.dp_type_combo_box.currentIndex())
-        drain_type_def_row = cursor.execute("SELECT DrainTypeID FROM DrainTypeDefinitions "
-                                            "WHERE DrainTypeName = ?", drain_type_name).fetchone()
-
-        # find the target field names in the database corresponding to the shapefile being imported
-        field_name_rows = cursor.execute("SELECT DBField FROM FieldMatches "
-                                         "WHERE AttTableID = ?", drain_type_def_row.DrainTypeID).fetchall()
-        target_field_col_data = [row.DBField for row in field_name_rows]
-
-        source_field_col_data = []
-        for target_fld in target_field_col_data:
-            source_field_row = cursor.execute("SELECT DBFField FROM FieldMatches "
-                                              "WHERE DBField = ?", target_fld).fetchone()
-            if source_field_row:
-                # check if the DBFField value matches (if at least first 3 chars need to match)
-                # with any of the values in the combobox used for the 2nd column of the table
-                found_match = False
-                for shp_att_name in shp_file_attribute_names:
-                    if shp_att_name.lower() == source_field_row.DBFField.lower():
-                        if source_field_row.DBFField not in source_field_col_data:
-                            source_field_col_data.append(source_field_row.DBFField)
-                        else:
-                            source_field_col_data.append(self.no_match_use_default)
-                        found_match = True
-                        break
-
-                if not found_match:
-                    matching_field = None
-                    for shp_att_name in shp_file_attribute_names:
-                        if len(shp_att_name) > 2 and len(source_field_row.DBFField) > 2:
-                            # match first 3 characters
-                            match_count = 0
-                            for i in range(len(shp_att_name)):
-                                if shp_att_name[0:i+1].lower() == source_field_row.DBFField[0:i+1].lower():
-                                    match_count += 1
-                            if match_count > 2:
-                                matching_field = shp_att_name
-                                break
-
-                    if matching_field is not None and matching_field not in source_field_col_data:
-                        source_field_col_data.append(matching_field)
-                    else:
-                        source_field_col_data.append(self.no_match_use_default)
+        # use the field matches last used for a shapefile with the same fields if there is a profile for it
+        field_matches = mapping_profiles.get_field_matches(self.wizard.db_session, 'DP', drain_type_name,
+                                                           self.shp_file_attribute_names)
+        target_field_col_data = [target_fld for target_fld, _ in field_matches]
+        source_field_col_data = [src_fld for _, src_fld in field_matches]
 
         target_source_combined = zip(target_field_col_data, source_field_col_data)
         table_data = [[item[0], item[1]] for item in target_source_combined]
@@ -1007,45 +984,226 @@ class ImportWizardPage(QWizardPage):
             self.field_match_table_wizard = TableWidget(table_data=table_data, table_header=table_headers,
                                                         cmb_data=cmb_data)
         self.v_set_fields_layout.addWidget(self.field_match_table_wizard)
-        conn.close()
+
+    def save_mapping_profile(self, field_matches):
+        # keep the field matches used for the shapefile for the next shapefile with the same fields
+        drain_type_name = self.dp_type_combo_box.currentText() if self.shp_type == "DP" else None
+        mapping_profiles.save_profile(self.wizard.db_session, self.shp_type, drain_type_name,
+                                      self.shp_file_attribute_names, field_matches)
+
+    def get_field_matches(self):
+        # read the (target field, source field) pairs from the field match table
+        fld_match_table_model = self.field_match_table_wizard.table_model
+        field_matches = []
+        for row in range(fld_match_table_model.rowCount()):
+            target_field_name = str(fld_match_table_model.index(row, 0).data())
+            src_field_name = str(fld_match_table_model.index(row, 1).data())
+            field_matches.append((target_field_name, src_field_name))
+        return field_matches
+
+    def create_import_engine(self):
+        # the engine runs on the import worker thread and reaches the wizard through the signals of the worker
+        self.import_worker = ImportWorker(self.wizard.db_session)
+        self.import_worker.progress_changed.connect(self.update_import_progress)
+        self.import_worker.message_requested.connect(self.show_import_message, Qt.BlockingQueuedConnection)
+        self.import_worker.define_value_requested.connect(self.answer_define_value, Qt.BlockingQueuedConnection)
+        self.import_engine = import_engine.ImportEngine(db_session=self.wizard.db_session,
+                                                        dp_log_file=self.wizard.dp_log_file,
+                                                        rd_log_file=self.wizard.rd_log_file,
+                                                        is_uninterrupted=self.wizard.is_uninterrupted,
+                                                        progress_callback=self.import_worker.report_progress,
+                                                        message_callback=self.import_worker.show_message,
+                                                        define_value_callback=self.import_worker.define_value)
+        return self.import_engine
+
+    def run_import(self, function, *args):
+        """
+        Runs function (a method of the import engine) on the import worker thread and returns its return value.
+        The wizard handles events while waiting; only the Cancel Import button can be used so that nothing on
+        the page (e.g., adding a road network) commits the session while the worker writes to it.
+        """
+        self.import_worker.function = function
+        self.import_worker.args = args
+        event_loop = QEventLoop()
+        self.import_worker.finished.connect(event_loop.quit)
+        self.set_page_enabled(False)
+        self.btn_cancel_import.setEnabled(True)
+        try:
+            self.import_worker.start()
+            event_loop.exec_()
+            self.import_worker.wait()
+        finally:
+            self.import_worker.finished.disconnect(event_loop.quit)
+            self.btn_cancel_import.setEnabled(False)
+            self.set_page_enabled(True)
+        if self.import_worker.error is not None:
+            raise self.import_worker.error
+        return self.import_worker.result
+
+    def cancel_import(self):
+        # the import stops at the next feature and the page rolls back the shapefile
+        if self.import_engine is not None:
+            self.btn_cancel_import.setEnabled(False)
+            self.import_engine.cancel()
+
+    def set_page_enabled(self, is_enabled):
+        # the shapefile, drain type, road network and field matches of the page and the wizard buttons
+        self.group_box_imported_file.setEnabled(is_enabled)
+        self.group_box_set_field_names.setEnabled(is_enabled)
+        wizard = self.wizard.wizard
+        for button_type in (QWizard.BackButton, QWizard.NextButton, QWizard.FinishButton, QWizard.CancelButton):
+            wizard.button(button_type).setEnabled(is_enabled)
+
+    def update_import_progress(self, shp_file, count_done, count_total):
+        self.progress_bar.setMaximum(count_total)
+        self.progress_bar.setValue(count_done)
+
+    def answer_define_value(self, missing_field_value, missing_field_name, def_table_name, is_multiplier):
+        # runs on the GUI thread while the worker waits for the answer
+        try:
+            self.import_worker.define_value_answer = self.show_define_value_dialog(missing_field_value,
+                                                                                   missing_field_name,
+                                                                                   def_table_name, is_multiplier)
+        except Exception as ex:
+            self.import_worker.define_value_answer = ex
+
+    def show_import_message(self, title, message):
+        msg_box = GraipMessageBox()
+        msg_box.setIcon(QMessageBox.Information)
+        msg_box.setText(message)
+        msg_box.setWindowTitle(title)
+        msg_box.exec_()
+
+    def import_shapefile(self, engine, spec):
+        """
+        Imports the shapefile of spec unless it was imported the same way before and has not changed since, and
+        returns the first GRAIPDID/GRAIPRID of its records. A shapefile imported before is imported again
+        incrementally keeping the IDs of its records.
+        """
+        db_session = self.wizard.db_session
+        checkpoint = self.wizard.checkpoints[(spec.shp_type, spec.shp_file)]
+        import_call = checkpoints.get_import_call(engine, checkpoint, spec, is_dp_changed=self.wizard.is_dp_changed)
+        if import_call is None:
+            self.progress_bar.setMaximum(1)
+            self.progress_bar.setValue(1)
+            return checkpoint.first_id
+
+        if spec.shp_type == 'DP':
+            self.wizard.is_dp_changed = True
+        self.define_unknown_values(engine, spec)
+        checkpoints.start_import(db_session, checkpoint)
+        import_function, import_args = import_call
+        self.run_import(import_function, *import_args)
+        first_id, last_id = engine.get_imported_id_range(spec)
+        checkpoints.commit_import(db_session, checkpoint, spec, first_id, last_id)
+        return first_id
+
+    def define_unknown_values(self, engine, spec):
+        """
+        In step by step mode, scans the shapefiles for values not in the definitions tables and asks for all of
+        them at once so that the imports do not stop for each value. The first shapefile imported by the run
+        is scanned together with all the selected shapefiles still to be imported, using the drain type, road
+        network and field matches the wizard chooses for them by default. A later shapefile is scanned again
+        only if other field matches or another drain type were chosen for it on its page.
+        """
+        if self.wizard.is_uninterrupted:
+            return
+        scanned_spec = None
+        if self.wizard.scanned_specs is not None:
+            scanned_spec = self.wizard.scanned_specs.get((spec.shp_type, spec.shp_file), None)
+        if scanned_spec is not None and scanned_spec.field_matches == spec.field_matches and \
+                scanned_spec.drain_type_name == spec.drain_type_name:
+            return
+
+        if self.wizard.scanned_specs is None:
+            specs = self.get_specs_to_import(engine, spec)
+        else:
+            specs = [spec]
+        unknown_values = [unknown_value for unknown_value in self.run_import(engine.scan_unknown_values, specs)
+                          if get_value_decision_key(unknown_value.definition_table_name, unknown_value.value)
+                          not in self.wizard.value_decisions]
+        if unknown_values:
+            resolve_values_dlg = ResolveValuesDialog(unknown_values=unknown_values,
+                                                     db_session=self.wizard.db_session)
+            resolve_values_dlg.show()
+            resolve_values_dlg.exec_()
+            if resolve_values_dlg.is_cancel:
+                raise Exception("Aborting processing of this shapefile")
+            self.wizard.value_decisions.update(resolve_values_dlg.decisions)
+        if self.wizard.scanned_specs is None:
+            self.wizard.scanned_specs = {}
+        for scanned_spec in specs:
+            self.wizard.scanned_specs[(scanned_spec.shp_type, scanned_spec.shp_file)] = scanned_spec
+
+    def get_specs_to_import(self, engine, spec):
+        # spec and the specs the pages of the shapefiles after it start with, for the shapefiles the run imports
+        db_session = self.wizard.db_session
+        shp_files = [('DP', shp_file) for shp_file in get_items_from_list_box(self.wizard.lst_widget_dp_shp_files)]
+        shp_files += [('RD', shp_file) for shp_file in get_items_from_list_box(self.wizard.lst_widget_rd_shp_files)]
+        shp_files = shp_files[shp_files.index((spec.shp_type, spec.shp_file)) + 1:]
+        specs = [spec]
+        is_dp_changed = self.wizard.is_dp_changed
+        for shp_type, shp_file in shp_files:
+            other_spec = graip_preprocess.get_import_spec(db_session, shp_type, shp_file, {})[0]
+            checkpoint = self.wizard.checkpoints[(shp_type, shp_file)]
+            if checkpoints.get_import_call(engine, checkpoint, other_spec, is_dp_changed=is_dp_changed) is None:
+                continue
+            is_dp_changed = is_dp_changed or shp_type == 'DP'
+            specs.append(other_spec)
+        return specs
+
+    def show_define_value_dialog(self, missing_field_value, missing_field_name, def_table_name, is_multiplier):
+        # the first time a value defined in the Define Values dialog is found, the action chosen for it is
+        # saved and logged as if chosen in the Define Value dialog. The action is kept for importing the
+        # shapefile again if its import is rolled back.
+        decision = self.wizard.value_decisions.get(get_value_decision_key(def_table_name, missing_field_value), None)
+        if decision is not None:
+            action, definition, definition_id, multiplier = decision
+            action_taken_msg = core.save_definition_action(self.wizard.db_session.cursor(), action, def_table_name,
+                                                           missing_field_value, definition, definition_id,
+                                                           description=missing_field_value, multiplier=multiplier,
+                                                           definitions_index=self.wizard.db_session.definitions)
+            return definition_id, action_taken_msg
+
+        define_value_dlg = DefineValueDialog(missing_field_value=missing_field_value,
+                                             missing_field_name=missing_field_name,
+                                             db_session=self.wizard.db_session,
+                                             def_table_name=def_table_name, is_multiplier=is_multiplier)
+        define_value_dlg.show()
+        define_value_dlg.exec_()
+        if define_value_dlg.is_cancel:
+            raise Exception("Aborting processing of this shapefile")
+        return define_value_dlg.definition_id, define_value_dlg.action_taken_msg
 
     def show_add_network_dlg(self):
-        graip_db_file = self.wizard.line_edit_mdb_file.text()
-        conn = pyodbc.connect(MS_ACCESS_CONNECTION % graip_db_file)
-        cursor = conn.cursor()
-        dlg = AddRoadNetworkDefinitionsDialog(graip_db_file)
+        db_session = self.wizard.db_session
+        dlg = AddRoadNetworkDefinitionsDialog(db_session)
         dlg.show()
         dlg.exec_()
         if dlg.result() == QDialog.Accepted:
+            cursor = db_session.cursor()
             self.rd_network_combo_box.addItem(dlg.rd_network_name)
             sql_insert = "INSERT INTO RoadNetworkDefinitions(RoadNetwork, BaseRate, Description) VALUES (?, ?, ?)"
             data = (dlg.rd_network_name, dlg.rd_base_rate, dlg.rd_description)
             cursor.execute(sql_insert, data)
-            conn.commit()
+            db_session.commit()
             # find the number of records
             network_def_row = cursor.execute("SELECT COUNT(*) AS def_count FROM RoadNetworkDefinitions").fetchone()
             # set the network combobox to the just entered new definition
             index = network_def_row.def_count - 1
             self.rd_network_combo_box.setCurrentIndex(index)
-            conn.close()
 
     def update_rd_network_gui_elements(self):
-        graip_db_file = self.wizard.line_edit_mdb_file.text()
-        conn = pyodbc.connect(MS_ACCESS_CONNECTION % graip_db_file)
-        cursor = conn.cursor()
         network_combo_index = self.rd_network_combo_box.currentIndex()
         road_network_id = network_combo_index + 1
-        rd_network_def_row = cursor.execute("SELECT * FROM RoadNetworkDefinitions WHERE RoadNetworkID=?",
-                                            road_network_id).fetchone()
+        with self.wizard.db_session.read_cursor() as cursor:
+            rd_network_def_row = cursor.execute("SELECT * FROM RoadNetworkDefinitions WHERE RoadNetworkID=?",
+                                                road_network_id).fetchone()
         if rd_network_def_row is not None:
             self.rd_ber_line_edit.setText(str(rd_network_def_row.BaseRate))
             self.rd_des_line_edit.setText(rd_network_def_row.Description)
-        conn.close()
 
     def delete_rn_def_record(self):
-        graip_db_file = self.wizard.line_edit_mdb_file.text()
-        conn = pyodbc.connect(MS_ACCESS_CONNECTION % graip_db_file)
-        cursor = conn.cursor()
         msg_box = GraipMessageBox()
         msg_box.setWindowTitle("Not allowed")
         msg_box.setText("Network 'Default' can't be deleted")
@@ -1053,9 +1211,10 @@ class ImportWizardPage(QWizardPage):
         if selected_network_name.lower() == 'default':
             msg_box.exec_()
         else:
-            cursor.execute("DELETE FROM RoadNetworkDefinitions WHERE RoadNetwork=?", selected_network_name)
-            conn.commit()
-            conn.close()
+            db_session = self.wizard.db_session
+            db_session.cursor().execute("DELETE FROM RoadNetworkDefinitions WHERE RoadNetwork=?",
+                                        selected_network_name)
+            db_session.commit()
             current_index = self.rd_network_combo_box.currentIndex()
             self.rd_network_combo_box.removeItem(current_index)
 
@@ -1067,57 +1226,17 @@ def delete_shapefile(shp_file_to_delete):
         file_delete_msgbox = FileDeleteMessageBox(file_name)
         user_input = file_delete_msgbox.exec_()
         if user_input == QMessageBox.Yes:
-            gdal_driver = ogr.GetDriverByName(GDALFileDriver.ShapeFile())
+            gdal_driver = ogr.GetDriverByName(core.GDALFileDriver.ShapeFile())
             gdal_driver.DeleteDataSource(shp_file_to_delete)
 
 
-def create_log_file(graip_db_file, log_file, log_type):
-    with open(log_file, 'w') as file_obj:
-        file_obj.write("GRAIP Database File:{}".format(graip_db_file) + '\n')
-        file_obj.write(time.strftime("%m-%d-%Y %H:%M:%S") + '\n')
-        if log_type == 'DP':
-            file_obj.write("GRAIPDID, Drain Type, Error Message, Action Taken \n")
-        else:
-            file_obj.write("GRAIPDID, Road Type, Error Message, Action Taken \n")
-
-
-def clear_data_tables(graip_db_file):
-    conn = pyodbc.connect(MS_ACCESS_CONNECTION % graip_db_file)
-    cursor = conn.cursor()
-    cursor.execute("DELETE * FROM DrainPoints")
-    cursor.execute("DELETE * FROM RoadLines")
-    drain_type_def_rows = cursor.execute("SELECT TableName FROM DrainTypeDefinitions").fetchall()
-    for row in drain_type_def_rows:
-        cursor.execute("DELETE * FROM {}".format(row.TableName))
-    conn.commit()
-    conn.close()
-
-
-def get_shapefile_attribute_column_names(shp_file):
-    gdal_driver = ogr.GetDriverByName(GDALFileDriver.ShapeFile())
-    data_source = gdal_driver.Open(shp_file, 1)
-    layer = data_source.GetLayer(0)
-    layer_definition = layer.GetLayerDefn()
-
-    attribute_names = []
-    for i in range(layer_definition.GetFieldCount()):
-        att_name = layer_definition.GetFieldDefn(i).GetName()
-        if att_name != 'FID' and att_name != 'Shape':
-            attribute_names.append(att_name)
-
-    data_source.Destroy()
-    return attribute_names
-
-
-def populate_drain_type_combobox(graip_db_file, dp_type_combo_box):
-    conn = pyodbc.connect(MS_ACCESS_CONNECTION % graip_db_file)
-    cursor = conn.cursor()
-    drain_point_def_rows = cursor.execute("SELECT DrainTypeName FROM DrainTypeDefinitions").fetchall()
+def populate_drain_type_combobox(db_session, dp_type_combo_box):
+    with db_session.read_cursor() as cursor:
+        drain_point_def_rows = cursor.execute("SELECT DrainTypeName FROM DrainTypeDefinitions").fetchall()
     drain_point_types = [row.DrainTypeName for row in drain_point_def_rows]
     dp_type_combo_box.blockSignals(True)
     dp_type_combo_box.addItems(drain_point_types)
     dp_type_combo_box.blockSignals(False)
-    conn.close()
     return dp_type_combo_box
 
 
@@ -1125,135 +1244,15 @@ def set_index_dp_type_combo_box(dp_shp_file, dp_type_combo_box):
     dp_shp_file_name = os.path.basename(dp_shp_file)
     dp_type_combo_box.blockSignals(True)
 
-    matching_index = 0
-    for index in range(dp_type_combo_box.count()):
-        drain_type_name = dp_type_combo_box.itemText(index)
-        no_char_match = 0
-        for i in range(1, len(drain_type_name)):
-            if drain_type_name[0:i].lower() == dp_shp_file_name[0:i].lower():
-                no_char_match += 1
-
-        if no_char_match > 2:
-            dp_type_combo_box.setCurrentIndex(index)
-            dp_type_combo_box.blockSignals(False)
-            return dp_type_combo_box
-        if no_char_match == 1:
-            matching_index = index
-
+    drain_type_names = [dp_type_combo_box.itemText(index) for index in range(dp_type_combo_box.count())]
+    matching_index = matching.match_drain_type(dp_shp_file_name, drain_type_names)
     dp_type_combo_box.setCurrentIndex(matching_index)
     dp_type_combo_box.blockSignals(False)
     return dp_type_combo_box
 
 
-def add_entry_to_error_table(graip_db_file, err_table_name, graipid, ftype, err_msg, action_taken):
-    if err_table_name not in (DP_ERROR_LOG_TABLE_NAME, RD_ERROR_LOG_TABLE_NAME):
-        raise Exception("{} is not a valid table name for logging error.".format(err_table_name))
-
-    conn = pyodbc.connect(MS_ACCESS_CONNECTION % graip_db_file)
-    cursor = conn.cursor()
-    if err_table_name == DP_ERROR_LOG_TABLE_NAME:
-        sql_insert = "INSERT INTO {} (GRAIPDID, DrainType, ErrorMessage, ActionTaken) VALUES(?, ?, ?, ?)"
-        sql_insert = sql_insert.format(DP_ERROR_LOG_TABLE_NAME)
-    else:
-        sql_insert = "INSERT INTO {} (GRAIPRID, RoadType, ErrorMessage, ActionTaken) VALUES(?, ?, ?, ?)"
-        sql_insert = sql_insert.format(RD_ERROR_LOG_TABLE_NAME)
-
-    data = (graipid, ftype, err_msg, action_taken)
-    cursor.execute(sql_insert, data)
-    conn.commit()
-    conn.close()
-
-
-def add_entry_to_log_file(log_file, graipid, ftype, message, action_taken):
-    with open(log_file, 'a') as file_obj:
-        text_to_write = "{}, {}, {}, {} \n"
-        text_to_write = text_to_write.format(graipid, ftype, message, action_taken)
-        file_obj.write(text_to_write)
-
-
-def is_data_type_match(graip_db_file, table_name, col_name, data_value):
-    conn = pyodbc.connect(MS_ACCESS_CONNECTION % graip_db_file)
-    cursor = conn.cursor()
-    for row in cursor.columns(table=table_name):
-        if row.column_name == col_name:
-            if row.data_type in (pyodbc.SQL_CHAR, pyodbc.SQL_VARCHAR, pyodbc.SQL_WCHAR, pyodbc.SQL_WLONGVARCHAR,
-                                 pyodbc.SQL_WVARCHAR, pyodbc.SQL_LONGVARCHAR):
-                return type(data_value) is str
-            elif row.data_type in (pyodbc.SQL_TINYINT, pyodbc.SQL_SMALLINT, pyodbc.SQL_INTEGER, pyodbc.SQL_BIGINT,
-                                   pyodbc.SQL_NUMERIC):
-                if type(data_value) is not int and type(data_value) is not float:
-                    try:
-                        int(data_value)
-                        return True
-                    except:
-                        try:
-                            float(data_value)
-                            return True
-                        except:
-                            return False
-                else:
-                    return True
-
-            elif row.data_type in (pyodbc.SQL_DECIMAL, pyodbc.SQL_FLOAT, pyodbc.SQL_DOUBLE, pyodbc.SQL_REAL):
-                return type(data_value) is float or type(data_value) is int
-            elif row.data_type in (pyodbc.SQL_TYPE_DATE, pyodbc.SQL_TYPE_TIMESTAMP):
-                if type(data_value) is datetime:
-                    return True
-                if isinstance(data_value, basestring):
-                    if len(data_value) < 8:
-                        return False
-                    else:
-                        # here we are checking only 2 date format (e.g., 01/12/2016 and 2016/12/01)
-                        try:
-                            datetime.strptime(data_value, "%m/%d/%Y")
-                            return True
-                        except:
-                            try:
-                                datetime.strptime(data_value, "%Y/%m/%d")
-                                return True
-                            except:
-                                return False
-
-                return False
-
-    conn.close()
-    return False
-
-
-def get_drain_id(time_in, date_in, vehicle_id):
-    # remove am/pm
-    if isinstance(time_in, basestring):
-        time = time_in[:-2]
-        time_hour, time_min, time_sec = time.split(":")
-        time_hour = int(time_hour)
-        time_min = int(time_min)
-        time_sec = int(time_sec)
-        if time_sec > 30:
-            time_min += 1
-        if "p" in time_in and time_hour != 12:
-            time_hour += 12
-
-        if "a" in time_in and time_hour == 12:
-            time_hour = 0
-        time_24_format = (time_hour * 100) + time_min
-    else:
-        time_24_format = time_in
-    dt_obj = date_in
-    # get 2 digit year
-    year = int(str(dt_obj.year)[2:])
-    drain_id = (year * 1000000000) + (dt_obj.month * 10000000) + (dt_obj.day * 100000) + \
-               (time_24_format * 10) + vehicle_id
-    return drain_id
-
-
-def get_table_column_data_type(graip_db_file, table_name, col_name):
-    conn = pyodbc.connect(MS_ACCESS_CONNECTION % graip_db_file)
-    cursor = conn.cursor()
-    for row in cursor.columns(table=table_name):
-        if row.column_name == col_name:
-            return row.data_type
-
-    return None
+def get_value_decision_key(def_table_name, value):
+    return def_table_name.lower(), value.lower() if isinstance(value, basestring) else value
 
 
 def get_items_from_list_box(list_box):
@@ -1269,9 +1268,13 @@ def handle_exception(exception):
     msg_box.setWindowTitle("Error")
     msg_box.setIcon(QMessageBox.Critical)
     err_message = exception.message
-    if len(err_message) == 0:
-        err_message = sys.exc_info()[1][1]
-    else:
-        err_message += "\n" + sys.exc_info()[1][1]
+    # database errors from pyodbc have the driver message as the 2nd argument
+    if len(exception.args) > 1:
+        if len(err_message) == 0:
+            err_message = str(exception.args[1])
+        else:
+            err_message += "\n" + str(exception.args[1])
+    elif len(err_message) == 0:
+        err_message = str(exception)
     msg_box.setText(err_message)
     msg_box.exec_()
\ No newline at end of file